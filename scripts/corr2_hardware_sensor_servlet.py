@@ -22,28 +22,86 @@ import corr2
 from corr2 import sensors
 from corr2.sensors import Corr2Sensor
 from corr2 import corr2LogHandlers
-
-#This variable exists because of problems with kcs - the rack location sensor needs to be transmitted a few times
-reportRackLocation = 0
-
-#This variable is global, because the _sensor_cb_hw() function does hot have a great mechanism for passing properties 
-#between itself and other KCS functions. I do not want to look further into this as we want to draw a line under the 
-#SKARAB work.
-#
-#This variable determines if the sensor loop is paused or not. A paused sensor loop will still run every 30 seconds,
-#it will just not send any messages to the SKARAB. Set to paused by default so they can be safetly started on mass.
-sensor_loop_running = 0
+from corr2 import sensor_scheduler
 
 #Number of seconds between sensor loop polls
 sensorPollInterval_s = 30
 
+#Number of SKARAB slots the location-based staggering spreads boards over
+staggerSlots = 250
+
+
+class HardwareBoard(object):
+    """
+    One SKARAB polled by the servlet, and its sensors.
+    """
+    def __init__(self, hostname, prefix=''):
+        """
+        :param hostname: the SKARAB hostname or IP address
+        :param prefix: prefix for this board's sensor names, empty for none
+        :return:
+        """
+        self.host = casperfpga.CasperFpga(hostname)
+        self.prefix = prefix
+        self.ip_address = socket.gethostbyname(self.host.transport.host)
+        self.rack_location_tuple = get_physical_location(self.ip_address)
+        self.sensors = {}
+        self.discovered = False
+        # problems with kcs - the rack location sensor needs to be
+        # transmitted a few times
+        self.report_rack_location = 0
+
+    def sensor_name(self, name):
+        if not self.prefix:
+            return name
+        return '{}.{}'.format(self.prefix, name)
+
+    def stagger_index(self):
+        """
+        Index the SKARAB by location, so that boards in the same rack
+        (likely the same instrument) get spread furthest apart. The rack
+        index is the fastest-changing one, for the same reason. The logic
+        is similar to that in get_physical_location().
+        """
+        octets = self.ip_address.split('.')
+        leafIndex = int(octets[2]) - 5 # Leaf no 5 is the first leaf the SKARABs are connected to
+        switchPortIndex = int(octets[3]) // 4
+        return switchPortIndex * 18 + leafIndex #18 leafs with SKARABs on them
+
+
+def stagger_offsets(boards, period, policy='location'):
+    """
+    Work out when in each poll period each board is read, so that the
+    CPU and network load are spread over the period rather than all the
+    boards being read at once.
+    :param boards: a list of HardwareBoards
+    :param period: the poll period, in seconds
+    :param policy: 'location' to give every SKARAB site-wide a fixed slot
+    from its rack location, which also staggers boards polled by separate
+    servlets; 'even' to spread this servlet's boards evenly over the
+    period
+    :return: a list of offsets into the period, one per board
+    """
+    if policy == 'location':
+        return [period / float(staggerSlots) *
+                (board.stagger_index() % staggerSlots) for board in boards]
+    elif policy == 'even':
+        order = sorted(range(len(boards)),
+                       key=lambda ctr: boards[ctr].stagger_index())
+        offsets = [0.0] * len(boards)
+        for rank, ctr in enumerate(order):
+            offsets[ctr] = period * rank / float(len(boards))
+        return offsets
+    raise ValueError('Unknown stagger policy {}'.format(policy))
+
+
 class Corr2HardwareSensorServer(katcp.DeviceServer):
 
     # Interface version information.
-    VERSION_INFO = ('corr2 hardware sensor servlet', 0, 1)
+    VERSION_INFO = ('corr2 hardware sensor servlet', 0, 2)
 
     # Device server build / instance information.
-    BUILD_INFO = ('corr2', 0, 1, 'alpha')
+    BUILD_INFO = ('corr2', 0, 2, 'alpha')
 
     # @profile
     def __init__(self, *args, **kwargs):
@@ -51,8 +109,18 @@ class Corr2HardwareSensorServer(katcp.DeviceServer):
         super(Corr2HardwareSensorServer, self).__init__(*args)
         if use_tornado:
             self.set_concurrency_options(thread_safe=False, handler_thread=False)
-            self.executor = futures.ThreadPoolExecutor(max_workers=1)
-            self.host = casperfpga.CasperFpga(kwargs["skarab_host"])
+            hostnames = kwargs['skarab_hosts']
+            # one board keeps the old, unprefixed sensor names
+            prefix = kwargs.get('prefix') or len(hostnames) > 1
+            self.boards = [
+                HardwareBoard(hostname,
+                              hostname.replace('_', '-') if prefix else '')
+                for hostname in hostnames]
+            # a bounded pool shared by all the boards
+            self.executor = futures.ThreadPoolExecutor(
+                max_workers=min(kwargs.get('workers', 16), len(self.boards)))
+            self.stagger = kwargs.get('stagger', 'location')
+            self.scheduler = None
             self._created = False
             self._initialised = False
 
@@ -64,8 +132,12 @@ class Corr2HardwareSensorServer(katcp.DeviceServer):
             # set timeout for the sensor reads
             self.timeout = kwargs['timeout']
 
-            start_time = str(time.time())
-            self.log_filename = '{}_hardware_sensor_servlet.log'.format(kwargs['skarab_host'])
+            #A paused sensor loop will still run every poll interval, it will just not send any
+            #messages to the SKARABs. Set to paused by default so they can be safely started en masse.
+            self.sensor_loop_running = 0
+
+            self.servlet_name = kwargs.get('name') or hostnames[0]
+            self.log_filename = '{}_hardware_sensor_servlet.log'.format(self.servlet_name)
             self.log_level = kwargs.pop('log_level', logging.WARN)
 
             #I am not sure if this function needs to be here, it is called in the corr2_sensor_sevlet so I put it here 
@@ -75,106 +147,103 @@ class Corr2HardwareSensorServer(katcp.DeviceServer):
                                             self.log_level)
 
             self.sensor_manager = corr2.sensors.SensorManager(self, instrument=None,
+                name=self.servlet_name,
                 mass_inform_func=self.mass_inform,
                 log_filename=self.log_filename,
                 log_file_dir=self.log_file_dir,
                 logLevel=self.log_level)
+            self.sensor_manager.sensors_clear()
 
-            self.rack_location_tuple = get_physical_location(socket.gethostbyname(self.host.transport.host))
-            self.sensors = {}
+            for board in self.boards:
+                self._create_board_sensors(board)
+            self._discover_sensors()
 
-            sensor_manager = self.sensor_manager
-            sensor_manager.sensors_clear()
+            self._logger.info('{} init function complete for {} boards.'.format(
+                self.servlet_name, len(self.boards)))
 
-            sensordict = dict()
-
-            #This initial get_sensor_data() call needs to succeed as it populates the sensor dictionary. As such it is called until success. 
-            retrievedSensors = False
-            while(retrievedSensors == False):
-                try:
-                    sensordict = self.host.transport.get_sensor_data(
-                        timeout=self.timeout)
-                    retrievedSensors = True
-                except Exception as e:
-                    self._logger.error(
-                        'Error retrieving {}s sensors on startup - {}. Waiting ten seconds and trying again'.format(self.host, e.message))
-                    time.sleep(10)
-
-            for key, value in sensordict.iteritems():
-                try:
-                    if isinstance(value[0], float):
-                        sensortype = Corr2Sensor.float
-                    elif isinstance(value[0], int):
-                        sensortype = Corr2Sensor.integer
-                    elif isinstance(value[0], bool):
-                        sensortype = Corr2Sensor.boolean
-                    elif isinstance(value[0], str):
-                        sensortype = Corr2Sensor.string
-                    else:
-                        raise RuntimeError("Unknown datatype!")
-                    self.sensors[key] = sensor_manager.do_sensor(
-                        sensortype, '{}'.format(key),
-                        'a generic HW sensor', unit=value[1])
-                except Exception as e:
-                    self.sensor_manager.logger.error(
-                        'Unable to add sensor {}-{}. Skipping.'.format(key, value))
-                    raise e
-            self.sensors['location'] = sensor_manager.do_sensor(
-                    Corr2Sensor.string,'location',
-                    'Rack location of this SKARAB',
-                    initial_status=Corr2Sensor.NOMINAL,unit='unitless')
-            self.sensors['location'].set_value(self.rack_location_tuple[0])
-
-            self.sensors['boot_image'] = sensor_manager.do_sensor(
-                    Corr2Sensor.string,'boot-image',
-                    'Currently running FPGA image',
-                    initial_status=Corr2Sensor.NOMINAL,unit='unitless')
-
-            self.sensors['device_status'] = sensor_manager.do_sensor(
-                    Corr2Sensor.device_status,'device-status',
-                    'Overall SKARAB health')
-
-            self._logger.info('{} init function complete.'.format(self.host))
+    def _create_board_sensors(self, board):
+        """
+        The sensors every board has, whether or not it can be reached.
+        """
+        sensor_manager = self.sensor_manager
+        board.sensors['location'] = sensor_manager.do_sensor(
+                Corr2Sensor.string, board.sensor_name('location'),
+                'Rack location of this SKARAB',
+                initial_status=Corr2Sensor.NOMINAL,unit='unitless')
+        board.sensors['location'].set_value(board.rack_location_tuple[0])
+
+        board.sensors['boot_image'] = sensor_manager.do_sensor(
+                Corr2Sensor.string, board.sensor_name('boot-image'),
+                'Currently running FPGA image',
+                initial_status=Corr2Sensor.NOMINAL,unit='unitless')
+
+        board.sensors['device_status'] = sensor_manager.do_sensor(
+                Corr2Sensor.device_status, board.sensor_name('device-status'),
+                'Overall SKARAB health')
+
+    def _add_hw_sensors(self, board, sensordict):
+        """
+        Create a board's hardware sensors from its first get_sensor_data().
+        """
+        for key, value in sensordict.iteritems():
+            try:
+                if isinstance(value[0], float):
+                    sensortype = Corr2Sensor.float
+                elif isinstance(value[0], int):
+                    sensortype = Corr2Sensor.integer
+                elif isinstance(value[0], bool):
+                    sensortype = Corr2Sensor.boolean
+                elif isinstance(value[0], str):
+                    sensortype = Corr2Sensor.string
+                else:
+                    raise RuntimeError("Unknown datatype!")
+                board.sensors[key] = self.sensor_manager.do_sensor(
+                    sensortype, board.sensor_name(key),
+                    'a generic HW sensor', unit=value[1])
+            except Exception as e:
+                self.sensor_manager.logger.error(
+                    'Unable to add sensor {}-{}. Skipping.'.format(key, value))
+                raise e
+        board.discovered = True
+
+    def _discover_sensors(self):
+        """
+        The initial get_sensor_data() call populates each board's sensor
+        dictionary, so it is done for all the boards concurrently at
+        startup. Boards that cannot be reached yet are retried from the
+        sensor loop, instead of holding up the others.
+        """
+        results = {
+            board: self.executor.submit(board.host.transport.get_sensor_data,
+                                        timeout=self.timeout)
+            for board in self.boards}
+        for board, result in results.iteritems():
+            try:
+                self._add_hw_sensors(board, result.result())
+            except Exception as e:
+                self._logger.error(
+                    'Error retrieving {}s sensors on startup - {}. Will retry '
+                    'from the sensor loop.'.format(board.host, e.message))
 
     def start_sensor_loop(self):
-        # Work out when to call the sensor loop. This is done so that the SKARABs on site do not
-        # all call the hardware sensor loop at the same time. We want them to do this in a 
-        # staggered pattern so that the CPU and network load are balanced.
-        #
-        # The loop is called every sensorPollInterval_s seconds. As such the SKARABs need to be 
-        # distributed across this window. A custom indexing function was implemented. The hash used 
-        # is the skraab location. The skarab rack index is the fasted changing index in the has as
-        # skarabs in an instrument are likely to be in the same rack, so indexing across racks first
-        # results in sensor loop calls in an instrument being distributed better than if the 
-        # column index was the fastes changing index.
-        #
-        # The logic here is similar to that employed in the get_physical_location() function
-        ipAddress = socket.gethostbyname(self.host.transport.host)
-        octets = ipAddress.split('.')
-        leafIndex = int(octets[2]) - 5 # Leaf no 5 is the first leaf the SKARABs are connected to
-        switchPortIndex = int(octets[3]) // 4
-        skarabIndex = switchPortIndex * 18 + leafIndex #18 leafs with SKARABs on them
-
+        # Each board is read at a fixed offset into the poll period, so
+        # that the SKARABs on site do not all call the hardware sensor loop
+        # at the same time - see stagger_offsets(). Offsets are counted
+        # from the top of the minute, so sensorPollInterval_s should be a
+        # factor of 60.
         global sensorPollInterval_s
-        timeOffset = sensorPollInterval_s/250.0 * skarabIndex #Assumes 250 SKARABS
-
-        loopCallTime = time.time() 
-        # We want the reference time to be aligned on a minute. As such sensorPollInterval_s
-        # should be a factor of 60, this keeps everything nicely aligned 
-        loopCallTime = loopCallTime - loopCallTime % 60 + timeOffset 
-        
-        # print(leafIndex, switchPortIndex, skarabIndex, loopCallTime, timeOffset, sensorPollInterval_s)
-
-
-        # Actually start sensor loop
-        IOLoop.current().call_at(loopCallTime,
-            _sensor_cb_hw,
-            self.executor,
-            self.sensors,
-            self.host,
-            self.timeout,
-            self._logger,
-            loopCallTime)
+        self.scheduler = sensor_scheduler.SensorScheduler(
+            ioloop=IOLoop.current(), default_period_s=sensorPollInterval_s,
+            max_concurrent_per_host=1, jitter_fraction=0,
+            logger=self._logger)
+        offsets = stagger_offsets(self.boards, sensorPollInterval_s,
+                                  self.stagger)
+        for board, offset in zip(self.boards, offsets):
+            sensor_task = sensor_scheduler.SensorTask(
+                '{0: <25} on {1: >15}'.format('_sensor_cb_hw', board.host.host),
+                host=board.host.host, offset_s=offset)
+            self.scheduler.add_task(sensor_task, _sensor_cb_hw, self, board)
+        self.scheduler.start()
 
     def setup_sensors(self):
         """
@@ -183,6 +252,11 @@ class Corr2HardwareSensorServer(katcp.DeviceServer):
         """
         return
 
+    def _get_boards(self, hostname):
+        if not hostname:
+            return self.boards
+        return [board for board in self.boards if board.host.host == hostname]
+
     @request()
     @return_reply()
     def request_ping(self, sock):
@@ -193,20 +267,26 @@ class Corr2HardwareSensorServer(katcp.DeviceServer):
         """
         return 'ok',
 
-    @request()
+    @request(Str(default=''))
     @return_reply(Str())
-    def request_reset_hardware_platform(self, sock):
+    def request_reset_hardware_platform(self, sock, hostname):
         """
         Reset the skarab and checks if it is in a reset state.
         :param sock:
+        :param hostname: the SKARAB to reset, needed if this servlet
+        polls more than one
         :return: {'ok,'fail'}
         """
-
+        boards = self._get_boards(hostname)
+        if len(boards) != 1:
+            return ('fail', 'Specify one of: {}'.format(
+                ', '.join(board.host.host for board in self.boards)))
+        host = boards[0].host
         tmpLevel = self._logger.level
         self._logger.setLevel(10)  # Set logging level to info to record this reset
-        self._logger.info('Reseting Skarab: {}'.format(self.host.host))
+        self._logger.info('Reseting Skarab: {}'.format(host.host))
         self._logger.setLevel(tmpLevel)
-        self.host.transport.reboot_fpga()
+        host.transport.reboot_fpga()
         return ('ok', 'Reset Successful')
 
     @request()
@@ -217,9 +297,7 @@ class Corr2HardwareSensorServer(katcp.DeviceServer):
         :param sock:
         :return: {'ok,'fail'}
         """
-        
-        global sensor_loop_running
-        sensor_loop_running = 0
+        self.sensor_loop_running = 0
         return ('ok', 'Sensor loop paused')
 
     @request()
@@ -230,13 +308,10 @@ class Corr2HardwareSensorServer(katcp.DeviceServer):
         :param sock:
         :return: {'ok,'fail'}
         """
-
-        global sensor_loop_running
-        sensor_loop_running = 1
+        self.sensor_loop_running = 1
         return ('ok', 'Sensor loop resuming')
 
 
-
 def get_physical_location(ipAddress):
     octets = ipAddress.split('.')
     leafNo = int(octets[2])
@@ -286,49 +361,46 @@ def is_sensor_list_status_ok(sensors_dict):
 
 
 @gen.coroutine
-def _sensor_cb_hw(executor, sensors, host, timeout, logger, loopCallTime):
+def _sensor_cb_hw(server, board):
     """
-    Sensor call back to check all HW sensors
-    :param sensors: per-host dict of sensors
+    Sensor call back to check all HW sensors on a board
+    :param server: the Corr2HardwareSensorServer
+    :param board: the HardwareBoard to check
     :return:
     """
-
-    global sensorPollInterval_s
-    loopCallTime = loopCallTime + sensorPollInterval_s # The loops are called every 30 seconds, so increment by 30 seconds 
+    sensors = board.sensors
+    host = board.host
+    executor = server.executor
+    timeout = server.timeout
+    logger = server._logger
 
     def set_failure():
         for key, sensor in sensors.iteritems():
             if(key != 'location'):
                 sensor.set(status=Corr2Sensor.UNREACHABLE,
                         value=Corr2Sensor.SENSOR_TYPES[Corr2Sensor.SENSOR_TYPE_LOOKUP[sensor.type]][1])
-        time.sleep(0.5)
-        IOLoop.current().call_at(loopCallTime, _sensor_cb_hw, executor, sensors, host, timeout, logger, loopCallTime)
 
     #Determine if SKARAB must be polled - if it is not, set all sensor values to unreachable
-    global sensor_loop_running
-    if(sensor_loop_running == 0):
-        # logger.info('Sensor loop paused {0} {1}'.format(time.time(),loopCallTime))
+    if(server.sensor_loop_running == 0):
         set_failure()
         return
 
     try:
-        boot_image = parse_boot_image_return(host.transport.get_virtex7_firmware_version())
+        firmware_version = yield executor.submit(
+            host.transport.get_virtex7_firmware_version)
+        boot_image = parse_boot_image_return(firmware_version)
         sensors['boot_image'].set(value=boot_image[0],status=Corr2Sensor.NOMINAL)
     except Exception as e:
         logger.info('Error retrieving boot image state on host {} - {}'.format(host.host, e.message))
         set_failure()
         return
 
-    global reportRackLocation
-    if(reportRackLocation<3):
-	reportRackLocation+=1
-    	rack_location_tuple = get_physical_location(socket.gethostbyname(host.transport.host))
-	sensors['location'].set(value=rack_location_tuple[0],status=Corr2Sensor.WARN,timestamp=time.time())
-    elif(reportRackLocation==3):
-        reportRackLocation+=1
-        rack_location_tuple = get_physical_location(socket.gethostbyname(host.transport.host))
-	sensors['location'].set(value=rack_location_tuple[0],status=Corr2Sensor.NOMINAL,timestamp=time.time())
-
+    if(board.report_rack_location<3):
+        board.report_rack_location+=1
+        sensors['location'].set(value=board.rack_location_tuple[0],status=Corr2Sensor.WARN,timestamp=time.time())
+    elif(board.report_rack_location==3):
+        board.report_rack_location+=1
+        sensors['location'].set(value=board.rack_location_tuple[0],status=Corr2Sensor.NOMINAL,timestamp=time.time())
 
     try:
         results = yield executor.submit(host.transport.get_sensor_data,
@@ -339,6 +411,14 @@ def _sensor_cb_hw(executor, sensors, host, timeout, logger, loopCallTime):
         set_failure()
         return
 
+    if not board.discovered:
+        try:
+            server._add_hw_sensors(board, results)
+        except Exception as e:
+            logger.error('Error adding {}s sensors - {}'.format(host.host, e.message))
+            set_failure()
+            return
+
     for key, value in results.iteritems():
         try:
             if ((value[2].lower() == 'ok') or (value[2].lower() == 'nominal')):
@@ -353,7 +433,6 @@ def _sensor_cb_hw(executor, sensors, host, timeout, logger, loopCallTime):
             sensors[key].set(value=value[0], status=status)
         except Exception as e:
             logger.error('Error updating {}-{} sensor - {}'.format(host.host, key, e.message))
-            time.sleep(0.5)
             try:
                 sensors[key].set(status=Corr2Sensor.UNREACHABLE,
                         value=Corr2Sensor.SENSOR_TYPES[Corr2Sensor.SENSOR_TYPE_LOOKUP[sensors[key].type]][1])
@@ -369,9 +448,6 @@ def _sensor_cb_hw(executor, sensors, host, timeout, logger, loopCallTime):
         sensors['device_status'].set(value=device_value, status=device_status)
     except Exception as e:
         logger.error('Error updating {}-device-status sensor - {}'.format(host.host, e.message))
-    # logger.info('sensorloop ran')
-    time.sleep(0.5)
-    IOLoop.current().call_at(loopCallTime, _sensor_cb_hw, executor, sensors, host, timeout, logger, loopCallTime)
 
 @gen.coroutine
 def on_shutdown(ioloop, server):
@@ -402,8 +478,28 @@ def main():
         '--no_tornado', dest='no_tornado', action='store_true', default=False,
         help='do NOT use the tornado version of the Katcp server')
     parser.add_argument(
-        '--host', dest='host', action='store',
-        help='SKARAB hostname or IP address to connect to.')
+        '--host', dest='host', action='store', default='',
+        help='SKARAB hostname or IP address to connect to, or a '
+             'comma-separated list of them.')
+    parser.add_argument(
+        '--hosts_file', dest='hosts_file', action='store', default=None,
+        help='a file listing SKARABs to poll, one per line')
+    parser.add_argument(
+        '--name', dest='name', action='store', default=None,
+        help='a name for this servlet, used for the log file. Defaults '
+             'to the first host.')
+    parser.add_argument(
+        '--prefix', dest='prefix', action='store_true', default=False,
+        help='prefix sensor names with the hostname even when polling a '
+             'single SKARAB')
+    parser.add_argument(
+        '--workers', dest='workers', action='store', default=16, type=int,
+        help='the most SKARABs to talk to at once')
+    parser.add_argument(
+        '--stagger', dest='stagger', action='store', default='location',
+        choices=['location', 'even'],
+        help='spread polls by rack location (site-wide) or evenly over '
+             'this servlet\'s SKARABs')
     parser.add_argument(
         '--log_here', dest='log_here', action='store_true', default=False,
         help='Log to file here or in /var/log/skarab')
@@ -418,9 +514,22 @@ def main():
     except Exception:
         raise RuntimeError('Received nonsensical log level {}'.format(args.loglevel))
 
+    hostnames = [host.strip() for host in args.host.split(',')
+                 if host.strip()]
+    if args.hosts_file:
+        with open(args.hosts_file, 'r') as f:
+            hostnames.extend(line.strip() for line in f
+                             if line.strip() and not line.startswith('#'))
+    if not hostnames:
+        raise RuntimeError('No SKARABs given - use --host or --hosts_file.')
+
     server = Corr2HardwareSensorServer('127.0.0.1', args.port,
                                        tornado=(not args.no_tornado),
-                                       skarab_host=args.host,
+                                       skarab_hosts=hostnames,
+                                       name=args.name,
+                                       prefix=args.prefix,
+                                       workers=args.workers,
+                                       stagger=args.stagger,
                                        log_here=args.log_here,
                                        log_level=log_level,
                                        timeout=float(args.timeout))
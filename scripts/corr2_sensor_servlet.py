@@ -9,11 +9,13 @@ import tornado.gen
 
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 from katcp import DeviceServer
+from katcp.kattypes import request, return_reply, Float, Int, Str
 from tornado.ioloop import IOLoop
 
 from corr2 import sensors_periodic
 from corr2.fxcorrelator import FxCorrelator
 from corr2.sensors import SensorManager
+from corr2.sensor_history import summarise_history
 from corr2.utils import parse_ini_file
 from corr2.corr2LogHandlers import getKatcpLogger, reassign_log_handlers, \
                                     create_katcp_and_file_handlers
@@ -102,6 +104,58 @@ class Corr2SensorServer(DeviceServer):
         """
         self.log_level = log_level;
 
+    @request(Str(), Float(default=600.0), Int(min=1, default=60))
+    @return_reply(Int(min=0))
+    def request_sensor_history(self, sock, sensor_name, period, buckets):
+        """
+        Summarise the recent history of a numeric sensor. Each bucket is
+        informed as: start-time min max mean num-readings
+        :param sock:
+        :param sensor_name: the sensor to query
+        :param period: how many seconds of history to summarise
+        :param buckets: how many time buckets to split the period into
+        :return: the number of buckets informed
+        """
+        try:
+            summary = summarise_history(
+                getattr(self.instrument, 'sensor_manager', None),
+                sensor_name, period, buckets)
+        except ValueError as ex:
+            return self._log_excep(None, ex.message)
+        for row in summary:
+            sock.inform(*row)
+        return 'ok', len(summary)
+
+    @request(Str(default=''))
+    @return_reply(Int(min=0))
+    def request_sensor_loop_stats(self, sock, kind):
+        """
+        Report runtime statistics for each periodic sensor callback, one
+        inform per callback and host: callback host calls p50-ms p95-ms
+        max-ms overruns target-period achieved-period
+        :param sock:
+        :param kind: only report callbacks whose name contains this
+        :return: the number of informs sent
+        """
+        if self.instrument is None or self.instrument.sensor_manager is None \
+                or self.instrument.sensor_manager.scheduler is None:
+            return self._log_excep(None, 'Sensors have not been set up yet.')
+        stats = self.instrument.sensor_manager.scheduler.stats()
+        informs = 0
+        for (task_kind, host), task_stats in sorted(stats.items()):
+            if kind not in task_kind:
+                continue
+            sock.inform(task_kind, host or 'all',
+                        task_stats['calls'],
+                        task_stats['runtime_p50'] * 1000.0,
+                        task_stats['runtime_p95'] * 1000.0,
+                        task_stats['runtime_max'] * 1000.0,
+                        task_stats['overruns'],
+                        task_stats['target_period'],
+                        task_stats['achieved_period'])
+            informs += 1
+        return 'ok', informs
+
     def initialise(self, config):
         """
         Setup and start sensors
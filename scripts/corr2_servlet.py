@@ -15,6 +15,9 @@ from concurrent import futures
 from corr2.fxcorrelator import FxCorrelator
 from corr2.sensors import Corr2Sensor, Corr2SensorManager
 from corr2.utils import parse_ini_file, process_new_eq
+from corr2.sensor_history import summarise_history
+from corr2.packed_array import pack_array, ENCODINGS as ARRAY_ENCODINGS
+from corr2.transient_capture import capture_path
 from corr2 import corr_monitoring_loop as corr_mon_loop
 
 from corr2.corr2LogHandlers import getKatcpLogger, \
@@ -127,6 +130,23 @@ class Corr2Server(DeviceServer):
         rv = rv.replace(',', '')
         return rv.split(' ')
 
+    @staticmethod
+    def inform_array(sock, args, array, encoding, timestamp=None):
+        """
+        Inform a numpy array, as str(list) or packed - see packed_array.
+        :param sock:
+        :param args: the inform arguments to put before the data
+        :param array: the data
+        :param encoding: 'list', or a packed_array encoding
+        :param timestamp: the capture time, for packed arrays
+        :return:
+        """
+        if encoding == 'list':
+            data = [str(array.tolist())]
+        else:
+            data = pack_array(array, timestamp, encoding)
+        sock.inform(*(list(args) + data))
+
     @request(Str(), Str(default=''), Int(default=1000))
     @return_reply()
     def request_create(self, sock, config_file, instrument_name, log_len):
@@ -515,15 +535,45 @@ class Corr2Server(DeviceServer):
             return tuple(['ok'] +
                      Corr2Server.rv_to_liststr(_src[source_name]))
 
+    @request(Str(), Str(default='list'))
+    @return_reply(Str(multiple=True))
+    def request_eq_array(self, sock, source_name, encoding):
+        """
+        Get the full EQ last written to or read from an input, without
+        reading it from the hardware.
+        :param sock:
+        :param source_name: the input
+        :param encoding: 'list' for one complex value per channel, or
+            'compact' for the encoding used by the <input>-eq sensors
+        :return:
+        """
+        try:
+            feng = self.instrument.fops.get_fengine(source_name)
+        except ValueError as ex:
+            return self._log_excep(ex, ex.message)
+        if feng.last_eq is None:
+            return self._log_excep(None, 'EQ for {} not known yet.'.format(
+                source_name))
+        if encoding == 'compact':
+            return 'ok', feng.eq_encoded()
+        elif encoding != 'list':
+            return self._log_excep(None, 'Unknown encoding {}.'.format(
+                encoding))
+        return tuple(['ok'] + Corr2Server.rv_to_liststr(feng.last_eq))
+
     @request(Str(default='', multiple=True))
     @return_reply()
+    @gen.coroutine
     def request_gain_all(self, sock, *eq_vals):
         """
-        Apply the gain settings for an input
+        Apply the gain settings for an input. The gains are set in the
+        background, so other requests are not held up.
         :param sock:
-        :param eq_vals: the equaliser values, or 'auto'.
+        :param eq_vals: the equaliser values, or 'auto'. For 'auto', each
+            input is informed as: input snapshots-averaged seconds converged
         :return:
         """
+        report = None
         try:
             if len(eq_vals) <= 0:
                 neweqvals=None
@@ -535,14 +585,23 @@ class Corr2Server(DeviceServer):
                 neweqvals=None
                 self.instrument.logger.info('Applying default gains')
             elif eq_vals[0] == 'auto':
-                neweqvals='auto'
                 self.instrument.logger.info('Trying to set gains automatically')
+                report = yield self.instrument.async_ops.submit(
+                    'fops.auto_eq', self.instrument.fops.auto_eq)
             else:
                 neweqvals = process_new_eq(list(eq_vals))
-            self.instrument.fops.set_eq(new_eq=neweqvals, input_name=None)
+            if report is None:
+                yield self.instrument.fops.set_eq_async(new_eq=neweqvals,
+                                                        input_name=None)
         except Exception as ex:
-            return self._log_excep(ex, 'Failed setting eq for all sources')
-        return 'ok',
+            raise gen.Return(self._log_excep(
+                ex, 'Failed setting eq for all sources'))
+        if report is not None:
+            for input_name in sorted(report.keys()):
+                sock.inform(input_name, report[input_name]['averages'],
+                            '{:.3f}'.format(report[input_name]['converge_time']),
+                            report[input_name]['converged'])
+        raise gen.Return(('ok',))
 
       
     @request(Str(), Float(default=-1.0), Str(default='', multiple=True))
@@ -563,13 +622,31 @@ class Corr2Server(DeviceServer):
             return tuple(['fail', ' supplied stream name %s does not match expected %s.' % (stream_name, self.instrument.fops.data_stream.name)])
         try:
 
-            self.instrument.fops.delay_set_all(loadtime, delay_strings)
-            return tuple(['ok', ' Model updated. Check sensors after next update to confirm application'])
+            if not self.instrument.fops.delay_set_all(loadtime, delay_strings):
+                return tuple(['fail', ' Load time too soon or in the past, model dropped.'])
+            return tuple(['ok', ' Model queued. Check sensors after next update to confirm application'])
+        except ValueError as ex:
+            return self._log_excep(None, 'Bad delay model - {}'.format(ex))
         except Exception as ex:
             stack_trace = traceback.format_exc()
             return self._log_stacktrace(stack_trace, 'Failed setting delays.')
 
 
+    @request(Int(min=1, default=10))
+    @return_reply(Int(min=0))
+    def request_delay_traces(self, sock, count):
+        """
+        Dump the timing of the last few delay updates, one inform each:
+        trace-id load-mcnt stage times margin late loaded
+        :param sock:
+        :param count: how many of the most recent updates
+        :return:
+        """
+        traces = self.instrument.fops.delay_tracer.last(count)
+        for trace in traces:
+            sock.inform(trace.trace_id, trace.load_mcnt, str(trace))
+        return 'ok', len(traces)
+
     @request(Float(default=-1.0))
     @return_reply(Float())
     def request_accumulation_length(self, sock, new_acc_time):
@@ -605,66 +682,106 @@ class Corr2Server(DeviceServer):
             return self._log_stacktrace(stack_trace, 'Failed to set interpacket gap size.')
         return 'ok', 
 
-    @request(Str())
+    @request(Str(), Str(default='list'))
     # @return_reply(Str(multiple=True))
     @return_reply()
-    def request_quantiser_snapshot(self, sock, source_name):
+    def request_quantiser_snapshot(self, sock, source_name, encoding):
         """
         Get a list of values representing the quantised spectrum for
         the given source
         :param sock:
         :param source_name: the source to query
+        :param encoding: 'list', or 'b64' or 'raw' for a packed array
         :return:
         """
         if source_name.strip() == '':
             return self._log_excep(None, 'No source name given.')
+        if encoding != 'list' and encoding not in ARRAY_ENCODINGS:
+            return self._log_excep(None, 'Unknown encoding {}.'.format(
+                encoding))
         try:
             snapdata = self.instrument.fops.get_quant_snap(source_name)
         except Exception as ex:
             stack_trace = traceback.format_exc()
             return self._log_stacktrace(stack_trace, ex.message)
-        sock.inform(source_name, str(snapdata))
+        self.inform_array(sock, [source_name], snapdata, encoding)
         return 'ok',
 
-    @request(Str(), Int())
+    @request(Str())
+    @return_reply(Float())
+    def request_quantiser_snapshot_timings(self, sock, source_name):
+        """
+        Get the timing of each window of the last full-spectrum quantiser
+        snapshot of a source, one inform each:
+        start-chan stop-chan offset read-ms arm-ms decode-ms
+        :param sock:
+        :param source_name: the source to query
+        :return: the whole capture's time, in ms
+        """
+        try:
+            capture_s, timings = \
+                self.instrument.fops.get_quant_snap_timings(source_name)
+        except Exception as ex:
+            return self._log_excep(ex, ex.message)
+        if capture_s is None:
+            return self._log_excep(None, 'No quantiser snapshot captured '
+                                         'for {} yet.'.format(source_name))
+        for window in timings:
+            sock.inform(window['start_chan'], window['stop_chan'],
+                        window['offset'], window['read_s'] * 1000.0,
+                        window['arm_s'] * 1000.0,
+                        window['decode_s'] * 1000.0)
+        return 'ok', capture_s * 1000.0
+
+    @request(Str(), Int(), Str(default='list'))
     @return_reply()
-    def request_quantiser_singlechan_snapshot(self, sock, source_name, channel_select):
+    def request_quantiser_singlechan_snapshot(self, sock, source_name,
+                                              channel_select, encoding):
         """
         Get a list of values representing the time series for a
         single, specified channel of the given source
         :param sock:
         :param channel_select: the channel for which data is to be retrieved
         :param source_name: the source to query
+        :param encoding: 'list', or 'b64' or 'raw' for a packed array
         :return:
         """
         if source_name.strip() == '':
             return self._log_excep(None, 'No source name given.')
+        if encoding != 'list' and encoding not in ARRAY_ENCODINGS:
+            return self._log_excep(None, 'Unknown encoding {}.'.format(
+                encoding))
         try:
             snapdata = self.instrument.fops.get_quant_snap(source_name, channel_select)
         except Exception as ex:
             return self._log_excep(ex, ex.message)
-        sock.inform(source_name, channel_select, str(snapdata))
+        self.inform_array(sock, [source_name, channel_select], snapdata,
+                          encoding)
         return 'ok',
 
-    @request(Str(), Float(default=-1))
+    @request(Str(), Float(default=-1), Str(default='list'))
     @return_reply(Int())
-    def request_adc_snapshot(self, sock, source_name, capture_time):
+    def request_adc_snapshot(self, sock, source_name, capture_time, encoding):
         """
         Request a snapshot of ADC data for a specific source, at a
         specific time.
         :param sock:
         :param source_name: the source to query
         :param capture_time: the UNIX time from which to capture data
+        :param encoding: 'list', or 'b64' or 'raw' for a packed array
         :return:
         """
         if source_name.strip() == '':
             return self._log_excep(None, 'No source name given.')
+        if encoding != 'list' and encoding not in ARRAY_ENCODINGS:
+            return self._log_excep(None, 'Unknown encoding {}.'.format(
+                encoding))
         try:
             data = self.instrument.fops.get_adc_snapshot(
                 source_name, capture_time)
             snaptime = data[source_name].timestamp
-            rstr = str(data[source_name].data)
-            sock.inform(source_name, rstr)
+            self.inform_array(sock, [source_name], data[source_name].data,
+                              encoding, snaptime)
             return 'ok', snaptime
         except ValueError as ex:
             stack_trace = traceback.format_exc()
@@ -681,6 +798,7 @@ class Corr2Server(DeviceServer):
         try:
             self.delays_disabled = disable_delays
             if disable_delays:
+                self.instrument.fops.delay_queue.clear()
                 message = "Delay model updates disabled."
             else:
                 message = "Delay model updates re-enabled."
@@ -691,20 +809,24 @@ class Corr2Server(DeviceServer):
             stack_trace = traceback.format_exc()
             return self._log_stacktrace(stack_trace, 'Failed to configure delay disable.')
 
-    @request()
+    @request(Str(default='list'))
     @return_reply(Int())
-    def request_transient_buffer_trigger(self, sock):
+    def request_transient_buffer_trigger(self, sock, encoding):
         """
         Get ADC snapshots for all data sources, hopefully triggered at the
         same time.
         :param sock:
+        :param encoding: 'list', or 'b64' or 'raw' for packed arrays
         :return:
         """
+        if encoding != 'list' and encoding not in ARRAY_ENCODINGS:
+            return self._log_excep(None, 'Unknown encoding {}.'.format(
+                encoding))
         try:
             data = self.instrument.fops.get_adc_snapshot()
             for source in data:
-                rstr = str(data[source].data)
-                sock.inform(source, rstr)
+                self.inform_array(sock, [source], data[source].data,
+                                  encoding, data[source].timestamp)
             snaptime = data[data.keys()[0]].timestamp
             return 'ok', snaptime
         except ValueError as ex:
@@ -712,6 +834,45 @@ class Corr2Server(DeviceServer):
             return self._log_stacktrace(stack_trace, 'Failed to read ADC voltage data from '
                                                      'transient buffers.')
 
+    @request(Str(default=''), Float(default=-1), Str(default='gzip'))
+    @return_reply(Str(), Int(), Int(), Float())
+    def request_transient_buffer_capture(self, sock, filename, capture_time,
+                                         compression):
+        """
+        Trigger the ADC snapshots of all inputs at the same time, as for
+        ?transient-buffer-trigger, and write them to an HDF5 file on the
+        correlator host rather than sending them back. Each input is
+        informed as: input timestamp min max rms
+        :param sock:
+        :param filename: the name of the file to write in the configured
+            transient_capture_dir, which must not exist yet. Default a new,
+            uniquely named file.
+        :param capture_time: the UNIX time at which to trigger, default now
+        :param compression: an HDF5 compression filter, or 'none'
+        :return: the file, the number of inputs and samples written and
+            the time the capture took
+        """
+        try:
+            filename = capture_path(self.instrument.transient_capture_dir,
+                                    filename)
+        except (ValueError, OSError) as ex:
+            return self._log_excep(None, str(ex))
+        if compression == 'none':
+            compression = None
+        try:
+            summary, stats = self.instrument.fops.capture_adc_snapshots(
+                filename, capture_time, compression=compression)
+        except Exception as ex:
+            stack_trace = traceback.format_exc()
+            return self._log_stacktrace(stack_trace, 'Failed to capture the '
+                                                     'transient buffers.')
+        for source in sorted(stats):
+            sock.inform(source, stats[source]['timestamp'],
+                        stats[source]['min'], stats[source]['max'],
+                        '{:.3f}'.format(stats[source]['rms']))
+        return ('ok', summary['filename'], summary['inputs'],
+                summary['samples'], summary['seconds'])
+
     @request(Str(), Float(default='', multiple=True))
     @return_reply(Str(multiple=True))
     def request_beam_weights(self, sock, beam_name, *weight_list):
@@ -720,19 +881,23 @@ class Corr2Server(DeviceServer):
         :param sock:
         :param beam_name: required beam stream
         :param weight_list: list of weights to set, one per input
-        :return: a list of the weights set
+        :return: a list of the weights, as read back from the hardware
         """
         if not self.instrument.found_beamformer:
             return self._log_excep(None, 'Cannot run beamformer commands with '
                                          'no beamformer')
         if weight_list != '':
             try:
-                self.instrument.bops.set_beam_weights(
+                verified = self.instrument.bops.set_beam_weights(
                     weight_list, beam_name)
             except Exception as ex:
                 stack_trace = traceback.format_exc()
                 return self._log_stacktrace(stack_trace,
                     'Failed setting beamweights for {0}.'.format(beam_name))
+            if not verified:
+                return self._log_excep(None, 'Beamweights for {0} did not '
+                                             'read back as written.'.format(
+                                                 beam_name))
         try:
             cur_weights = self.instrument.bops.get_beam_weights(
                 beam_name)
@@ -799,18 +964,37 @@ class Corr2Server(DeviceServer):
 
     @request()
     @return_reply()
+    @gen.coroutine
     def request_vacc_sync(self, sock):
         """
-        Initiate a new vacc sync operation on the instrument.
+        Initiate a new vacc sync operation on the instrument, in the
+        background.
         :param sock:
         :return:
         """
         try:
-            self.instrument.xops.vacc_sync()
+            yield self.instrument.xops.vacc_sync_async()
         except Exception as ex:
             stack_trace = traceback.format_exc()
-            return self._log_stacktrace(stack_trace, 'Failed syncing vaccs')
-        return 'ok',
+            raise gen.Return(self._log_stacktrace(stack_trace,
+                                                  'Failed syncing vaccs'))
+        raise gen.Return(('ok',))
+
+    @request()
+    @return_reply(Int())
+    def request_async_operations(self, sock):
+        """
+        List the instrument operations running in the background, one
+        inform each: name stage percent-done seconds-since-submitted
+        :param sock:
+        :return: the number of operations
+        """
+        active = self.instrument.async_ops.active()
+        for progress in sorted(active, key=lambda progress_: progress_.submitted):
+            sock.inform(progress.name, progress.stage,
+                        '{:.0f}'.format(progress.fraction * 100.0),
+                        '{:.1f}'.format(time.time() - progress.submitted))
+        return 'ok', len(active)
 
     @request()
     @return_reply()
@@ -931,6 +1115,44 @@ class Corr2Server(DeviceServer):
 
             return 'ok', check_time
 
+    @request()
+    @return_reply(Int(min=0))
+    def request_sensor_inform_stats(self, sock):
+        """
+        Report the batched sensor-status inform counters.
+        :param sock:
+        :return: the number of counters informed
+        """
+        if self.instrument is None or self.instrument.sensor_manager is None:
+            return self._log_excep(None, 'No sensor manager yet - initialise '
+                                         'the instrument first.')
+        stats = self.instrument.sensor_manager.publisher.stats()
+        for key in sorted(stats.keys()):
+            sock.inform(key, stats[key])
+        return 'ok', len(stats)
+
+    @request(Str(), Float(default=600.0), Int(min=1, default=60))
+    @return_reply(Int(min=0))
+    def request_sensor_history(self, sock, sensor_name, period, buckets):
+        """
+        Summarise the recent history of a numeric sensor. Each bucket is
+        informed as: start-time min max mean num-readings
+        :param sock:
+        :param sensor_name: the sensor to query
+        :param period: how many seconds of history to summarise
+        :param buckets: how many time buckets to split the period into
+        :return: the number of buckets informed
+        """
+        try:
+            summary = summarise_history(
+                getattr(self.instrument, 'sensor_manager', None),
+                sensor_name, period, buckets)
+        except ValueError as ex:
+            return self._log_excep(None, ex.message)
+        for row in summary:
+            sock.inform(*row)
+        return 'ok', len(summary)
+
     @request()
     @return_reply(Int(min=0))
     def request_get_log(self, sock):
@@ -1052,7 +1274,7 @@ class Corr2Server(DeviceServer):
         assert len(eq_vals) == n_chans
         if len(eq_vals) > 0 and eq_vals[0] != '':
             try:
-                self.instrument.fops.set_eq(True, source_name, list(eq_vals))
+                self.instrument.fops.set_eq(new_eq=list(eq_vals), input_name=source_name)
             except Exception as ex:
                 stack_trace = traceback.format_exc()
                 return self._log_stacktrace(stack_trace, 'Failed setting eq for input {0}'.format(source_name))
@@ -1070,7 +1292,7 @@ class Corr2Server(DeviceServer):
         """
         if len(eq_vals) > 0 and eq_vals[0] != '':
             try:
-                self.instrument.fops.set_eq(True, None, list(eq_vals))
+                self.instrument.fops.set_eq(new_eq=process_new_eq(list(eq_vals)), input_name=None)
             except Exception as ex:
                 stack_trace = traceback.format_exc()
                 return self._log_stacktrace(stack_trace, 'Failed setting all eqs.')
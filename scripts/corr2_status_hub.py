@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+"""
+Own the status register reads for an instrument and serve them to the
+corr2 servlet and the sensor servlet over a Unix socket. Point both at
+it with status_hub_socket in the [FxCorrelator] section of the config.
+"""
+
+from __future__ import print_function
+
+import os
+import time
+import signal
+import logging
+
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+from corr2.fxcorrelator import FxCorrelator
+from corr2.status_snapshot import StatusSnapshotCache
+from corr2.status_hub import StatusHub
+from corr2.utils import parse_ini_file
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description='Start a corr2 status hub.',
+        formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--config', dest='config', type=str, action='store',
+                        default=None, help='a corr2 config file')
+    parser.add_argument('--socket', dest='socket', type=str, action='store',
+                        default=None,
+                        help='Unix socket to serve on, default the config\'s '
+                             'status_hub_socket')
+    parser.add_argument('-n', '--name', dest='name', action='store',
+                        default=None, help='a name for the instrument')
+    parser.add_argument('--log_level', dest='log_level', action='store',
+                        default='WARN', help='log level to set')
+    args = parser.parse_args()
+
+    if 'CORR2INI' in os.environ.keys() and args.config is None:
+        args.config = os.environ['CORR2INI']
+    elif args.config is None:
+        raise RuntimeError('No config file.')
+
+    if args.name is None:
+        args.name = os.path.basename(args.config).rsplit('.', 1)[0]
+
+    try:
+        log_level = getattr(logging, args.log_level.upper())
+    except AttributeError:
+        raise RuntimeError('Received nonsensical log level {}'.format(
+            args.log_level))
+
+    configd = parse_ini_file(args.config)
+    socket_path = args.socket or \
+        configd['FxCorrelator'].get('status_hub_socket', '')
+    if not socket_path:
+        raise RuntimeError('No socket - give --socket or set '
+                           'status_hub_socket in the config.')
+
+    instrument = FxCorrelator('{}_hub'.format(args.name),
+                              config_source=args.config)
+    instrument.initialise(program=False, configure=False,
+                          require_epoch=False, logLevel=log_level)
+
+    # the hub does the reads itself, whatever the config says
+    cache = StatusSnapshotCache(
+        max_age_s=instrument.status_cache.max_age_s, logger=instrument.logger)
+    hub = StatusHub(cache, instrument.fhosts + instrument.xhosts,
+                    socket_path, logger=instrument.logger)
+    hub.start()
+    print('Status hub serving {} hosts on {}.'.format(
+        len(hub.hosts), socket_path))
+
+    running = [True]
+
+    def stop(sig, frame):
+        running[0] = False
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    while running[0]:
+        time.sleep(0.5)
+    print('Status hub shutting down after {} requests ({} reads).'.format(
+        hub.requests, cache.reads))
+    hub.stop()
+
+# end
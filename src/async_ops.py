@@ -0,0 +1,179 @@
+"""
+Run long instrument operations in the background and get a
+concurrent.futures.Future back, so that independent requests need not
+wait for each other. Tornado coroutines can yield the futures directly.
+
+An operation reports its progress with report_progress(), which does
+nothing when the operation is called directly rather than through
+AsyncOperations.submit. Cancelling a future that has not started stops
+it from running. Cancelling one that has started asks it to stop at its
+next report_progress(), which then raises OperationCancelled.
+"""
+import time
+import logging
+import threading
+
+from concurrent import futures
+
+LOGGER = logging.getLogger(__name__)
+
+# default number of operations that can run at once
+MAX_WORKERS = 4
+
+_current = threading.local()
+
+
+class OperationCancelled(RuntimeError):
+    pass
+
+
+class OperationProgress(object):
+    """
+    The progress of one background operation.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.stage = 'queued'
+        self.fraction = 0.0
+        self.submitted = time.time()
+        self.updated = self.submitted
+        self._cancel = threading.Event()
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """
+        :param listener: called as listener(progress) on every update
+        """
+        self._listeners.append(listener)
+
+    def update(self, stage, fraction=None, check_cancel=True):
+        """
+        Note the operation's progress.
+        :param stage: a short description of what it is doing now
+        :param fraction: how much of the operation is done, 0 to 1
+        :param check_cancel: raise if the operation has been cancelled
+        :raises OperationCancelled: if the operation has been cancelled
+        """
+        self.stage = stage
+        if fraction is not None:
+            self.fraction = fraction
+        self.updated = time.time()
+        for listener in self._listeners:
+            try:
+                listener(self)
+            except Exception as e:
+                LOGGER.error('{}: progress listener failed - {}'.format(
+                    self.name, e))
+        if check_cancel and self._cancel.is_set():
+            raise OperationCancelled('{} cancelled during {}'.format(
+                self.name, stage))
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def __str__(self):
+        return '{}: {} ({:.0f}%)'.format(self.name, self.stage,
+                                         self.fraction * 100.0)
+
+
+def report_progress(stage, fraction=None):
+    """
+    Report the progress of the operation running in this thread, if it
+    was started by AsyncOperations.submit.
+    :param stage: a short description of what it is doing now
+    :param fraction: how much of the operation is done, 0 to 1
+    :raises OperationCancelled: if the operation has been cancelled
+    """
+    progress = getattr(_current, 'progress', None)
+    if progress is not None:
+        progress.update(stage, fraction)
+
+
+class AsyncOperations(object):
+    """
+    A shared, bounded pool for running instrument operations in the
+    background. The operations' per-host work still goes through the
+    instrument's host pool, so concurrent operations do not put more
+    than one request in flight on any host.
+    """
+    def __init__(self, max_workers=MAX_WORKERS, logger=None):
+        """
+        :param max_workers: how many operations can run at once
+        :param logger:
+        :return:
+        """
+        self.logger = logger or LOGGER
+        self._executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._active = set()
+
+    def submit(self, name, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) in the background.
+        :param name: a name for the operation, for its progress
+        :param fn: the operation
+        :return: a concurrent.futures.Future, with the operation's
+        OperationProgress as its progress attribute
+        """
+        progress = OperationProgress(name)
+        future = self._executor.submit(self._run, progress, fn, args, kwargs)
+        future.progress = progress
+        with self._lock:
+            self._active.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _run(self, progress, fn, args, kwargs):
+        previous = getattr(_current, 'progress', None)
+        _current.progress = progress
+        try:
+            progress.update('running')
+            rv = fn(*args, **kwargs)
+        except OperationCancelled as e:
+            self.logger.info(str(e))
+            raise
+        except Exception as e:
+            self.logger.error('{} failed - {}'.format(progress.name, e))
+            raise
+        finally:
+            _current.progress = previous
+        # the operation has finished, so a late cancel cannot stop it now
+        progress.update('done', 1.0, check_cancel=False)
+        return rv
+
+    def _done(self, future):
+        with self._lock:
+            self._active.discard(future)
+
+    @staticmethod
+    def cancel(future):
+        """
+        Cancel an operation, whether it has started or not.
+        :return: True if it will not run to completion
+        """
+        if future.cancel():
+            return True
+        if future.done():
+            return False
+        future.progress.cancel()
+        return True
+
+    def active(self):
+        """
+        :return: the OperationProgress of each operation that is queued or
+        running
+        """
+        with self._lock:
+            return [future.progress for future in self._active]
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            for future in self._active:
+                self.cancel(future)
+        self._executor.shutdown(wait=wait)
+
+# end
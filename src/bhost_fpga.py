@@ -7,12 +7,51 @@ Author: Jason Manley, Andrew Martens, Ruby van Rooyen, Monika Obrocka
 
 from logging import INFO
 import numpy as np
-import struct
 
 from xhost_fpga import FpgaXHost
 # from corr2LogHandlers import getLogger
 
 
+def beam_steering_coeffs(delays, phases, host_indices, num_hosts,
+                         beng_per_host, n_chans):
+    """
+    Work out the beam steering coefficients for every host, b-engine and
+    input in one go.
+    :param delays: the delay for each input, in samples
+    :param phases: the phase offset for each input, in radians
+    :param host_indices: the indices of the hosts to work out
+    :param num_hosts: the number of b-engine hosts in the system
+    :param beng_per_host: b-engines per host
+    :param n_chans: channels in the system
+    :return: an int16 array (hosts, b-engines, inputs * 4) of the base
+        phase (real, imag) and phase increment per channel (real, imag)
+        for each input, scaled to 16 bits
+    """
+    # phase change across the band for the delay specified (radians)
+    # negative slope for positive delay
+    slope = -np.asarray(delays, dtype=np.float64) * np.pi
+    phases = np.asarray(phases, dtype=np.float64)
+    # offset of each host in the range [-0.5:0.5) over the band
+    # (the delay is calculated for the centre of our band)
+    host_offset = np.asarray(host_indices, dtype=np.float64) / num_hosts - 0.5
+    # the base phase steps by the same amount from one b-engine to the next
+    beng_offset = np.arange(beng_per_host, dtype=np.float64) / (
+        num_hosts * beng_per_host)
+    total_phase = (host_offset[:, None, None] + beng_offset[None, :, None]) * \
+        slope[None, None, :] + phases[None, None, :]
+    phase_base = np.exp(1.0j * total_phase)
+    # the increment per frequency is the same for every b-engine
+    phase_inc = np.exp(1.0j * (slope / n_chans))
+    coeffs = np.empty(phase_base.shape + (4,))
+    coeffs[..., 0] = phase_base.real
+    coeffs[..., 1] = phase_base.imag
+    coeffs[..., 2] = phase_inc.real
+    coeffs[..., 3] = phase_inc.imag
+    coeffs = np.clip(np.trunc(coeffs * 2**15), -32768, 32767)
+    return coeffs.astype(np.int16).reshape(
+        len(host_offset), beng_per_host, -1)
+
+
 class FpgaBHost(FpgaXHost):
     def __init__(self, host, index, katcp_port=7147, bitstream=None,
                  connect=True, config=None, **kwargs):
@@ -41,6 +80,13 @@ class FpgaBHost(FpgaXHost):
 
         self.beng_per_host = self.x_per_fpga
 
+        # beam index -> the weights last requested and written, so they
+        # need not be read back
+        self.beam_weights = {}
+        # beam index -> the weights as last read back from the hardware,
+        # i.e. as the hardware quantised them, None for antennas not read
+        self.beam_weights_hw = {}
+
         self.host_type = 'bhost'
 
     # @classmethod
@@ -63,38 +109,126 @@ class FpgaBHost(FpgaXHost):
             self.host, self.index, beam.index, beam.name,
             beam.destination))
 
-    def beam_weights_set(self, beam_index, weights):
+    def beam_weights_set(self, beam_index, weights, force=False,
+                         tolerance=1e-3):
         """
         Set the beam weights for the given beam and given input labels.
+        Only the weights that differ from the last requested ones are
+        written, and those are read back straight away into
+        beam_weights_hw.
         :param beam_index: The integer offset of the beam on this board.
         :param weights: a list of the weights to set on each input.
+        :param force: write every weight, whatever the shadow copy says
+        :param tolerance: the largest difference between a written and a
+            read back weight that still matches
+        :return: (the number of weights written, True if they all read
+            back as written)
         """
         assert len(weights) == self.n_ants, ('Incorrect number of weights supplied (%i; need %i)' % (len(weights), self.n_ants))
-        for source_index, source_weight in enumerate(weights):
+        shadow = self.beam_weights.get(beam_index)
+        if force or shadow is None:
+            changed = range(self.n_ants)
+        else:
+            changed = [source_index for source_index in range(self.n_ants)
+                       if weights[source_index] != shadow[source_index]]
+        if not changed:
+            return 0, True
+        # forget the shadows until the writes have all gone through
+        self.beam_weights.pop(beam_index, None)
+        actual = self.beam_weights_hw.pop(beam_index, None) or \
+            [None] * self.n_ants
+        for source_index in changed:
+            source_weight = weights[source_index]
             self.registers.bf_weight.write(weight=source_weight,
                     stream=beam_index, antenna=source_index, load_now=0)
             self.registers.bf_weight.write(weight=source_weight,
                     stream=beam_index, antenna=source_index, load_now=1)
-            #self.registers.bf_weight.write(weight=source_weight,
-            #        stream=beam_index, antenna=source_index, load_now=0)
             self.logger.debug(
                 '%s:%i: Beam %i: set antenna(%i) weight(%.5f)' % (
                     self.host, self.index, beam_index,
                     source_index, source_weight))
         self.registers.bf_weight.write(weight=source_weight,
                 stream=beam_index, antenna=source_index, load_now=0)
+        self.beam_weights[beam_index] = list(weights)
+        for source_index in changed:
+            actual[source_index] = self._beam_weight_read(beam_index,
+                                                          source_index)
+        self.beam_weights_hw[beam_index] = actual
+        return len(changed), self._beam_weights_check(beam_index, changed,
+                                                      tolerance)
+
+    def _beam_weight_read(self, beam_index, source_index):
+        """
+        Read one antenna's weight for a beam back from the board.
+        """
+        self.registers.bf_weight.write(weight=0,
+                stream=beam_index, antenna=source_index, load_now=0)
+        return self.registers.bf_valout_bw0.read()['data']['bw0']
 
-    def beam_weights_get(self, beam_index):
+    def _beam_weights_check(self, beam_index, antennas, tolerance):
+        """
+        Compare the read back weights of some antennas with the requested
+        ones, logging any that differ.
+        :return: True if they all matched
+        """
+        shadow = self.beam_weights.get(beam_index)
+        actual = self.beam_weights_hw.get(beam_index)
+        if shadow is None or actual is None:
+            return False
+        mismatched = [source_index for source_index in antennas
+                      if actual[source_index] is None or
+                      abs(actual[source_index] - shadow[source_index]) >
+                      tolerance]
+        if mismatched:
+            self.logger.error('%s:%i: Beam %i: weights for antennas %s do not '
+                              'match what was written.' % (
+                                  self.host, self.index, beam_index,
+                                  mismatched))
+        return not mismatched
+
+    def beam_weights_get(self, beam_index, from_hardware=False):
         """
         Get the beam weights for the given beam_index (offset on this board).
         Returns a list of weights.
+        :param beam_index: The integer offset of the beam on this board.
+        :param from_hardware: read the weights back from the board, rather
+            than return the weights last requested
         """
-        rv = [0 for a in range(self.n_ants)]
-        for source_index in range(self.n_ants):
-            self.registers.bf_weight.write(weight=0,
-                    stream=beam_index, antenna=source_index, load_now=0)
-            rv[source_index] = self.registers.bf_valout_bw0.read()['data']['bw0']
-        return rv
+        shadow = self.beam_weights.get(beam_index)
+        if shadow is not None and not from_hardware:
+            return list(shadow)
+        return [self._beam_weight_read(beam_index, source_index)
+                for source_index in range(self.n_ants)]
+
+    def beam_weights_verify(self, beam_index, tolerance=1e-3):
+        """
+        Check the weights last requested for a beam against the hardware.
+        All the weights are read back into beam_weights_hw; the requested
+        weights are left as they are.
+        :param beam_index: The integer offset of the beam on this board.
+        :param tolerance: the largest difference that still matches
+        :return: True if the hardware matched the requested weights
+        """
+        self.beam_weights_hw[beam_index] = self.beam_weights_get(
+            beam_index, from_hardware=True)
+        return self._beam_weights_check(beam_index, range(self.n_ants),
+                                        tolerance)
+
+    def beam_weights_verified(self, beam_index, tolerance=1e-3):
+        """
+        Whether the weights last read back for a beam, without reading
+        the hardware again, cover every antenna and match the requested
+        weights.
+        :param beam_index: The integer offset of the beam on this board.
+        :param tolerance: the largest difference that still matches
+        :return: True if they do
+        """
+        shadow = self.beam_weights.get(beam_index)
+        actual = self.beam_weights_hw.get(beam_index)
+        if shadow is None or actual is None or None in actual:
+            return False
+        return all(abs(hw - requested) <= tolerance
+                   for hw, requested in zip(actual, shadow))
 
     def beam_quant_gains_set(self, beam_index, new_gain):
         """
@@ -143,149 +277,18 @@ class FpgaBHost(FpgaXHost):
             rv.append(reg.read()['data'])
         return rv
 
-    def beam_delays_set(self, num_hosts, beam_index, coeffs):
+    def beam_delays_set(self, beam_index, coeffs):
         """
-        Set the beam steering coefficients for the given beam and input.
+        Write the beam steering coefficients for the given beam.
         :param beam_index: The integer offset of the beam on this board.
-        :param coeffs: a list of tuples containing the delay settings for all inputs in the form (
-            delay (radians), phase (radians), phase base for host (complex value), phase increment per frequency (
-            complex value)
+        :param coeffs: this host's slice of beam_steering_coeffs(), one row
+            of 16-bit values per b-engine
         """
-        #have used a tuple for coeffs instead of dictionary to save compute resources
-
-        assert len(coeffs) == self.n_ants, \
+        assert coeffs.shape[1] == self.n_ants * 4, \
             'Incorrect number of coeffs supplied (%i supplied; need %i)' % (
-                len(coeffs), self.n_ants)
-
-        #create an array of base phase values for every b-engine
-        phase_base0 = self.n_ants * [0]
-        phase_base1 = self.n_ants * [0]
-        phase_base2 = self.n_ants * [0]
-        phase_base3 = self.n_ants * [0]
-
-        #create an array of phase increment values (the same for every b-engine)
-        phase_inc = self.n_ants * [0]
-
-        #offset of beamformer host fpga in the range [-0.5:0.5) over the band
-        #(the delay is calculated for the centre of our band)
-        host_offset = (float(self.index) / num_hosts) - 0.5
-
-        #go through coefficients for all antennas
-        for ant_index, ant_coeffs in enumerate(coeffs):
-            assert len(ant_coeffs) == 4, \
-                'Incorrect number of coeffs supplied for beam %i input %i, host %i (%i supplied; need 4' % (
-                beam_index, ant_index, self.index, len(ant_coeffs))
-
-            delay = float(ant_coeffs[0])
-            phase = float(ant_coeffs[1])
-
-            #the (pre-calculated) phase base change for each b-engine
-            phase_base_delta = ant_coeffs[2]
-
-            #the pre-calculated phase rotation increment per frequency within each b-engine
-            phase_inc_val = ant_coeffs[3]
-
-            #total phase for base of engine 0
-            total_phase = (host_offset * delay) + phase
-
-            phase_base = np.exp(1.0j * total_phase)
-            phase_base0[ant_index] = phase_base
-
-            #update phase base to base of b-engine 1
-            phase_base = phase_base * phase_base_delta
-            phase_base1[ant_index] = phase_base
-
-            #update phase base to base of b-engine 2
-            phase_base = phase_base * phase_base_delta
-            phase_base2[ant_index] = phase_base
-
-            #update phase base to base of b-engine 3
-            phase_base = phase_base * phase_base_delta
-            phase_base3[ant_index] = phase_base
-
-            #the increment is the same for all b-engines
-            phase_inc[ant_index] = phase_inc_val
-
-        coeffs0 = (self.n_ants * 4) * [0]
-        coeffs1 = (self.n_ants * 4) * [0]
-        coeffs2 = (self.n_ants * 4) * [0]
-        coeffs3 = (self.n_ants * 4) * [0]
-
-        coeffs0[0::4] = [coeff.real for coeff in phase_base0]
-        coeffs0[1::4] = [coeff.imag for coeff in phase_base0]
-        coeffs0[2::4] = [coeff.real for coeff in phase_inc]
-        coeffs0[3::4] = [coeff.imag for coeff in phase_inc]
-
-        #print 'base: %s' %phase_base0
-        #print 'inc: %s' %phase_base0
-        #print 'combined: %s' %coeffs0
-
-        coeffs1[0::4] = [coeff.real for coeff in phase_base1]
-        coeffs1[1::4] = [coeff.imag for coeff in phase_base1]
-        coeffs1[2::4] = [coeff.real for coeff in phase_inc]
-        coeffs1[3::4] = [coeff.imag for coeff in phase_inc]
-
-        coeffs2[0::4] = [coeff.real for coeff in phase_base2]
-        coeffs2[1::4] = [coeff.imag for coeff in phase_base2]
-        coeffs2[2::4] = [coeff.real for coeff in phase_inc]
-        coeffs2[3::4] = [coeff.imag for coeff in phase_inc]
-
-        coeffs3[0::4] = [coeff.real for coeff in phase_base3]
-        coeffs3[1::4] = [coeff.imag for coeff in phase_base3]
-        coeffs3[2::4] = [coeff.real for coeff in phase_inc]
-        coeffs3[3::4] = [coeff.imag for coeff in phase_inc]
-
-        #convert to integer values ready for struct.pack
-        coeffs0 = [coeff * 2**15 for coeff in coeffs0]
-        coeffs1 = [coeff * 2**15 for coeff in coeffs1]
-        coeffs2 = [coeff * 2**15 for coeff in coeffs2]
-        coeffs3 = [coeff * 2**15 for coeff in coeffs3]
-
-        #ensure that values are not outside of max and minimum values
-        for i in range(len(coeffs0)):
-            if(coeffs0[i] > 32767):
-                coeffs0[i] = 32767
-            elif(coeffs0[i] < -32768):
-                coeffs0[i] = -32768
-
-        for i in range(len(coeffs1)):
-            if(coeffs1[i] > 32767):
-                coeffs1[i] = 32767
-            elif(coeffs1[i] < -32768):
-                coeffs1[i] = -32768
-
-        for i in range(len(coeffs2)):
-            if(coeffs2[i] > 32767):
-                coeffs2[i] = 32767
-            elif(coeffs2[i] < -32768):
-                coeffs2[i] = -32768
-
-        for i in range(len(coeffs1)):
-            if(coeffs3[i] > 32767):
-                coeffs3[i] = 32767
-            elif(coeffs3[i] < -32768):
-                coeffs3[i] = -32768
-
-        #convert into 16 bit binary values ready for writing to shared BRAM
-        ss0 = struct.pack('>%ih' % (self.n_ants * 4), *coeffs0)
-        ss1 = struct.pack('>%ih' % (self.n_ants * 4), *coeffs1)
-        ss2 = struct.pack('>%ih' % (self.n_ants * 4), *coeffs2)
-        ss3 = struct.pack('>%ih' % (self.n_ants * 4), *coeffs3)
-
-        #write values out to brams in b-engines
-        bram_name = 'sys0_fbf_beam_steering_coeffs_bram%i' % beam_index
-        self.write(bram_name, ss0, 0)
-        bram_name = 'sys1_fbf_beam_steering_coeffs_bram%i' % beam_index
-        self.write(bram_name, ss1, 0)
-        bram_name = 'sys2_fbf_beam_steering_coeffs_bram%i' % beam_index
-        self.write(bram_name, ss2, 0)
-        bram_name = 'sys3_fbf_beam_steering_coeffs_bram%i' % beam_index
-        self.write(bram_name, ss3, 0)
-
-        #self.logger.debug('%s: host id (%i) beam (%i) antenna (%i) beam steering initial phase %.5f degrees (%.5f,%.5f),
-        #   delta initial phase %.5f degrees (%.5f,%.5f), phase increment %.5f degrees (%.5f,%.5f)' %(
-        #   self.host, self.index, beam_index, ant_index,
-        #   total_phase*(180.0/np.pi), phase_base.real, phase_base.imag,
-        #   np.arctan(phase_base_delta.imag/phase_base_delta.real)*(180.0/np.pi), phase_base_delta.real, phase_base_delta.imag,
-        #   np.arctan(phase_inc.imag/phase_inc.real)*(180.0/np.pi), phase_inc.real, phase_inc.imag)
-        #)
+                coeffs.shape[1] / 4, self.n_ants)
+        # one bulk write of big-endian 16-bit values per b-engine bram
+        for beng, beng_coeffs in enumerate(coeffs):
+            bram_name = 'sys%i_fbf_beam_steering_coeffs_bram%i' % (
+                beng, beam_index)
+            self.write(bram_name, beng_coeffs.astype('>i2').tostring(), 0)
@@ -216,20 +216,24 @@ class MonitoringLoop(object):
         :return:
         """
         status = {}
+        sections = [section for section, check in [
+            ('ct', corner_turner_check), ('cd', coarse_delay_check),
+            ('rx_reorder', rx_reorder_check)] if check]
+        # with a status hub configured this shares the sensor servlet's
+        # reads, otherwise only the sections checked here are read
+        snapshot = self.instrument.status_cache.get(
+            host, max_age_s=self.check_time, sections=sections)
         # check ct & cd
         if corner_turner_check:
             # perform corner-turner check
-            ct_status = host.get_ct_status()
-            status['corner_turner'] = ct_status
+            status['corner_turner'] = snapshot['ct']
         if coarse_delay_check:
             # perform coarse delay check
-            cd_status = host.get_cd_status()
-            status['coarse_delay'] = cd_status
+            status['coarse_delay'] = snapshot['cd']
 
         # check feng rx reorder
         if rx_reorder_check:
-            feng_rx_reorder_status = host.get_rx_reorder_status()
-            status['feng_rx_reorder'] = feng_rx_reorder_status
+            status['feng_rx_reorder'] = snapshot['rx_reorder']
 
         return status
 
@@ -302,21 +306,25 @@ class MonitoringLoop(object):
         """
 
         status = {}
+        sections = [section for section, check in [
+            ('rx_reorder', xeng_rx_reorder_check),
+            ('hmc_reorder', xeng_hmc_reorder_check),
+            ('vacc', xeng_vacc_check)] if check]
+        # as for the f-hosts, only read what is checked if there is no hub
+        snapshot = self.instrument.status_cache.get(
+            host, max_age_s=self.check_time, sections=sections)
         # check xeng rx reorder
 
         if xeng_rx_reorder_check:
-            xeng_rx_reorder_status = host.get_rx_reorder_status()
-            status['xeng_rx_reorder'] = xeng_rx_reorder_status
+            status['xeng_rx_reorder'] = snapshot['rx_reorder']
 
         # check xeng hmc reorder
         if xeng_hmc_reorder_check:
-            xeng_hmc_reorder_status = host.get_hmc_reorder_status()
-            status['xeng_hmc_reorder'] = xeng_hmc_reorder_status
+            status['xeng_hmc_reorder'] = snapshot['hmc_reorder']
 
         # check xeng vacc
         if xeng_vacc_check:
-            xeng_vacc_status = host.get_vacc_status()
-            status['xeng_vacc'] = xeng_vacc_status
+            status['xeng_vacc'] = snapshot['vacc']
 
         return status
 
@@ -0,0 +1,152 @@
+import time
+import logging
+
+from katcp import Sensor
+
+LOGGER = logging.getLogger(__name__)
+
+
+class CounterGroup(object):
+    """
+    A set of hardware counters read together, e.g. one host's GbE error
+    counters, with the previous sample of each so that deltas and rates
+    can be worked out.
+    """
+    def __init__(self, key, names, bits, rules=None):
+        """
+        :param key: the group's key in the engine
+        :param names: the counter names, in the order they are read
+        :param bits: counter width, for wrap handling
+        :param rules: a dict of name -> (condition, status), where
+        condition is 'changed' or 'notchanged' - the equivalent of
+        errif/warnif. Counters without a rule are always NOMINAL.
+        :return:
+        """
+        self.key = key
+        self.names = list(names)
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        self.values = None
+        self.timestamp = None
+        self._last = None
+        # the status for each counter when it has / has not changed
+        self.on_change = [Sensor.NOMINAL] * len(self.names)
+        self.on_same = [Sensor.NOMINAL] * len(self.names)
+        for ctr, name in enumerate(self.names):
+            condition, status = (rules or {}).get(name, (None, None))
+            if condition == 'changed':
+                self.on_change[ctr] = status
+            elif condition == 'notchanged':
+                self.on_same[ctr] = status
+
+    def update(self, values, timestamp=None):
+        """
+        Store a new sample of every counter in the group. A group's first
+        sample, or its first after forget(), has zero deltas. A sample
+        with the same timestamp as the last one, e.g. from a cached status
+        snapshot that has not been re-read, is not a new sample: the last
+        update's results are returned unchanged.
+        :param values: a dict of name -> raw counter value, or a sequence
+        in the order of the group's names
+        :param timestamp: when the counters were read, default now
+        :return: (values, deltas, rates, statuses) lists
+        """
+        if timestamp is not None and timestamp == self.timestamp and \
+                self._last is not None:
+            return self._last
+        if hasattr(values, 'keys'):
+            values = [values[name] for name in self.names]
+        values = [int(value) for value in values]
+        timestamp = time.time() if timestamp is None else timestamp
+        if self.values is None:
+            deltas = [0] * len(values)
+            rates = [0.0] * len(values)
+        else:
+            # modular difference handles the counter wrapping
+            deltas = [(value - previous) & self.mask
+                      for value, previous in zip(values, self.values)]
+            elapsed = timestamp - self.timestamp
+            rates = [delta / elapsed if elapsed > 0 else 0.0
+                     for delta in deltas]
+        self.values = values
+        self.timestamp = timestamp
+        statuses = [on_change if delta != 0 else on_same
+                    for delta, on_change, on_same in
+                    zip(deltas, self.on_change, self.on_same)]
+        self._last = values, deltas, rates, statuses
+        return self._last
+
+    def forget(self):
+        """
+        Treat the next sample as the first.
+        """
+        self.values = None
+        self.timestamp = None
+        self._last = None
+
+    def __len__(self):
+        return len(self.names)
+
+
+class CounterEngine(object):
+    """
+    Central store for the raw error and packet counters of all hosts.
+    Each group keeps its previous sample, so an update works out the
+    deltas (allowing for counter wrap), rates and statuses of the whole
+    group at once, rather than each sensor comparing its own values.
+
+    The groups are a handful of counters each and are updated as each
+    host's read completes, so plain Python is used - numpy's per-call
+    overhead is larger than the work at this size.
+    """
+    def __init__(self, logger=None):
+        """
+        :param logger:
+        :return:
+        """
+        self.logger = logger or LOGGER
+        self.groups = {}
+
+    def group(self, key, names, bits=32, rules=None):
+        """
+        Get a counter group, registering it the first time.
+        :param key: anything hashable, e.g. (hostname, 'network')
+        :param names: the counter names, in the order they are read
+        :param bits: counter width, for wrap handling
+        :param rules: see CounterGroup
+        :return: a CounterGroup
+        """
+        if key not in self.groups:
+            self.groups[key] = CounterGroup(key, names, bits, rules)
+        return self.groups[key]
+
+    def forget(self, key=None):
+        """
+        Treat the next sample of a group (or all groups) as the first,
+        e.g. after the counters have been cleared.
+        :param key: the group's key, None for all groups
+        :return:
+        """
+        if key is None:
+            for group in self.groups.values():
+                group.forget()
+        elif key in self.groups:
+            self.groups[key].forget()
+
+
+def set_counter_sensors(sensors, group, values, statuses):
+    """
+    Set integer sensors from a group update.
+    :param sensors: a dict of counter name -> sensor, or a list in the
+    group's order
+    :param group: the CounterGroup that was updated
+    :param values: the counter values from the update
+    :param statuses: the statuses from the update
+    :return: the worst status that was set
+    """
+    for ctr, name in enumerate(group.names):
+        sensor = sensors[name] if hasattr(sensors, 'keys') else sensors[ctr]
+        sensor.set(value=values[ctr], status=statuses[ctr])
+    return max(statuses) if len(group) else Sensor.NOMINAL
+
+# end
@@ -1,46 +1,76 @@
 from threading import Event
+from collections import namedtuple
 import logging
 
+import numpy
+
 LOGGER = logging.getLogger(__name__)
 
+# the delay rates are shifted down by this much on the FPGA
+DELAY_BITSHIFT = 2 ** 23
+# binary point of the 32-bit delay rate, phase and phase rate registers
+DELAY_REG_BP = 31
+# the register ranges, as fractions
+_MAX_POSITIVE = 1 - 1 / float(2 ** DELAY_REG_BP)
+_MAX_NEGATIVE = -1 + 1 / float(2 ** DELAY_REG_BP)
+
 
 class DelaysUnsetError(Exception):
     pass
 
 
-def process_list(delay_list, sample_rate_hz):
+def _parse_one(delay):
     """
-    Given a list of strings or delay tuples, return a list of delay tuples
-    NOTE: THIS WILL CONVERT SECONDS TO SAMPLES FOR DELAY!
+    A string (delay,rate:phase,rate) or tuple ((delay,rate),(phase,rate))
+    as a list of four floats.
+    """
+    if isinstance(delay, str):
+        bits = delay.strip().split(':')
+        delay = (bits[0].split(','), bits[1].split(','))
+    (delay, delay_rate), (phase, phase_rate) = delay
+    return [float(delay), float(delay_rate), float(phase), float(phase_rate)]
+
+
+def parse_delay_list(delay_list):
+    """
+    Parse a whole list of delay settings in one go.
     :param delay_list: a list of strings (delay,rate:phase,rate) or
         delay tuples ((delay,rate),(phase,rate))
-    :param sample_rate_hz: the sample rate of the incoming data
-    :return: a list of Delay objects
+    :return: an (inputs, 4) array of delay, delay rate, phase, phase rate
     """
-    def process_string(delaystr):
-        bits = delaystr.strip().split(':')
-        delay = bits[0]
-        delay = delay.split(',')
-        delay = (float(delay[0]), float(delay[1]))
-        fringe = bits[1]
-        fringe = fringe.split(',')
-        fringe = (float(fringe[0]), float(fringe[1]))
-        return delay, fringe
-    rv = []
+    if all(isinstance(delay, str) and delay.count(':') == 1 and
+           delay.count(',') == 2 for delay in delay_list):
+        try:
+            flat = ','.join(delay_list).replace(':', ',').split(',')
+            return numpy.array(flat, dtype=numpy.float64).reshape(-1, 4)
+        except ValueError:
+            pass
+    # tuples, or something is wrong - go one at a time to find it
+    coeffs = numpy.zeros((len(delay_list), 4), dtype=numpy.float64)
     for ctr, delay in enumerate(delay_list):
         try:
-            if isinstance(delay, str):
-                delaytup = process_string(delay)
-                LOGGER.debug('input %i update received: %s'%(ctr,delay))
-            else:
-                delaytup = delay
-            rv.append(prepare_delay_vals(delaytup, sample_rate_hz))
-        except:
+            coeffs[ctr] = _parse_one(delay)
+        except Exception:
             errmsg = 'delay.process_list(): given delay \'%s\' at position %i' \
                      ' is not a valid delay setting' % (delay, ctr)
             LOGGER.error(errmsg)
             raise ValueError(errmsg)
-    return rv
+    return coeffs
+
+
+def process_list(delay_list, sample_rate_hz):
+    """
+    Given a list of strings or delay tuples, return a list of delay tuples
+    NOTE: THIS WILL CONVERT SECONDS TO SAMPLES FOR DELAY!
+    :param delay_list: a list of strings (delay,rate:phase,rate) or
+        delay tuples ((delay,rate),(phase,rate))
+    :param sample_rate_hz: the sample rate of the incoming data
+    :return: a list of Delay objects
+    """
+    return [prepare_delay_vals(((delay, delay_rate), (phase, phase_rate)),
+                               sample_rate_hz)
+            for delay, delay_rate, phase, phase_rate in
+            parse_delay_list(delay_list)]
 
 
 def prepare_delay_vals(coefficients, sample_rate):
@@ -59,7 +89,6 @@ def prepare_delay_vals(coefficients, sample_rate):
     # convert delay in time into delay in clock cycles
     delay_s = float(delay_coeff[0]) * sample_rate
     # convert to fractions of a sample
-    import numpy
     phase_offset_s = float(phase_coeff[0])/float(numpy.pi)
     # convert from radians per second to fractions of sample per sample
     delta_phase_offset_s = (float(phase_coeff[1]) / float(numpy.pi) /
@@ -67,6 +96,141 @@ def prepare_delay_vals(coefficients, sample_rate):
     return Delay(delay_s, delay_coeff[1], phase_offset_s, delta_phase_offset_s)
 
 
+# the register words for one input's delay model, and the values they
+# actually represent
+DelayWords = namedtuple('DelayWords', [
+    'delay_whole', 'delay_frac', 'delay_delta', 'phase', 'phase_delta',
+    'act_delay', 'act_delay_delta', 'act_phase', 'act_phase_delta',
+    'saturated'])
+
+
+class DelayBatch(object):
+    """
+    The delay models for all inputs, with the clipping and fixed-point
+    conversion for the delay registers done for every input at once.
+    """
+    FIELDS = ['delay_delta', 'phase', 'phase_delta']
+
+    def __init__(self, delay, delay_delta, phase_offset, phase_offset_delta,
+                 load_mcnt=-1):
+        """
+        :param delay: array of delays, in samples
+        :param delay_delta: array of delay rates, in samples per sample
+        :param phase_offset: array of phases, in fractions of pi radians
+        :param phase_offset_delta: array of phase rates, in fractions of pi
+        radians per sample
+        :param load_mcnt: when to load the models
+        :return:
+        """
+        self.delay = numpy.asarray(delay, dtype=numpy.float64)
+        self.delay_delta = numpy.asarray(delay_delta, dtype=numpy.float64)
+        self.phase_offset = numpy.asarray(phase_offset, dtype=numpy.float64)
+        self.phase_offset_delta = numpy.asarray(phase_offset_delta,
+                                                dtype=numpy.float64)
+        self.load_mcnt = load_mcnt
+        self._to_words()
+
+    @classmethod
+    def from_list(cls, delay_list, sample_rate_hz, load_mcnt=-1):
+        """
+        Make a batch from a ?delays payload.
+        NOTE: THIS WILL CONVERT SECONDS TO SAMPLES FOR DELAY!
+        :param delay_list: a list of strings (delay,rate:phase,rate) or
+            delay tuples ((delay,rate),(phase,rate))
+        :param sample_rate_hz: the sample rate of the incoming data
+        :param load_mcnt: when to load the models
+        :return: a DelayBatch
+        """
+        return cls.from_coeffs(parse_delay_list(delay_list), sample_rate_hz,
+                               load_mcnt)
+
+    @classmethod
+    def from_coeffs(cls, coeffs, sample_rate_hz, load_mcnt=-1):
+        """
+        Make a batch from coefficients parsed by parse_delay_list.
+        :param coeffs: an (n, 4) array of delay (s), delay rate,
+            phase (rad) and phase rate (rad/s)
+        :param sample_rate_hz: the sample rate of the incoming data
+        :param load_mcnt: when to load the models
+        :return: a DelayBatch
+        """
+        return cls(coeffs[:, 0] * sample_rate_hz, coeffs[:, 1],
+                   coeffs[:, 2] / numpy.pi,
+                   coeffs[:, 3] / numpy.pi / sample_rate_hz, load_mcnt)
+
+    @classmethod
+    def from_delays(cls, delays):
+        """
+        Make a batch from Delay objects.
+        """
+        return cls([d.delay for d in delays], [d.delay_delta for d in delays],
+                   [d.phase_offset for d in delays],
+                   [d.phase_offset_delta for d in delays],
+                   delays[0].load_mcnt if delays else -1)
+
+    def _to_words(self):
+        scale = float(2 ** DELAY_REG_BP)
+        # delay: whole samples and a 32-bit fraction
+        self.delay_whole = numpy.trunc(self.delay).astype(numpy.int64)
+        self.delay_frac = numpy.trunc(
+            (self.delay - self.delay_whole) * 2 ** 32).astype(numpy.int64)
+        self.act_delay = self.delay_whole + self.delay_frac / 2.0 ** 32
+        # delay rate, shifted up by what the FPGA shifts down by
+        shifted = self.delay_delta * DELAY_BITSHIFT
+        self.delay_delta_value = numpy.clip(shifted, -1.0, _MAX_POSITIVE)
+        sat_delay_delta = self.delay_delta_value != shifted
+        self.delay_delta_word = numpy.trunc(
+            self.delay_delta_value * scale).astype(numpy.int64)
+        self.act_delay_delta = self.delay_delta_word / scale / DELAY_BITSHIFT
+        # phase
+        self.phase_value = numpy.clip(self.phase_offset, _MAX_NEGATIVE,
+                                      _MAX_POSITIVE)
+        sat_phase = self.phase_value != self.phase_offset
+        self.phase_word = numpy.trunc(
+            self.phase_value * scale).astype(numpy.int64)
+        self.act_phase = self.phase_word / scale
+        # phase rate, also shifted
+        shifted = self.phase_offset_delta * DELAY_BITSHIFT
+        self.phase_delta_value = numpy.clip(shifted, _MAX_NEGATIVE,
+                                            _MAX_POSITIVE)
+        sat_phase_delta = self.phase_delta_value != shifted
+        self.phase_delta_word = numpy.trunc(
+            self.phase_delta_value * scale).astype(numpy.int64)
+        self.act_phase_delta = self.phase_delta_word / scale / DELAY_BITSHIFT
+        self.saturated = {
+            'delay_delta': sat_delay_delta,
+            'phase': sat_phase,
+            'phase_delta': sat_phase_delta,
+        }
+
+    def __len__(self):
+        return len(self.delay)
+
+    def saturated_inputs(self):
+        """
+        :return: the indices of the inputs with any value clipped
+        """
+        clipped = self.saturated['delay_delta'] | self.saturated['phase'] | \
+            self.saturated['phase_delta']
+        return numpy.nonzero(clipped)[0].tolist()
+
+    def words(self, index):
+        """
+        The register words for one input.
+        :param index: the input number
+        :return: a DelayWords
+        """
+        return DelayWords(
+            int(self.delay_whole[index]), int(self.delay_frac[index]),
+            int(self.delay_delta_word[index]),
+            float(self.phase_value[index]),
+            float(self.phase_delta_value[index]),
+            float(self.act_delay[index]), float(self.act_delay_delta[index]),
+            float(self.act_phase[index]), float(self.act_phase_delta[index]),
+            tuple(field for field in self.FIELDS
+                  if self.saturated[field][index]))
+
+
 class Delay(object):
     def __init__(self, delay=0.0, delay_delta=0.0,
                  phase_offset=0.0, phase_offset_delta=0.0,
@@ -0,0 +1,334 @@
+import time
+import heapq
+import logging
+import itertools
+import threading
+
+from delay_trace import HOST_STAGES
+from host_pool import HostPoolError
+
+LOGGER = logging.getLogger(__name__)
+
+# arm a staged model at least this long before its load time
+ARM_LEAD_S = 0.05
+# wait this long after a model's load time before arming the next one
+LOAD_MARGIN_S = 0.05
+
+
+class StagedDelay(object):
+    """
+    One input's delay model, converted to register words and waiting in
+    the queue to be armed.
+    """
+    __slots__ = ['load_mcnt', 'load_time', 'seq', 'words', 'trace',
+                 'staged_at']
+
+    def __init__(self, load_mcnt, load_time, seq, words, trace=None):
+        self.load_mcnt = load_mcnt
+        self.load_time = load_time
+        self.seq = seq
+        self.words = words
+        self.trace = trace
+        self.staged_at = time.time()
+
+    def __lt__(self, other):
+        return (self.load_mcnt, self.seq) < (other.load_mcnt, other.seq)
+
+
+class DelayQueue(object):
+    """
+    Per-input queues of future delay models, ordered by load mcnt.
+
+    Each input has one timed latch, so a model can only be armed once the
+    one before it has loaded. New models, already converted to register
+    words, are handed to a background worker, which arms each input's
+    next model as soon as its latch is free - so models can be sent well
+    ahead of their load times without overwriting each other.
+    """
+    def __init__(self, fops, arm_lead_s=ARM_LEAD_S,
+                 load_margin_s=LOAD_MARGIN_S, tracer=None, logger=None):
+        """
+        :param fops: the FEngineOperations whose inputs are delayed
+        :param arm_lead_s: models closer than this to their load time
+        are too late to arm and are dropped
+        :param load_margin_s: how long after a load to wait before arming
+        the input's next model
+        :param tracer: a delay_trace.DelayTracer to time the updates with
+        :param logger:
+        :return:
+        """
+        self.fops = fops
+        self.tracer = tracer
+        self.arm_lead_s = arm_lead_s
+        self.load_margin_s = load_margin_s
+        self.logger = logger or LOGGER
+        self.queued = 0
+        self.armed = 0
+        self.dropped = 0
+        self._cond = threading.Condition()
+        self._intake = []
+        # input number -> heap of StagedDelays
+        self._pending = {}
+        # input number -> the StagedDelay its latch is armed with
+        self._armed = {}
+        self._seq = itertools.count()
+        self._thread = None
+        self._running = False
+        self._trace_publish_pending = False
+
+    def put(self, delays, load_time, trace=None, input_number=None):
+        """
+        Queue a delay model for all inputs, or for one. Returns straight
+        away, the model is armed in the background.
+        :param delays: a delay.DelayBatch with one model for each input,
+        or a single model if input_number is given, and the load mcnt set
+        :param load_time: the UNIX time of the batch's load mcnt
+        :param trace: the update's delay_trace.DelayTrace, if it is traced
+        :param input_number: the one input to queue the model for, None
+        for all inputs
+        :return:
+        """
+        with self._cond:
+            self._intake.append((delays, load_time, trace, input_number,
+                                 time.time()))
+            self.queued += 1
+            if not self._running:
+                self._start()
+            self._cond.notify()
+
+    def pending(self):
+        """
+        :return: a dict of input number -> the load mcnts still queued
+        """
+        with self._cond:
+            return {input_number: sorted(staged.load_mcnt for staged in heap)
+                    for input_number, heap in self._pending.items() if heap}
+
+    def clear(self):
+        """
+        Drop all models that have not been armed yet.
+        :return:
+        """
+        with self._cond:
+            self._intake = []
+            self._pending = {}
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='delay-queue')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                intake, self._intake = self._intake, []
+            for delays, load_time, trace, input_number, queued in intake:
+                if trace is not None:
+                    self.tracer.stage(trace, 'queue', time.time() - queued)
+                try:
+                    self._stage(delays, load_time, trace, input_number)
+                except Exception as e:
+                    self.logger.error('Dropping delay model for mcnt {} - '
+                                      '{}'.format(delays.load_mcnt, e))
+            with self._cond:
+                due, wake = self._due(time.time())
+            if due:
+                try:
+                    self._arm(due)
+                except Exception as e:
+                    self.logger.error('Error arming delay models - {}'.format(e))
+                continue
+            with self._cond:
+                if self._running and not self._intake:
+                    if wake is None:
+                        self._cond.wait()
+                    else:
+                        self._cond.wait(max(wake - time.time(), 0.001))
+
+    def _stage(self, delays, load_time, trace=None, input_number=None):
+        """
+        Queue a converted model's register words per input.
+        """
+        load_mcnt = delays.load_mcnt
+        if input_number is None:
+            fengines = self.fops.fengines
+            if len(delays) != len(fengines):
+                raise ValueError('Have {} F-engines, received {} delay '
+                                 'coefficient sets.'.format(len(fengines),
+                                                            len(delays)))
+            saturated = delays.saturated_inputs()
+            words = dict((feng.input_number, delays.words(feng.input_number))
+                         for feng in fengines)
+        else:
+            if len(delays) != 1:
+                raise ValueError('Expected one delay coefficient set for '
+                                 'input {}, received {}.'.format(
+                                     input_number, len(delays)))
+            saturated = [input_number] if delays.saturated_inputs() else []
+            words = {input_number: delays.words(0)}
+        if saturated:
+            self.logger.warn('Delay models clipped for inputs {}.'.format(
+                saturated))
+        seq = next(self._seq)
+        with self._cond:
+            for feng in self.fops.fengines:
+                if feng.input_number not in words:
+                    continue
+                staged = StagedDelay(load_mcnt, load_time, seq,
+                                     words[feng.input_number], trace)
+                # a newer model for the same mcnt replaces the old one
+                heap = [other for other in
+                        self._pending.get(feng.input_number, [])
+                        if other.load_mcnt != load_mcnt]
+                heap.append(staged)
+                heapq.heapify(heap)
+                self._pending[feng.input_number] = heap
+
+    def _due(self, now):
+        """
+        Find the models that can be armed now. Call with the lock held.
+        :param now: the time now
+        :return: (a list of (Fengine, StagedDelay) to arm, the next time
+        there will be something to do or None)
+        """
+        due = []
+        wake = None
+        for feng in self.fops.fengines:
+            heap = self._pending.get(feng.input_number)
+            while heap and heap[0].load_time < now + self.arm_lead_s:
+                late = heapq.heappop(heap)
+                self.dropped += 1
+                self.logger.error('{}: dropping delay model for mcnt {}, too '
+                                  'late to arm.'.format(feng.name,
+                                                        late.load_mcnt))
+            if not heap:
+                continue
+            armed = self._armed.get(feng.input_number)
+            if armed is not None and \
+                    armed.load_time + self.load_margin_s > now:
+                if armed.load_mcnt <= heap[0].load_mcnt:
+                    # the latch is busy until this one has loaded
+                    free = armed.load_time + self.load_margin_s
+                    wake = free if wake is None else min(wake, free)
+                    continue
+                # an earlier model overrides the armed one, which goes back
+                # in the queue
+                heapq.heappush(heap, armed)
+            due.append((feng, heapq.heappop(heap)))
+        return due, wake
+
+    def _arm(self, due):
+        """
+        Arm the due models, one host-level load per host, all the hosts
+        at once.
+        """
+        by_host = {}
+        for feng, staged in due:
+            loads = by_host.setdefault(feng.host.host, {})
+            loads.setdefault(staged.load_mcnt, {})[feng.offset] = staged.words
+        hosts = [host for host in self.fops.hosts if host.host in by_host]
+        start = time.time()
+
+        def arm_host(fhost_):
+            rv = []
+            for load_mcnt in sorted(by_host[fhost_.host]):
+                timings = {}
+                loaded = fhost_.delay_set_words(
+                    by_host[fhost_.host][load_mcnt], load_mcnt, timings)
+                rv.append((load_mcnt, loaded, timings, time.time()))
+            return rv
+        try:
+            # ahead of any EQ writes or snapshots queued for the hosts
+            results = self.fops.corr.map_hosts(arm_host, hosts,
+                                               timeout=self.fops.timeout,
+                                               urgent=True)
+        except HostPoolError as e:
+            self.logger.error('Error arming delay models - {}'.format(e))
+            results = e.results
+        # only the hosts that completed have their latches armed. The
+        # others' models are dropped rather than retried, since a timed
+        # out arm may still have reached the latch.
+        armed = [(feng, staged) for feng, staged in due
+                 if feng.host.host in results]
+        with self._cond:
+            previous = {}
+            for feng, staged in armed:
+                previous[feng.input_number] = self._armed.get(feng.input_number)
+                self._armed[feng.input_number] = staged
+        self.armed += len(armed)
+        self.dropped += len(due) - len(armed)
+        if self.tracer is not None:
+            self._trace(armed, results, previous, start)
+        self._publish([feng for feng, _ in armed])
+
+    def _publish(self, fengines):
+        """
+        Update the delay sensors on the IOLoop, since this runs in the
+        queue's worker thread. The trace sensors are only updated once per
+        IOLoop callback, however many arms happened in between.
+        """
+        sensor_manager = self.fops.corr.sensor_manager
+        if not sensor_manager:
+            return
+        publish_trace = False
+        if self.tracer is not None:
+            with self._cond:
+                publish_trace = not self._trace_publish_pending
+                self._trace_publish_pending = True
+
+        def update_sensors():
+            for feng in fengines:
+                sensor_manager.sensors_feng_delays(feng)
+            if publish_trace:
+                with self._cond:
+                    self._trace_publish_pending = False
+                sensor_manager.sensors_delay_trace(self.tracer)
+        ioloop = getattr(self.fops.corr, 'ioloop', None) or \
+            getattr(sensor_manager.katcp_server, 'ioloop', None)
+        if ioloop is None:
+            update_sensors()
+        else:
+            # add_callback is the only thread-safe IOLoop method
+            ioloop.add_callback(update_sensors)
+
+    def _trace(self, due, results, previous, start):
+        """
+        Record the arm timings of the updates that were just armed, and
+        whether the updates they replaced loaded.
+        """
+        staged_by_load = {}
+        for feng, staged in due:
+            staged_by_load[(feng.host.host, staged.load_mcnt)] = staged
+            if staged.trace is not None:
+                self.tracer.stage(staged.trace, 'staged',
+                                  start - staged.staged_at)
+        for host, host_results in results.items():
+            fengs = {feng.offset: feng for feng in self.fops.fengines
+                     if feng.host.host == host}
+            for load_mcnt, loaded, timings, armed_at in host_results:
+                trace = staged_by_load[(host, load_mcnt)].trace
+                if trace is not None:
+                    for name in HOST_STAGES:
+                        if name in timings:
+                            self.tracer.host_stage(trace, host, name,
+                                                   timings[name])
+                    self.tracer.armed(trace, host, armed_at)
+                for offset, success in loaded.items():
+                    input_number = fengs[offset].input_number
+                    replaced = previous.get(input_number)
+                    if replaced is not None:
+                        self.tracer.confirm(replaced.trace, input_number,
+                                            success)
+
+# end
@@ -0,0 +1,218 @@
+import time
+import bisect
+import logging
+import itertools
+import threading
+
+from collections import deque, OrderedDict
+
+from sensor_scheduler import percentile
+
+LOGGER = logging.getLogger(__name__)
+
+# upper edges of the latency histogram buckets, in ms - the last bucket
+# holds everything slower
+HISTOGRAM_EDGES_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+# the stages of a delay update, in order
+STAGES = ['request', 'queue', 'parse', 'process', 'staged',
+          'write', 'check', 'arm']
+
+# the stages timed per host
+HOST_STAGES = ['write', 'check', 'arm']
+
+# recent samples kept per stage, for the percentiles
+SAMPLE_HISTORY = 256
+
+
+class LatencyHistogram(object):
+    """
+    Counts of latencies in fixed buckets, plus recent samples for the
+    percentiles.
+    """
+    def __init__(self, edges_ms=None):
+        self.edges_ms = edges_ms or HISTOGRAM_EDGES_MS
+        self.counts = [0] * (len(self.edges_ms) + 1)
+        self.samples = deque(maxlen=SAMPLE_HISTORY)
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(self.edges_ms, seconds * 1000.0)] += 1
+        self.samples.append(seconds)
+
+    def stats(self):
+        return {
+            'count': sum(self.counts),
+            'p50': percentile(self.samples, 0.5),
+            'p95': percentile(self.samples, 0.95),
+            'max': max(self.samples) if self.samples else 0.0,
+            'histogram': ','.join(str(count) for count in self.counts),
+        }
+
+
+class DelayTrace(object):
+    """
+    The timing of one delay update through each stage, from the request
+    to the confirmation that it loaded.
+    """
+    def __init__(self, trace_id, load_mcnt, load_time):
+        self.trace_id = trace_id
+        self.load_mcnt = load_mcnt
+        self.load_time = load_time
+        self.received = time.time()
+        self.stages = OrderedDict()
+        # host -> stage -> seconds
+        self.hosts = {}
+        # host -> seconds between that host's arm and the load time
+        self.margins = {}
+        # input number -> True if it loaded, filled in by the next update
+        self.loaded = {}
+        self.late = False
+
+    def stage(self, name, seconds):
+        self.stages[name] = max(self.stages.get(name, 0.0), seconds)
+
+    def host_stage(self, host, name, seconds):
+        self.hosts.setdefault(host, OrderedDict())[name] = seconds
+        self.stage(name, seconds)
+
+    @property
+    def margin(self):
+        """
+        The smallest time between an arm and the load, None if not armed.
+        """
+        return min(self.margins.values()) if self.margins else None
+
+    @property
+    def confirmed(self):
+        """
+        True if all inputs loaded, False if any did not, None if not known
+        yet.
+        """
+        if not self.loaded:
+            return None
+        return all(self.loaded.values())
+
+    def as_dict(self):
+        return {
+            'id': self.trace_id, 'load_mcnt': self.load_mcnt,
+            'load_time': self.load_time, 'received': self.received,
+            'stages': dict(self.stages),
+            'hosts': {host: dict(stages) for host, stages in self.hosts.items()},
+            'margin': self.margin, 'late': self.late,
+            'confirmed': self.confirmed,
+        }
+
+    def __str__(self):
+        stages = ' '.join('{}={:.1f}ms'.format(name, seconds * 1000.0)
+                          for name, seconds in self.stages.items())
+        margin = self.margin
+        return '#{} mcnt {}: {} margin={} late={} loaded={}'.format(
+            self.trace_id, self.load_mcnt, stages,
+            'none' if margin is None else '{:.1f}ms'.format(margin * 1000.0),
+            self.late, self.confirmed)
+
+
+class DelayTracer(object):
+    """
+    Tags each delay update with an ID, keeps the last few traces and
+    histograms of the time spent in each stage, overall and per host.
+    Updates armed less than late_margin_s before their load time are
+    flagged late.
+    """
+    def __init__(self, history=100, late_margin_s=0.1, logger=None):
+        """
+        :param history: how many traces to keep
+        :param late_margin_s: flag updates armed closer than this to their
+        load time
+        :param logger:
+        :return:
+        """
+        self.late_margin_s = late_margin_s
+        self.logger = logger or LOGGER
+        self.traces = deque(maxlen=history)
+        self.stage_histograms = {name: LatencyHistogram() for name in STAGES}
+        self.stage_histograms['margin'] = LatencyHistogram()
+        self.host_histograms = {}
+        self.late = 0
+        self.failed_loads = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start(self, load_mcnt, load_time):
+        """
+        Start tracing a new delay update.
+        :return: the DelayTrace
+        """
+        trace = DelayTrace(next(self._ids), load_mcnt, load_time)
+        with self._lock:
+            self.traces.append(trace)
+        return trace
+
+    def stage(self, trace, name, seconds):
+        trace.stage(name, seconds)
+        with self._lock:
+            self.stage_histograms[name].add(seconds)
+
+    def host_stage(self, trace, host, name, seconds):
+        """
+        Record one host's time in a stage, in both the host's and the
+        overall histograms. The trace keeps the slowest host's time for
+        the stage.
+        """
+        trace.host_stage(host, name, seconds)
+        with self._lock:
+            histograms = self.host_histograms.setdefault(
+                host, {stage: LatencyHistogram() for stage in HOST_STAGES})
+            histograms[name].add(seconds)
+            self.stage_histograms[name].add(seconds)
+
+    def armed(self, trace, host, armed_at=None):
+        """
+        Note when a host finished arming an update.
+        """
+        armed_at = time.time() if armed_at is None else armed_at
+        margin = trace.load_time - armed_at
+        trace.margins[host] = margin
+        with self._lock:
+            self.stage_histograms['margin'].add(max(margin, 0.0))
+        if margin < self.late_margin_s and not trace.late:
+            trace.late = True
+            self.late += 1
+            self.logger.warning('Delay update {} armed on {} only {:.1f}ms '
+                                'before its load time.'.format(
+                                    trace.trace_id, host, margin * 1000.0))
+
+    def confirm(self, trace, input_number, loaded):
+        """
+        Record whether an update loaded on an input, as read when the
+        input's next update is armed.
+        """
+        if trace is None:
+            return
+        trace.loaded[input_number] = loaded
+        if not loaded:
+            self.failed_loads += 1
+
+    def last(self, count=None):
+        """
+        :param count: how many traces, default all that are kept
+        :return: the most recent traces, oldest first
+        """
+        with self._lock:
+            traces = list(self.traces)
+        return traces if count is None else traces[-count:]
+
+    def stats(self):
+        """
+        :return: a dict of stage -> stats and a dict of host -> stage ->
+        stats, see LatencyHistogram.stats
+        """
+        with self._lock:
+            stages = {name: histogram.stats()
+                      for name, histogram in self.stage_histograms.items()}
+            hosts = {host: {name: histogram.stats()
+                            for name, histogram in histograms.items()}
+                     for host, histograms in self.host_histograms.items()}
+        return stages, hosts
+
+# end
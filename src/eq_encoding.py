@@ -0,0 +1,92 @@
+"""
+Compact text encodings of an F-engine's EQ, used for the <input>-eq
+sensors instead of a list of n_chans complex values:
+
+    poly c0,c1,...          polynomial coefficients, in numpy.polyval order,
+                            evaluated per channel and quantised as
+                            set_eq does. Only used if that gives exactly
+                            the words in the BRAM.
+    rle n*value n*value...  runs of n channels with the same value
+    b64 <data>              base64 of big-endian int16 real, imag pairs,
+                            one pair per channel
+"""
+import base64
+
+import numpy
+
+# use run-length encoding if there are no more runs than this
+MAX_RUNS = 64
+
+
+def _complex_str(value):
+    """
+    A complex value as a string complex() can parse, without brackets.
+    """
+    value = complex(value)
+    return '{!r}{}{!r}j'.format(value.real, '+' if value.imag >= 0 else '',
+                                value.imag)
+
+
+def _poly_words(coeffs, n_chans):
+    """
+    A polynomial EQ as the int16 words set_eq would write for it.
+    """
+    values = numpy.polyval(coeffs, numpy.arange(n_chans)).astype(
+        numpy.complex128)
+    words = numpy.empty(n_chans * 2)
+    words[0::2] = values.real
+    words[1::2] = values.imag
+    return numpy.trunc(numpy.clip(words, -32767, 32767)).astype('>i2')
+
+
+def encode_eq(words, poly=None):
+    """
+    Encode an EQ compactly.
+    :param words: the EQ as big-endian int16, real and imag for each channel
+    :param poly: the polynomial the EQ was made from, if it was. It is
+    only used if evaluating it again gives exactly these words.
+    :return: the encoded string
+    """
+    if poly is not None:
+        encoded = ','.join(_complex_str(coeff) for coeff in poly)
+        coeffs = [complex(coeff) for coeff in encoded.split(',')]
+        if numpy.array_equal(_poly_words(coeffs, len(words) // 2), words):
+            return 'poly ' + encoded
+    pairs = numpy.asarray(words).reshape(-1, 2)
+    changes = numpy.nonzero(numpy.any(pairs[1:] != pairs[:-1], axis=1))[0] + 1
+    if len(changes) < MAX_RUNS:
+        starts = [0] + changes.tolist()
+        stops = changes.tolist() + [len(pairs)]
+        return 'rle ' + ' '.join(
+            '{}*{}'.format(stop - start, _complex_str(
+                complex(pairs[start][0], pairs[start][1])))
+            for start, stop in zip(starts, stops))
+    return 'b64 ' + base64.b64encode(
+        numpy.asarray(words).astype('>i2').tostring())
+
+
+def decode_eq(value, n_chans=None):
+    """
+    Decode an EQ encoded by encode_eq.
+    :param value: the encoded string, e.g. an <input>-eq sensor value
+    :param n_chans: the number of channels, needed for polynomials
+    :return: a complex numpy array, one value per channel
+    """
+    kind, _, data = value.partition(' ')
+    if kind == 'poly':
+        if n_chans is None:
+            raise ValueError('Need n_chans to decode a polynomial EQ.')
+        coeffs = [complex(coeff) for coeff in data.split(',')]
+        words = _poly_words(coeffs, n_chans)
+        return words[0::2] + 1j * words[1::2].astype(numpy.float64)
+    elif kind == 'rle':
+        runs = [run.split('*') for run in data.split()]
+        return numpy.concatenate([
+            numpy.full(int(count), complex(run_value), numpy.complex128)
+            for count, run_value in runs])
+    elif kind == 'b64':
+        words = numpy.frombuffer(base64.b64decode(data), dtype='>i2')
+        return words[0::2] + 1j * words[1::2].astype(numpy.float64)
+    raise ValueError('Unknown EQ encoding {}'.format(kind))
+
+# end
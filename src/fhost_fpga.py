@@ -1,15 +1,23 @@
 import time
 from logging import INFO
-import struct
+import numpy
 
 import casperfpga.memory as caspermem
 from casperfpga.transport_skarab import SkarabTransport
 
 import delay as delayops
 from utils import parse_slx_params
+from eq_encoding import encode_eq
+from quant_snapshot import interleave_fields, snap_complex, \
+    QuantSnapshotCapture
 from host_fpga import FpgaHost
 # from corr2LogHandlers import getLogger
 
+# EQ writes: changed channels this close together go in one write, and
+# more separate runs than this means the whole BRAM is rewritten
+EQ_WRITE_GAP = 16
+EQ_WRITE_MAX_RUNS = 32
+
 #TODO: move snapshots from fhost obj to feng obj?
 #   -> not sensible while trig_time registers are shared for adc snapshots.
 
@@ -32,19 +40,31 @@ class InputNotFoundError(ValueError):
 
 class AdcData(object):
     """
-    Container for lists of ADC data
+    Container for arrays of ADC data
     """
     def __init__(self, timestamp, data):
         """
 
         :param timestamp: int, system time at which the data was read
-        :param data: a list of the data, sample-by-sample
+        :param data: a numpy array of the data, sample-by-sample
         :return:
         """
         self.timestamp = timestamp
         self.data = data
 
 
+def _adc_samples(samples):
+    """
+    The smallest signed integer array that holds the ADC samples, or
+    float32 if the snapshot gave fractional values.
+    """
+    if not numpy.all(numpy.mod(samples, 1) == 0):
+        return samples.astype(numpy.float32)
+    if len(samples) == 0 or (samples.min() >= -128 and samples.max() <= 127):
+        return samples.astype(numpy.int8)
+    return samples.astype(numpy.int16)
+
+
 def delay_get_bitshift(bitshift_schedule=23):
     """
     :return: Returns the scale factor used in the delay calculations
@@ -102,6 +122,13 @@ class Fengine(object):
         self.eq_bram_name = 'eq%i' % offset
         self.last_delay = delayops.Delay()
         self.last_eq = None
+        # the EQ BRAM contents last written or read
+        self._eq_words = None
+        # the polynomial the EQ was set from, if it was
+        self.last_eq_poly = None
+        # the planned full-spectrum quantiser snapshot capture, which
+        # keeps the per-window timings of the last capture
+        self.quant_capture = None
 
     @property
     def name(self):
@@ -131,7 +158,6 @@ class Fengine(object):
         :param channel_select: If a value is passed here, a time-series of a single channel is returned, if not, a spectrum is returned.
         :return: a numpy array of complex values
         """
-        import numpy
         if channel_select != -1:
             if channel_select < 0 or channel_select >= self.host.n_chans:
                 raise ValueError("channel_select should be between 0 and {}, but received {}!".format(self.host.n_chans, channel_select))
@@ -140,50 +166,52 @@ class Fengine(object):
             self.host.registers.quant_snap_ctrl.write(single_channel=True, channel_select=chan_group)
             snapshot = self.host.snapshots['snap_quant%i_ss' % self.offset]
             sdata = snapshot.read()['data']
-            compl = numpy.vectorize(complex)(sdata['real{}'.format(which_chan)], sdata['imag{}'.format(which_chan)])
-            return compl
+            return snap_complex(sdata, [which_chan])
         else:
             try:
                 self.host.registers.quant_snap_ctrl.write(single_channel=False)
             except:
                 pass
             snapshot = self.host.snapshots['snap_quant%i_ss'%self.offset]
-            #calculate number of snapshot reads required:
-            n_reads=float(self.host.n_chans)/(2**int(snapshot.block_info['snap_nsamples']))/4
-            compl = []
-            #Quantiser snapshot offset algorim: offset = (required_channel * 8) div 4
-            #Quantiser snapshot depth is 2048, and reads 4 values per clock cycle, to build a snapshot of all channels a trigger offset
-            #must be used. The trigger offset follows this algoritm: (offset div 8)*4 = snap_start_channel, e.g. to start reading at channel
-            #2048 offset should be 2048*8/4=4096
-            for read_n in range(int(numpy.ceil(n_reads))):
-                snap_start_ch = read_n * (2**int(snapshot.block_info['snap_nsamples']))*4
-                offset = snap_start_ch*8/4
-                sdata = snapshot.read(offset=offset)['data']
-                for ctr in range(0, len(sdata['real0'])):
-                    compl.append(complex(sdata['real0'][ctr], sdata['imag0'][ctr]))
-                    compl.append(complex(sdata['real1'][ctr], sdata['imag1'][ctr]))
-                    compl.append(complex(sdata['real2'][ctr], sdata['imag2'][ctr]))
-                    compl.append(complex(sdata['real3'][ctr], sdata['imag3'][ctr]))
-            return compl[0:self.host.n_chans]
+            if self.quant_capture is None or \
+                    self.quant_capture.snapshot is not snapshot or \
+                    self.quant_capture.n_chans != self.host.n_chans:
+                self.quant_capture = QuantSnapshotCapture(
+                    snapshot, self.host.n_chans, self.logger)
+            return self.quant_capture.capture()
 
     def delay_set(self, delay_obj):
         """
         Configures a given stream to a delay, defined by a delay.Delay object.
         Delay units should be samples, and phase is in fractions of pi radians.
         This function will also update this feng object's self.last_delay.
-        :return: nothing!
+        This writes the timed latch directly, bypassing the instrument's
+        delay queue: a model the queue arms later will replace it. Use
+        FEngineOperations.delay_set on a running instrument.
+        :return: True if the previous delay model loaded
         """
         self.logger.debug("Processing request for delay model: {}.".format(delay_obj.__str__()))
-        rv=True
-        self.last_delay.last_load_success=False
-        # set up the delays and update the stored values
+        words = delayops.DelayBatch.from_delays([delay_obj]).words(0)
+        return self.delay_set_words(words, delay_obj.load_mcnt)
 
-        self.last_delay.delay = self._delay_write_delay(delay_obj.delay)
-        self.last_delay.delay_delta = self._delay_write_delay_rate(delay_obj.delay_delta)
-        self.last_delay.phase_offset = self._delay_write_phase(delay_obj.phase_offset)
-        self.last_delay.phase_offset_delta = self._delay_write_phase_rate(delay_obj.phase_offset_delta)
+    def delay_set_words(self, words, load_mcnt):
+        """
+        Configures this stream's delay from register words already prepared
+        by a delay.DelayBatch, and arms the load at load_mcnt.
+        This function will also update this feng object's self.last_delay.
+        :param words: a delay.DelayWords
+        :param load_mcnt: sample mcnt to load the delay at
+        :return: True if the previous delay model loaded
+        """
+        return self.host.delay_set_words({self.offset: words},
+                                         load_mcnt)[self.offset]
 
-        # arm the timed load latches
+    def _delay_check_load(self):
+        """
+        Check that the previous delay model loaded, from the timed latch
+        status, and update self.last_delay's counts.
+        :return: True if it loaded
+        """
         status=self.host.registers['tl_cd%i_status'%self.offset].read()['data']
         load_count=status['load_count']
         arm_count=status['arm_count']
@@ -201,155 +229,40 @@ class Fengine(object):
             self.last_delay.last_load_success=False
         self.last_delay.load_count = load_count
         self.last_delay.arm_count = arm_count
-        self.last_delay.load_mcnt=self._arm_timed_latch(mcnt=delay_obj.load_mcnt)
-        self.logger.debug("New delay model applied: {}".format(self.last_delay.__str__()))
         return self.last_delay.last_load_success
 
     def _arm_timed_latch(self, mcnt):
         """
         Arms the delay correction timed latch.
-        Optimisations bypass normal register bitfield operations.
-        :param names: name of latch to trigger
         :param mcnt: sample mcnt to trigger at.
-        :return ::
+        :return: the mcnt the latch was armed for
         """
-        control1_reg = self.host.registers['delay%i_tl_control1' % self.offset]
-        control0_reg = self.host.registers['delay%i_tl_control0' % self.offset]
-        ao=control0_reg._fields['arm'].offset
-        #TODO: don't floor the timestamp, but round it sanely.
-        mcnt_rounded = (int(mcnt)>>self.host.timestamp_decimation)<<self.host.timestamp_decimation
-        self.logger.debug('Requested load mcnt %i rounded to %i.'%(mcnt,mcnt_rounded))
-        load_time_lsw = mcnt_rounded - (int(mcnt_rounded/(2**32)))*(2**32)
-        load_time_msw = int(mcnt_rounded/(2**32))
-        control1_reg.write_int(load_time_lsw)
-        control0_reg.write_int((1<<ao)+(load_time_msw))
-        control0_reg.write_int((0<<ao)+(load_time_msw))
-        return mcnt_rounded
-
-    def _delay_write_delay(self, delay):
-        """
-        delay is in samples. Can be fractional.
-        """
-        delay_whole = int(delay)
-        delay_frac = delay - delay_whole
-        
-        prep_whole = delay_whole
-        prep_frac = int((delay_frac*(2**32)))
+        return self.host.delay_arm_latches([self.offset], mcnt)
 
-        delay_reg_whole = self.host.registers['delay_whole%i' % self.offset].write_int(prep_whole)
-        delay_reg_frac = self.host.registers['delay_frac%i' % self.offset].write_int(prep_frac)
-
-        self.logger.debug('Setting delay_whole register to 0x%08x, from request for %i samples.' % (prep_whole,delay_whole))
-        self.logger.debug('Setting delay_frac register to 0x%08x, from request for %f samples.' % (prep_frac,delay_frac))
-        
-        act_value = prep_whole + (prep_frac/(2.0**32))
-
-        return act_value
-
-    def _delay_write_delay_rate(self, delay_rate):
-        """
-        Rate is unitless (eg in samples/sample).
-        Range: -1.0 to +1.0
-        """
-        bitshift = delay_get_bitshift(bitshift_schedule=23)
-        delay_delta_reg = self.host.registers['delta_delay%i' % self.offset]
-        # shift up by amount shifted down by on fpga
-        delta_delay_shifted = float(delay_rate) * bitshift
-
-        #figure out register offsets and widths
-        #reg_bp = delay_delta_reg._fields['delta'].binary_pt
-        #reg_bw = delay_delta_reg._fields['delta'].width_bits
-        reg_bp = 31
-        reg_bw = 32
-
-        #figure out maximum range, and clip if necessary:
-        max_positive_delta_delay = 2 ** (reg_bw - reg_bp - 1) - 1 / float(2 ** reg_bp)
-        #max_negative_delta_delay = -2 ** (reg_bw - reg_bp - 1) + 1 / float(2 ** reg_bp)
-        max_negative_delta_delay = -1.
-        if delta_delay_shifted > max_positive_delta_delay:
-            delta_delay_shifted = max_positive_delta_delay
-            self.logger.warn('Setting largest possible positive delay delta. ' \
-                             'Requested: %e samples/sample, set %e.'%
-                             (delay_rate,max_positive_delta_delay/bitshift))
-        elif delta_delay_shifted < max_negative_delta_delay:
-            delta_delay_shifted = max_negative_delta_delay
-            self.logger.warn('Setting largest possible negative delay delta. ' \
-                             'Requested: %e samples/sample, set %e.'%
-                             (delay_rate,max_negative_delta_delay/bitshift))
-
-        prep_int=int(delta_delay_shifted*(2**reg_bp))
-        act_value = (float(prep_int)/(2**reg_bp))/bitshift
-        self.logger.debug('Setting delay delta to %e samples/sample (reg 0x%08X), mapped from %e samples/sample request.' %(act_value, prep_int,delay_rate))
-        delay_delta_reg.write_int(prep_int)
-        return act_value
-
-    def _delay_write_phase(self, phase):
-        """
-        Phase is in fractions of pi radians (-1 to 1 corresponds to -180degrees to +180 degrees).
-        :return:
+    def _delay_write_words(self, words):
         """
-        phase_reg = self.host.registers['phase%i' % self.offset]
-
-        #figure out register offsets and widths
-        initial_reg_bp = 31 #phase_reg._fields['initial'].binary_pt
-        initial_reg_bw = 32 #phase_reg._fields['initial'].width_bits
-
-        # setup the phase offset
-        max_positive_phase = 2 ** (initial_reg_bw - initial_reg_bp - 1) - 1 / float(2 ** initial_reg_bp)
-        max_negative_phase = -2 ** (initial_reg_bw - initial_reg_bp - 1) + 1 / float(2 ** initial_reg_bp)
-        if phase > max_positive_phase:
-            self.logger.warn('Setting largest possible positive phase. '
-                        'Requested: %e*pi radians, set %e.' %
-                        (phase, max_positive_phase))
-            phase = max_positive_phase
-        elif phase < max_negative_phase:
-            self.logger.warn('Setting largest possible negative phase. '
-                        'Requested: %e*pi radians, set %e.' %
-                        (phase, max_negative_phase))
-            phase = max_negative_phase
-
-        prep_int_initial=int(phase*(2**initial_reg_bp))
-
-        act_value_initial = (float(prep_int_initial)/(2**initial_reg_bp))
-        #if phase<0: act_value_initial-=(2**initial_reg_bw)  # Seems to me as though this shouldn't be here. (JS)
-        self.logger.debug('Writing initial phase to %e*pi radians (reg: 0x%08X), mapped from %e request.' % (act_value_initial,prep_int_initial,phase))
-        # actually write the values to the register
-        phase_reg.write(initial=phase)
-        return act_value_initial
-
-    def _delay_write_phase_rate(self, phase_rate):
-        """
-        Phase rate is in pi radians/sample. (eg value of 0.5 would increment phase by 0.5*pi radians every sample)
+        Write the delay, delay rate, phase and phase rate registers.
+        :param words: a delay.DelayWords
         :return:
         """
-        bitshift = delay_get_bitshift()
-        phase_rate_reg = self.host.registers['phase_rate%i' % self.offset]
-
-        #figure out register offsets and widths
-        delta_reg_bp = 31 #phase_reg._fields['delta'].binary_pt
-        delta_reg_bw = 32 #phase_reg._fields['delta'].width_bits
-
-        #setup phase delta/rate:
-        # shift up by amount shifted down by on fpga
-        max_positive_delta_phase = 2 ** (delta_reg_bw - delta_reg_bp - 1) - 1 / float(2 ** delta_reg_bp)
-        max_negative_delta_phase = -2 ** (delta_reg_bw - delta_reg_bp - 1) + 1 / float(2 ** delta_reg_bp)
-        delta_phase_shifted = float(phase_rate) * bitshift
-        if delta_phase_shifted > max_positive_delta_phase:
-            dp = max_positive_delta_phase / bitshift
-            self.logger.warn('Setting largest possible positive phase delta. '
-                        'Requested %e*pi radians/sample, set %e.' % (phase_rate, dp))
-            delta_phase_shifted = max_positive_delta_phase
-        elif delta_phase_shifted < max_negative_delta_phase:
-            dp = max_negative_delta_phase / bitshift
-            self.logger.warn('Setting largest possible negative phase delta. '
-                        'Requested %e*pi radians/sample, set %e.' % (phase_rate, dp))
-            delta_phase_shifted = max_negative_delta_phase
-
-        prep_int_delta=int(delta_phase_shifted*(2**delta_reg_bp))
-        act_value_delta = (float(prep_int_delta)/(2**delta_reg_bp))/bitshift
-        self.logger.debug('Writing %e*pi radians/sample phase delta (reg: 0x%08X), mapped from %e*pi request.' % (act_value_delta,prep_int_delta,phase_rate))
-        phase_rate_reg.write(delta=delta_phase_shifted)
-        return act_value_delta
+        self.last_delay.last_load_success=False
+        if words.saturated:
+            self.logger.warn('Delay model clipped to the largest possible '
+                             '{}: {}'.format(', '.join(words.saturated), words))
+        # the tl_cd status read checks the load, so skip the read-backs
+        self.host.registers['delay_whole%i' % self.offset].write_int(
+            words.delay_whole, blindwrite=True)
+        self.host.registers['delay_frac%i' % self.offset].write_int(
+            words.delay_frac, blindwrite=True)
+        self.host.registers['delta_delay%i' % self.offset].write_int(
+            words.delay_delta, blindwrite=True)
+        self.host.registers['phase%i' % self.offset].write(initial=words.phase)
+        self.host.registers['phase_rate%i' % self.offset].write(delta=words.phase_delta)
+        self.last_delay.delay = words.act_delay
+        self.last_delay.delay_delta = words.act_delay_delta
+        self.last_delay.phase_offset = words.act_phase
+        self.last_delay.phase_offset_delta = words.act_phase_delta
+        self.logger.debug('Wrote delay registers: {}'.format(words))
 
     def get_eq(self):
         """
@@ -358,33 +271,31 @@ class Fengine(object):
         """
         # eq vals are packed as 32-bit complex (16 real, 16 imag)
         eqvals = self.host.read(self.eq_bram_name, self.host.n_chans*4)
-        eqvals = struct.unpack('>%ih' % (self.host.n_chans*2), eqvals)
-        eqcomplex = []
-        for ctr in range(0, len(eqvals), 2):
-            eqcomplex.append(eqvals[ctr] + (1j * eqvals[ctr+1]))
-        self.last_eq=eqcomplex
+        words = numpy.frombuffer(eqvals, dtype='>i2')
+        if self._eq_words is None or \
+                not numpy.array_equal(words, self._eq_words):
+            self.last_eq_poly = None
+        # what is in the bram now, for the next set_eq to compare against
+        self._eq_words = words.copy()
+        eqcomplex = words[0::2] + 1j * words[1::2].astype(numpy.float64)
+        self.last_eq = eqcomplex.tolist()
         return self.last_eq
 
-    def set_eq(self, eq_poly=None):
+    def _eq_coeffs(self, eq_poly):
         """
-        Write a given complex eq to the given SBRAM.
-        WARN: hardcoded for 16b values!
-
-        :param eq_poly: a list of polynomial coefficients, or list of float values (must be n_chans long) to write to bram. Set to string 'auto' to have system attempt to automatically set gains (requires sane values to have been set beforehand!).
-        :return:
+        Work out the complex EQ value for each channel.
+        :param eq_poly: see set_eq
+        :return: a complex numpy array, one value per channel
         """
-        coeffs = (self.host.n_chans * 2) * [0]
-        if eq_poly==None:
-            self.logger.debug('Setting default eq')
-            eq_poly=int(self.host._config['default_eq_poly'])
+        n_chans = self.host.n_chans
+        coeffs = numpy.zeros(n_chans, dtype=numpy.complex128)
         try:
-            if eq_poly == 'auto':
-                import numpy
+            if isinstance(eq_poly, basestring) and eq_poly == 'auto':
                 target_output=0.1 #this is the goal for numpy.abs(complex_snapshot). For 8.7bit meerkat, total range is thus sqrt((abs(1+1j)))=1.4
                 n_averages=30
 
                 #get an estimate of the current spectrum:
-                chans = range(self.host.n_chans)
+                chans = numpy.arange(n_chans)
                 quant_snapshot = numpy.abs(self.get_quant_snapshot())
                 for i in range(n_averages):
                     quant_snapshot += numpy.abs(self.get_quant_snapshot())
@@ -393,52 +304,115 @@ class Fengine(object):
                 error=target_output/quant_snapshot
 
                 #ignore band edges; only use central 80%:
-                start_chan=int(self.host.n_chans*0.1)
-                stop_chan=int(self.host.n_chans*0.9)
+                start_chan=int(n_chans*0.1)
+                stop_chan=int(n_chans*0.9)
                 eq_poly=numpy.polyfit(chans[start_chan:stop_chan],error[start_chan:stop_chan],3)
-                poly_coeffs=numpy.array(self.get_eq())*numpy.polyval(eq_poly,chans)
-                coeffs[0::2] = [coeff.real for coeff in poly_coeffs]
-                coeffs[1::2] = [coeff.imag for coeff in poly_coeffs]
-                
-            elif len(eq_poly) == self.host.n_chans:
+                coeffs[:] = numpy.array(self.get_eq())*numpy.polyval(eq_poly,chans)
+            elif len(eq_poly) == n_chans:
                 # list - one for each channel
-                coeffs[0::2] = [coeff.real for coeff in eq_poly]
-                coeffs[1::2] = [coeff.imag for coeff in eq_poly]
-            elif len(eq_poly)<self.host.n_chans:
+                coeffs[:] = eq_poly
+            elif len(eq_poly) < n_chans:
                 # polynomial
-                import numpy
-                poly_coeffs=numpy.polyval(eq_poly, range(self.host.n_chans))
-                coeffs[0::2] = [coeff.real for coeff in poly_coeffs]
-                coeffs[1::2] = [coeff.imag for coeff in poly_coeffs]
+                coeffs[:] = numpy.polyval(eq_poly, numpy.arange(n_chans))
         except TypeError:
-                #single value?
-                coeffs = (self.host.n_chans * 2) * [0]
-                coeffs[0::2] = [eq_poly.real for coeff in range(self.host.n_chans)]
-                coeffs[1::2] = [eq_poly.imag for coeff in range(self.host.n_chans)]
-
-        #Ensure coeffs values can be stored in 16 bits
-        saturated_channels_count=0
-        for i in range(len(coeffs)):
-            if(coeffs[i] > 32767):
-                coeffs[i]=32767
-                saturated_channels_count+=1
-            elif(coeffs[i] < -32767):
-                coeffs[i] =-32767
-                saturated_channels_count+=1
-
-        creal = coeffs[0::2]
-        cimag = coeffs[1::2]
-        ss = struct.pack('>%ih' % (self.host.n_chans * 2), *coeffs)
-        self.host.write(self.eq_bram_name, ss, 0)
-        self.last_eq=[complex(creal[i],cimag[i]) for i in range(self.host.n_chans)]
+            # single value
+            coeffs[:] = eq_poly
+        return coeffs
+
+    def set_eq(self, eq_poly=None, force=False):
+        """
+        Write a given complex eq to the given SBRAM.
+        WARN: hardcoded for 16b values!
+
+        Only the parts of the BRAM that differ from what was last written
+        (or read) are written, unless force is given.
+
+        :param eq_poly: a list of polynomial coefficients, or list of float values (must be n_chans long) to write to bram. Set to string 'auto' to have system attempt to automatically set gains (requires sane values to have been set beforehand!).
+        :param force: write the whole BRAM
+        :return:
+        """
+        n_chans = self.host.n_chans
+        if eq_poly is None:
+            self.logger.debug('Setting default eq')
+            eq_poly=int(self.host._config['default_eq_poly'])
+        coeffs = self._eq_coeffs(eq_poly)
+
+        # interleave real and imag, and ensure they can be stored in 16 bits
+        values = numpy.empty(n_chans * 2)
+        values[0::2] = coeffs.real
+        values[1::2] = coeffs.imag
+        saturated_channels_count = int(numpy.count_nonzero(
+            numpy.abs(values) > 32767))
+        words = numpy.trunc(numpy.clip(values, -32767, 32767)).astype('>i2')
+
+        self._eq_write_words(words, force)
+        self.last_eq_poly = self._eq_poly(eq_poly)
+        eqcomplex = words[0::2] + 1j * words[1::2].astype(numpy.float64)
+        self.last_eq = eqcomplex.tolist()
         if(saturated_channels_count != 0):
             self.logger.warn('EQ values adjusted. %i channels saturated.'%saturated_channels_count)
-        mean_real = sum(creal)/len(creal)
-        mean_imag = sum(cimag)/len(creal)
-        self.logger.info('EQ updated mean (%i+%ij): ...%s...'%(mean_real,mean_imag,self.last_eq[self.host.n_chans/2-3:self.host.n_chans/2+3]))
+        self.logger.info('EQ updated mean (%i+%ij): ...%s...'%(
+            eqcomplex.real.mean(), eqcomplex.imag.mean(),
+            self.last_eq[n_chans/2-3:n_chans/2+3]))
 
         return self.last_eq
 
+    def _eq_poly(self, eq_poly):
+        """
+        The polynomial an EQ setting describes, None for 'auto' or a value
+        per channel.
+        """
+        if isinstance(eq_poly, basestring):
+            return None
+        try:
+            if len(eq_poly) < self.host.n_chans:
+                return [complex(coeff) for coeff in eq_poly]
+            return None
+        except TypeError:
+            return [complex(eq_poly)]
+
+    def eq_encoded(self):
+        """
+        The last EQ written or read, compactly encoded - see eq_encoding.
+        :return: the encoded string, or '' if the EQ is not known
+        """
+        if self._eq_words is None:
+            return ''
+        return encode_eq(self._eq_words, self.last_eq_poly)
+
+    def _eq_write_words(self, words, force=False):
+        """
+        Write the changed parts of the EQ BRAM.
+        :param words: big-endian int16 array, real and imag for each channel
+        :param force: write the whole BRAM
+        :return: the number of channels written
+        """
+        n_chans = len(words) / 2
+        cached = getattr(self, '_eq_words', None)
+        if force or cached is None or len(cached) != len(words):
+            runs = [(0, n_chans)]
+        else:
+            # each channel is one 32-bit word in the bram
+            changed = numpy.nonzero(
+                (words != cached).reshape(-1, 2).any(axis=1))[0]
+            if len(changed) == 0:
+                return 0
+            # contiguous runs of changed channels, with small gaps filled in
+            # so as not to do lots of tiny writes
+            breaks = numpy.nonzero(numpy.diff(changed) > EQ_WRITE_GAP)[0]
+            starts = numpy.concatenate(([changed[0]], changed[breaks + 1]))
+            stops = numpy.concatenate((changed[breaks] + 1, [changed[-1] + 1]))
+            runs = zip(starts, stops)
+            if len(runs) > EQ_WRITE_MAX_RUNS:
+                runs = [(0, n_chans)]
+        # forget the cache if a write fails part way
+        self._eq_words = None
+        for start, stop in runs:
+            self.host.write(self.eq_bram_name,
+                            words[start * 2:stop * 2].tostring(), int(start) * 4)
+        self._eq_words = words.copy()
+        return sum(stop - start for start, stop in runs)
+
     def __repr__(self):
         return self.__str__()
 
@@ -555,6 +529,62 @@ class FpgaFHost(FpgaHost):
         return
 
 
+    def delay_set_words(self, words, load_mcnt, timings=None):
+        """
+        Load new delay models for any or all of the F-engines on this host
+        as one operation: write every input's coefficients, check that the
+        previous models loaded, then arm all the timed latches back to back.
+        :param words: a dict of fengine offset -> delay.DelayWords
+        :param load_mcnt: sample mcnt to load the delays at
+        :param timings: if given, a dict that gets the seconds spent in
+        the 'write', 'check' and 'arm' steps
+        :return: a dict of offset -> True if the previous delay model loaded
+        """
+        fengs = [feng for feng in self.fengines if feng.offset in words]
+        start = time.time()
+        for feng in fengs:
+            feng._delay_write_words(words[feng.offset])
+        written = time.time()
+        rv = {feng.offset: feng._delay_check_load() for feng in fengs}
+        checked = time.time()
+        mcnt_rounded = self.delay_arm_latches(
+            [feng.offset for feng in fengs], load_mcnt)
+        if timings is not None:
+            timings.update(write=written - start, check=checked - written,
+                           arm=time.time() - checked)
+        for feng in fengs:
+            feng.last_delay.load_mcnt = mcnt_rounded
+            feng.logger.debug('New delay model applied: {}'.format(
+                feng.last_delay.__str__()))
+        return rv
+
+    def delay_arm_latches(self, offsets, mcnt):
+        """
+        Arm the delay timed latches of several inputs for the same mcnt.
+        Optimisations bypass normal register bitfield operations.
+        :param offsets: the fengine offsets whose latches to arm
+        :param mcnt: sample mcnt to trigger at
+        :return: the mcnt, rounded to the timestamp resolution
+        """
+        #TODO: don't floor the timestamp, but round it sanely.
+        mcnt_rounded = (int(mcnt)>>self.timestamp_decimation)<<self.timestamp_decimation
+        self.logger.debug('Requested load mcnt %i rounded to %i.'%(mcnt,mcnt_rounded))
+        load_time_lsw = mcnt_rounded - (int(mcnt_rounded/(2**32)))*(2**32)
+        load_time_msw = int(mcnt_rounded/(2**32))
+        control0_regs = []
+        for offset in offsets:
+            self.registers['delay%i_tl_control1' % offset].write_int(
+                load_time_lsw, blindwrite=True)
+            control0_regs.append(self.registers['delay%i_tl_control0' % offset])
+        # pulse all the arm bits together, so the inputs load as one
+        for control0_reg in control0_regs:
+            ao = control0_reg._fields['arm'].offset
+            control0_reg.write_int((1<<ao)+(load_time_msw), blindwrite=True)
+        for control0_reg in control0_regs:
+            ao = control0_reg._fields['arm'].offset
+            control0_reg.write_int((0<<ao)+(load_time_msw), blindwrite=True)
+        return mcnt_rounded
+
     def add_fengine(self, fengine):
         """
         Add a new fengine to this fengine host
@@ -768,6 +798,20 @@ class FpgaFHost(FpgaHost):
         """
         if input_name != None:
             fengine = self.get_fengine(input_name)
+        self.arm_adc_snapshots(loadcnt, trig_level)
+        rv = self.read_adc_snapshots(timeout)
+        if input_name != None:
+            return rv['p%i' % fengine.offset]
+        else:
+            return rv
+
+    def arm_adc_snapshots(self, loadcnt=0, trig_level=0):
+        """
+        Arm the ADC snapshots, to be read with read_adc_snapshots.
+        :param loadcnt: the trigger/load time in ADC samples.
+        :param trig_level: the oscilloscope-like trigger point (range: 0.0 - 1.0)
+        :return:
+        """
         if loadcnt>0:
             self.logger.info("Triggering ADC snapshot at %i"%loadcnt)
             ltime_msw = (loadcnt >> 32) & (2**16 - 1)
@@ -783,25 +827,24 @@ class FpgaFHost(FpgaHost):
         else:
             self.snapshots.snap_adc0_ss.arm(man_trig=True)
             self.snapshots.snap_adc1_ss.arm(man_trig=True)
+
+    def read_adc_snapshots(self, timeout=10):
+        """
+        Read the ADC snapshots armed by arm_adc_snapshots.
+        :param timeout: timeout in seconds for snapshot read operation.
+        :return {'p0': AdcData(), 'p1': AdcData()}
+        """
         d0 = self.snapshots.snap_adc0_ss.read(arm=False, timeout=timeout)
         d1 = self.snapshots.snap_adc1_ss.read(arm=False, timeout=timeout)
         time48_0 = d0['extra_value']['timestamp']
         time48_1 = d1['extra_value']['timestamp']
         d = d0['data']
         d.update(d1['data'])
-        # pack the data into simple lists
-        rvp0 = []
-        rvp1 = []
-        for ctr in range(0, len(d['p0_d0'])):
-            for ctr2 in range(8):
-                rvp0.append(d['p0_d%i' % ctr2][ctr])
-                rvp1.append(d['p1_d%i' % ctr2][ctr])
-        rv= {'p0': AdcData(time48_0, rvp0),
-             'p1': AdcData(time48_1, rvp1)}
-        if input_name != None:
-            return rv['p%i' % fengine.offset]
-        else:
-            return rv
+        # interleave the parallel sample streams
+        rvp0 = _adc_samples(interleave_fields(d, ['p0_d%i' % ctr for ctr in range(8)]))
+        rvp1 = _adc_samples(interleave_fields(d, ['p1_d%i' % ctr for ctr in range(8)]))
+        return {'p0': AdcData(time48_0, rvp0),
+                'p1': AdcData(time48_1, rvp1)}
 
     def get_pack_status(self):
         """
@@ -30,6 +30,12 @@ from fxcorrelator_xengops import XEngineOperations
 from fxcorrelator_bengops import BEngineOperations
 from fxcorrelator_filterops import FilterOperations
 from data_stream import StreamAddress
+from status_snapshot import StatusSnapshotCache
+from status_hub import StatusHubClient
+from host_pool import HostPool, MAX_WORKERS as HOST_POOL_WORKERS, \
+    URGENT_WORKERS as HOST_POOL_URGENT_WORKERS
+from async_ops import AsyncOperations, MAX_WORKERS as ASYNC_OP_WORKERS
+from transient_capture import DEFAULT_CAPTURE_DIR
 
 from corr2LogHandlers import getLogger as _getLogger
 
@@ -152,6 +158,12 @@ class FxCorrelator(Instrument):
         # clear the data streams. These will be re-added during configuration.
         self.data_streams = []
 
+        # stop the previous F-engine handler's delay queue, its models are
+        # for the hosts as they were before this initialise
+        if self.fops is not None:
+            self.fops.delay_queue.clear()
+            self.fops.delay_queue.stop()
+
         # set up the F, X, B and filter handlers
         self.fops = FEngineOperations(self, timeout=self.timeout, **kwargs)
         self.xops = XEngineOperations(self, timeout=self.timeout, **kwargs)
@@ -365,6 +377,26 @@ class FxCorrelator(Instrument):
             self.est_synch_epoch()
         return self.synchronisation_epoch + (float(mcnt) / self.sample_rate_hz)
 
+    def map_hosts(self, fn, hosts, timeout=None, args=(), kwargs=None,
+                  urgent=False):
+        """
+        Run an operation on many hosts using the instrument's host pool,
+        at most one operation in flight per host.
+        :param fn: the function, taking the host as its first argument,
+            or the name of a method of the hosts
+        :param hosts: the hosts
+        :param timeout: seconds to wait for all the hosts, None for ever
+        :param args: extra arguments for fn
+        :param kwargs: extra keyword arguments for fn
+        :param urgent: for latency-critical operations: go ahead of the
+            hosts' queued operations, see host_pool.HostPool.submit_urgent
+        :return: a dict of host name -> result
+        :raises host_pool.HostPoolError: if any hosts failed or timed out,
+            with the results of the others
+        """
+        return self.host_pool.map_hosts(fn, hosts, timeout, args, kwargs,
+                                        urgent)
+
     def mcnt_from_time(self, time_seconds):
         """
         Returns the board timestamp from a given UTC system time
@@ -587,6 +619,39 @@ class FxCorrelator(Instrument):
         except KeyError:
             self.logger.warn('sensor_poll_interval config file variable is not available, default interval set to: 0.003.')
             self.sensor_poll_interval = 0.003
+        self.sensor_default_period = float(_fxcorr_d.get('sensor_default_period', 2.0))
+        # shared status register snapshots, for sensors and the monitoring loop
+        self.status_cache = StatusSnapshotCache(
+            max_age_s=float(_fxcorr_d.get('status_snapshot_max_age',
+                                          self.sensor_default_period)),
+            logger=self.logger)
+        # or get them from a corr2_status_hub, if one is configured
+        self.status_hub_socket = _fxcorr_d.get('status_hub_socket', '')
+        if self.status_hub_socket:
+            self.status_cache = StatusHubClient(
+                self.status_hub_socket, fallback=self.status_cache,
+                logger=self.logger)
+
+        # long-lived worker threads for per-host operations
+        if getattr(self, 'host_pool', None) is not None:
+            self.host_pool.shutdown(wait=False)
+        self.host_pool = HostPool(
+            max_workers=int(_fxcorr_d.get('host_pool_workers',
+                                          HOST_POOL_WORKERS)),
+            urgent_workers=int(_fxcorr_d.get('host_pool_urgent_workers',
+                                             HOST_POOL_URGENT_WORKERS)),
+            logger=self.logger)
+        # and for the ops' background operations, see async_ops
+        if getattr(self, 'async_ops', None) is not None:
+            self.async_ops.shutdown(wait=False)
+        self.async_ops = AsyncOperations(
+            max_workers=int(_fxcorr_d.get('async_op_workers',
+                                          ASYNC_OP_WORKERS)),
+            logger=self.logger)
+
+        # where ?transient-buffer-capture writes its files
+        self.transient_capture_dir = _fxcorr_d.get(
+            'transient_capture_dir', DEFAULT_CAPTURE_DIR)
 
         # These ones are fine, we'll just use a default if they're not there.
         self.katcp_port = int(_fxcorr_d.get('katcp_port', 7147))
@@ -596,6 +661,18 @@ class FxCorrelator(Instrument):
         self.timeout = int(_fxcorr_d.get('new_timeout', 1))
         self.programming_timeout = int(_fxcorr_d.get('programming_timeout', 15))
         self.post_switch_delay = int(_fxcorr_d.get('switch_delay', 10))
+        self.sensor_loop_block_report = _fxcorr_d.get(
+            'sensor_loop_block_report', 'false').lower() in ['true', 'yes', '1']
+        self.sensor_loop_stats_period = float(_fxcorr_d.get('sensor_loop_stats_period', 10.0))
+        self.sensor_inform_interval = float(_fxcorr_d.get('sensor_inform_interval', 0.1))
+        self.sensor_inform_byte_budget = int(_fxcorr_d.get('sensor_inform_byte_budget', 0))
+        # per-sensor history rings, off unless sensor_history_length is set
+        self.sensor_history_length = int(_fxcorr_d.get('sensor_history_length', 0))
+        self.sensor_history_max_sensors = int(_fxcorr_d.get('sensor_history_max_sensors', 1000))
+        self.sensor_history_sensors = [
+            pattern.strip() for pattern in
+            _fxcorr_d.get('sensor_history_sensors', '*').split(',')
+            if pattern.strip()]
 
         if 'spead_metapacket_ttl' in _fxcorr_d:
             import data_stream
@@ -621,6 +698,9 @@ class FxCorrelator(Instrument):
         self.decimation_factor = int(_feng_d.get('decimation_factor', 1))
         self.ct_readgap = int(_feng_d.get('ct_readgap', 45))
         self.min_load_time = float(_feng_d.get('min_load_time', 0.2))
+        # delay updates armed closer than this to their load time are late
+        self.delay_late_margin = float(_feng_d.get('delay_late_margin_ms', 100)) / 1000.0
+        self.delay_trace_history = int(_feng_d.get('delay_trace_history', 100))
         self.f_per_fpga = int(_feng_d.get('f_per_fpga', 2))
         self.adc_bitwidth = int(_feng_d.get('sample_bits', 10))
         self.pfb_group_delay = int(_feng_d.get('pfb_group_delay', 0))
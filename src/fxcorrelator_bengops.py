@@ -1,7 +1,9 @@
 from logging import INFO
 from casperfpga import utils as fpgautils
 from beam import Beam
+from bhost_fpga import beam_steering_coeffs
 import delay as delayops
+from async_ops import report_progress
 import time
 import numpy
 
@@ -48,6 +50,7 @@ class BEngineOperations(object):
             raise RuntimeError('Called beamformer initialise without beams? '
                                'Have you run configure?')
         # set up the beams
+        report_progress('beams', 0.1)
         for beam in self.beams.values():
             beam.initialise()
         # disable all beams (this is done in beam.py)
@@ -57,18 +60,28 @@ class BEngineOperations(object):
         init_delay = 0.0
         init_phase = 0.0
         delays = ((init_delay, init_phase),) * self.corr.n_antennas
+        report_progress('delays', 0.3)
         if self.corr.n_chans != 32768:
             for beam_name in self.beams:
                 self.set_beam_delays(beam_name, delays)
 
         init_weight = 1.0
         weights = [init_weight] * self.corr.n_antennas
+        report_progress('gains and weights', 0.6)
         for beam_name in self.beams:
             beam = self.get_beam_by_name(beam_name)
             self.set_beam_quant_gain(float(beam.config['quant_gain']), beam_name)
-            self.set_beam_weights(weights, beam_name)
+            self.set_beam_weights(weights, beam_name, force=True)
         self.logger.info('Beamformer initialised.')
 
+    def initialise_async(self, *args, **kwargs):
+        """
+        initialise, in the background - see async_ops.
+        :return: a concurrent.futures.Future
+        """
+        return self.corr.async_ops.submit('bops.initialise', self.initialise,
+                                          *args, **kwargs)
+
     def configure(self, *args, **kwargs):
         """
         Configure the beams from the config source. This is done whenever
@@ -159,8 +172,8 @@ class BEngineOperations(object):
             return
         beam = self.get_beam_by_name(beam_name)
         # set the quantiser gains for this beam
-        THREADED_FPGA_FUNC(self.hosts, 5, ('beam_quant_gains_set',
-                                           [beam.index, new_gain], {}))
+        self.corr.map_hosts('beam_quant_gains_set', self.hosts, 5,
+                            args=(beam.index, new_gain))
         self.logger.info('%s quant gain set to %f.' % (beam_name, new_gain))
         if self.corr.sensor_manager:
             self.corr.sensor_manager.sensors_beng_gains()
@@ -172,54 +185,117 @@ class BEngineOperations(object):
         :return: the output beam gain for this combination
         """
         beam = self.get_beam_by_name(beam_name)
-        vals = THREADED_FPGA_FUNC(self.hosts, 5, ('beam_quant_gains_get',
-                                           [beam.index], {}))
+        vals = self.corr.map_hosts('beam_quant_gains_get', self.hosts, 5,
+                                   args=(beam.index,))
         if min(vals.values()) == max(vals.values()):
             return vals.values()[0]
         else:
             raise RuntimeError('Boards dont all have the same gain! {}'.format(vals))
 
-    def set_beam_weights(self, weights, beam_name=None):
+    def set_beam_weights(self, weights, beam_name=None, force=False):
         """
-        Set the beam weights for a given beam and input.
+        Set the beam weights for a given beam and input. Each host only
+        writes the weights that changed since they were last set.
         :param weights: a list of weights, one per input, to apply to this beam & input. Give a single value to use for all inputs.
         :param beam_name: the beam name; if not specified, apply to all.
-        :return:
+        :param force: write all the weights, even unchanged ones
+        :return: True if the weights written read back as written
         """
         if beam_name is None:
-            for beam_name in self.beams:
-                self.set_beam_weights(weights, beam_name=beam_name)
-            return
+            verified = True
+            for ctr, beam_name in enumerate(self.beams):
+                report_progress('weights for {}'.format(beam_name),
+                                float(ctr) / len(self.beams))
+                verified &= self.set_beam_weights(weights, beam_name=beam_name,
+                                                  force=force)
+            return verified
         if type(weights) == int or type(weights) == float:
             new_weights = [weights for a in range(self.corr.n_antennas)]
         else:
-            new_weights = weights
+            new_weights = [float(weight) for weight in weights]
 
         self.logger.debug('Received weights for beam %s: %s' % (str(beam_name), str(weights)))
 
         assert len(new_weights) == self.corr.n_antennas, 'Need to specify %i values; you offered %i.' % (self.corr.n_antennas, len(new_weights))
         beam_index = self.get_beam_by_name(beam_name).index
-        THREADED_FPGA_FUNC(self.hosts, 5, ('beam_weights_set',
-                                           [beam_index, new_weights], {}))
-        self.logger.info('{} weights set to {}.'.format(beam_name, new_weights))
+        # each host reads back the weights it wrote in the same pass
+        results = self.corr.map_hosts('beam_weights_set', self.hosts, 5,
+                                      args=(beam_index, new_weights),
+                                      kwargs={'force': force})
+        self.logger.info('{} weights set to {} ({} writes).'.format(
+            beam_name, new_weights,
+            sum(written for written, _ in results.values())))
+        verified = all(matched for _, matched in results.values())
+        if not verified:
+            self.logger.error('{} weights read back differ on {}.'.format(
+                beam_name, [host for host, (_, matched) in results.items()
+                            if not matched]))
         if self.corr.sensor_manager:
             self.corr.sensor_manager.sensors_beng_weights()
+        return verified
 
-    def get_beam_weights(self, beam_name):
+    def set_beam_weights_async(self, weights, beam_name=None, force=False):
         """
-        Get the current beam weights for a given beam and input.
+        set_beam_weights, in the background - see async_ops.
+        :return: a concurrent.futures.Future
+        """
+        return self.corr.async_ops.submit('bops.set_beam_weights',
+                                          self.set_beam_weights,
+                                          weights, beam_name, force)
+
+    def get_beam_weights(self, beam_name, from_hardware=False):
+        """
+        Get the current beam weights for a given beam and input, as read
+        back from the hardware: the readbacks kept from when the weights
+        were written, or read again if some are missing.
         :param beam_name: the beam name
+        :param from_hardware: read all the weights back from the hosts,
+            even if every host has kept readbacks
         :return: a list of the beam weights, one per input.
         """
         beam = self.get_beam_by_name(beam_name)
-        vals = THREADED_FPGA_FUNC(self.hosts, 10, ('beam_weights_get',
-                                           [beam.index], {}))
-        import numpy
-        na = numpy.array(vals.values())
-        for ant in range(self.corr.n_antennas):
-            if na[:, ant].max() != na[:, ant].min():
-                self.logger.warning('Boards dont all have the same gain! {}'.format(vals))
-        return vals.values()[0]
+        readbacks = [host.beam_weights_hw.get(beam.index)
+                     for host in self.hosts]
+        if from_hardware or any(readback is None or None in readback
+                                for readback in readbacks):
+            # this also refreshes the hosts' kept readbacks
+            self.corr.map_hosts('beam_weights_verify', self.hosts, 10,
+                                args=(beam.index,))
+            readbacks = [host.beam_weights_hw[beam.index]
+                         for host in self.hosts]
+        if any(readback != readbacks[0] for readback in readbacks):
+            self.logger.warning('Boards dont all have the same gain! {}'.format(
+                readbacks))
+        return list(readbacks[0])
+
+    def beam_weights_verified(self, beam_name):
+        """
+        Whether every host's kept readbacks of a beam's weights match the
+        weights requested, without reading the hardware.
+        :param beam_name: the beam name
+        :return: True if they all do
+        """
+        beam = self.get_beam_by_name(beam_name)
+        return all(host.beam_weights_verified(beam.index)
+                   for host in self.hosts)
+
+    def verify_beam_weights(self, beam_name):
+        """
+        Read a beam's weights back from all the hosts and check them
+        against the weights last requested.
+        :param beam_name: the beam name
+        :return: True if every host matched
+        """
+        beam = self.get_beam_by_name(beam_name)
+        matched = self.corr.map_hosts('beam_weights_verify', self.hosts, 10,
+                                      args=(beam.index,))
+        verified = all(matched.values())
+        if not verified:
+            self.logger.error('{} weights read back differ on {}.'.format(
+                beam_name, [host for host, ok in matched.items() if not ok]))
+        if self.corr.sensor_manager:
+            self.corr.sensor_manager.sensors_beng_weights()
+        return verified
 
     def get_version_info(self):
         """
@@ -239,8 +315,9 @@ class BEngineOperations(object):
         #TODO This function doesn't really add value. Remove?
         rv = {}
         for beam in self.beams.itervalues():
-            rv[beam.name] = THREADED_FPGA_FUNC(self.hosts, 5, ('get_bpack_status',
-                                           [beam.index], {}))
+            rv[beam.name] = self.corr.map_hosts('get_bpack_status',
+                                                self.hosts, 5,
+                                                args=(beam.index,))
         return rv
 
     def set_beam_delays(self, beam_name, delays):
@@ -257,63 +334,51 @@ class BEngineOperations(object):
             self.logger.info('Preventing setting delays on 32k system')
             return
 
-        #process delays passed as string
-        def process_string(delaystr):
-            bits = delaystr.strip().split(':')
-            if len(bits) != 2:
-                return -1
-            return float(bits[0]), float(bits[1])
-
         if len(delays) != self.corr.n_antennas:
             self.logger.error('Need to specify %i delay values, %i provided.'
                 % (self.corr.n_antennas, len(delays)))
             return
 
-        ant_coeffs = []
-        last_delays = []
-        load_mcnt = self.corr.mcnt_from_time(time.time())
-        #generate delay and phase values for all antennas
+        #parse all the delay:phase pairs at once
         for ant_index, ant_delay in enumerate(delays):
-            #if passed in as string, split and convert
             if isinstance(ant_delay, str):
-                ant_delay_tup = process_string(ant_delay)
+                values = ant_delay.count(':') + 1
             else:
-                ant_delay_tup = ant_delay
-
-            if len(ant_delay_tup) != 2:
+                values = len(ant_delay)
+            if values != 2:
                 self.logger.error('Beam delay values must consist of 2 values, %i given for antenna %i' % (
-                    len(ant_delay_tup), ant_index))
+                    values, ant_index))
                 return
-
-            new_delay = delayops.prepare_delay_vals([[ant_delay_tup[0], 0.0], [ant_delay_tup[1], 0.0]],
-                self.corr.sample_rate_hz)
-            new_delay.load_mcnt = load_mcnt
-
-            #for a noise-like signal it makes little sense to delay by more than our FFT length
-            if new_delay.delay > self.corr.n_chans:
-                self.logger.info('Request to delay antenna input %i by %i samples in a %i channel system.' % (
-                    ant_index, new_delay.delay, self.corr.n_chans))
-
-            #phase change across the band for the delay specified (radians)
-            #negative slope for positive delay
-            delay = -new_delay.delay * numpy.pi
-            #phase offset (radians)
-            phase = new_delay.phase_offset * numpy.pi
-
-            #phase change per frequency as pre-calculated complex value
-            phase_per_freq = numpy.exp(1.0j * (delay / self.corr.n_chans))
-            #phase change per bengine as pre-calculated complex value
-            phase_per_beng = numpy.exp(1.0j * (delay / (len(self.hosts) * self.beng_per_host)))
-
-            ant_coeffs.append((delay, phase, phase_per_beng, phase_per_freq))
-
-            #record delay settings for sensor update
-            last_delays.append(new_delay)
-
-        #change coefficients on all hosts
+        if all(isinstance(ant_delay, str) for ant_delay in delays):
+            pairs = numpy.array(' '.join(delays).replace(':', ' ').split(),
+                                dtype=numpy.float64).reshape(-1, 2)
+        else:
+            pairs = numpy.array(
+                [ant_delay.split(':') if isinstance(ant_delay, str) else ant_delay
+                 for ant_delay in delays], dtype=numpy.float64)
+        delay_samples = pairs[:, 0] * self.corr.sample_rate_hz
+        phases = pairs[:, 1]
+
+        #for a noise-like signal it makes little sense to delay by more than our FFT length
+        for ant_index in numpy.nonzero(delay_samples > self.corr.n_chans)[0]:
+            self.logger.info('Request to delay antenna input %i by %i samples in a %i channel system.' % (
+                ant_index, delay_samples[ant_index], self.corr.n_chans))
+
+        #coefficients for every host, b-engine and antenna in one go
         beam = self.get_beam_by_name(beam_name)
-        THREADED_FPGA_FUNC(self.hosts, 10, ('beam_delays_set', [len(self.hosts), beam.index, ant_coeffs], {}))
+        coeffs = beam_steering_coeffs(
+            delay_samples, phases, [host.index for host in self.hosts],
+            len(self.hosts), self.beng_per_host, self.corr.n_chans)
+        host_slot = {host.host: ctr for ctr, host in enumerate(self.hosts)}
+        self.corr.map_hosts(lambda host_: host_.beam_delays_set(
+            beam.index, coeffs[host_slot[host_.host]]), self.hosts, 10)
         self.logger.info('{} delays set to {}.'.format(beam_name, delays))
+
+        #record delay settings for sensor update
+        load_mcnt = self.corr.mcnt_from_time(time.time())
+        last_delays = [delayops.Delay(delay, 0.0, phase / numpy.pi, 0.0,
+                                      load_mcnt=load_mcnt)
+                       for delay, phase in zip(delay_samples, phases)]
         beam.last_delays = last_delays
         if self.corr.sensor_manager:
             self.corr.sensor_manager.sensors_beng_delays(beam)
@@ -2,11 +2,17 @@ import Queue
 import threading
 import time
 import re
+import numpy
 
 import utils
 import fhost_fpga
 import fxcorrelator_speadops as speadops
 import delay as delayops
+from delay_queue import DelayQueue
+from delay_trace import DelayTracer
+from transient_capture import TransientCaptureWriter
+from host_pool import HostPoolError
+from async_ops import report_progress
 
 from casperfpga import utils as fpgautils
 from casperfpga import CasperLogHandlers
@@ -119,6 +125,48 @@ class FengineStream(SPEADStream):
         return 'FengineStream {} -> {}'.format(self.name, self.destination)
 
 
+class SpectrumAverage(object):
+    """
+    A running average of one input's quantiser spectrum magnitude, that
+    notices when more snapshots stop changing the estimate. Single
+    channels stay noisy for many snapshots, so convergence is judged on a
+    cubic fitted across the band - the same smoothing the EQ correction
+    gets.
+    """
+    def __init__(self, n_chans, start, stop):
+        """
+        :param n_chans: channels in the spectrum
+        :param start: first channel used to judge convergence
+        :param stop: end of the channels used to judge convergence
+        :return:
+        """
+        self.mean = numpy.zeros(n_chans)
+        self.count = 0
+        self.start = start
+        self.stop = stop
+        self.change = None
+        # fit against 0..1 rather than channel numbers, for conditioning
+        self._x = numpy.linspace(0.0, 1.0, stop - start)
+        self._fit = None
+
+    def add(self, spectrum):
+        """
+        Fold a snapshot into the average.
+        :param spectrum: the snapshot's magnitudes
+        :return: the largest relative change in the band's fitted cubic
+        that it caused, None for the first snapshot
+        """
+        self.count += 1
+        self.mean += (spectrum - self.mean) / self.count
+        fit = numpy.polyval(numpy.polyfit(
+            self._x, self.mean[self.start:self.stop], 3), self._x)
+        if self._fit is not None:
+            self.change = numpy.max(numpy.abs(fit - self._fit) /
+                                    numpy.maximum(numpy.abs(fit), 1e-12))
+        self._fit = fit
+        return self.change
+
+
 class FEngineOperations(object):
 
     def __init__(self, corr_obj, timeout=5, **kwargs):
@@ -149,6 +197,12 @@ class FEngineOperations(object):
             raise ValueError(errmsg)
 
         self.logger.debug('Successfully created logger for {}'.format(logger_name))
+        self.delay_tracer = DelayTracer(
+            history=getattr(corr_obj, 'delay_trace_history', 100),
+            late_margin_s=getattr(corr_obj, 'delay_late_margin', 0.1),
+            logger=self.logger)
+        self.delay_queue = DelayQueue(self, tracer=self.delay_tracer,
+                                      logger=self.logger)
 
     def initialise(self, *args, **kwargs):
         """
@@ -178,6 +232,7 @@ class FEngineOperations(object):
             self.logger.info('Found FIXED num_x F-engines')
 
         # set up the corner turner
+        report_progress('corner turner', 0.1)
         reg_error = False
         host_ctr = 0
         for f in self.hosts:
@@ -238,6 +293,7 @@ class FEngineOperations(object):
                 'incorrect/old. Expect ct_control[0,1,2,3], found: {}.'.format(cts))
 
         # write the board IDs to the fhosts
+        report_progress('destinations', 0.3)
         output_port = self.data_stream.destination.port
         board_id = 0
         for f in self.hosts:
@@ -250,17 +306,28 @@ class FEngineOperations(object):
             self.corr.sensor_manager.sensors_stream_destinations()
 
         # set eq and shift
+        report_progress('eq and fft shift', 0.4)
         self.set_fft_shift_all()
-        self.set_eq()
+        self.set_eq(force=True)
         self.set_center_freq(self.corr.sample_rate_hz/4.)
 
         # configure the ethernet cores.
+        report_progress('ethernet cores', 0.6)
         THREADED_FPGA_FUNC(self.hosts, timeout=self.timeout,
             target_function=('setup_host_gbes', (), {}))
 
         # subscribe to multicast groups
+        report_progress('multicast', 0.9)
         self.subscribe_to_multicast()
 
+    def initialise_async(self, *args, **kwargs):
+        """
+        initialise, in the background - see async_ops.
+        :return: a concurrent.futures.Future
+        """
+        return self.corr.async_ops.submit('fops.initialise', self.initialise,
+                                          *args, **kwargs)
+
     def configure(self, *args, **kwargs):
         """
         Configure the fengine operations - this is done whenever a correlator
@@ -400,13 +467,16 @@ class FEngineOperations(object):
         """Set the DDC oscillator frequency to "freq" Hz."""
         self.logger.debug('Setting DDC oscillator freq to {:.3f} MHz'.format(freq/1.e6))
         reg_value = float(freq)/self.corr.sample_rate_hz
-        THREADED_FPGA_OP(self.hosts, timeout=self.timeout,
-            target_function=(lambda fpga_: fpga_.registers.freq_cwg_osc.write(frequency=reg_value),))
+        self.corr.map_hosts(
+            lambda fpga_: fpga_.registers.freq_cwg_osc.write(frequency=reg_value),
+            self.hosts, self.timeout)
         return self._get_osc_freq()
 
     def _get_osc_freq(self):
         """Return the hardware configured oscillator frequency, in Hz."""
-        rv =THREADED_FPGA_OP(self.hosts,timeout=1,target_function=(lambda fpga_: fpga_.registers.freq_cwg_osc.read()['data']['frequency'],)) 
+        rv = self.corr.map_hosts(
+            lambda fpga_: fpga_.registers.freq_cwg_osc.read()['data']['frequency'],
+            self.hosts, 1)
         if min(rv.values()) != max(rv.values()): 
             self.logger.warning("Fhosts have different tuning frequencies!")
             raise RuntimeError("Fhosts have different tuning frequencies!")
@@ -422,8 +492,8 @@ class FEngineOperations(object):
         """
         self.logger.debug('Checking timestamps on F hosts.')
         start_time = time.time()
-        results = THREADED_FPGA_FUNC(self.hosts, timeout=self.timeout,
-            target_function=('get_local_time', [src], {}))
+        results = self.corr.map_hosts('get_local_time', self.hosts,
+                                      self.timeout, args=(src,))
         read_time = time.time()
         elapsed_time = read_time - start_time
         feng_times = {}
@@ -483,95 +553,99 @@ class FEngineOperations(object):
         """
         target_function = CHECK_TARGET_FUNC(target_function)
 
-        def jobfunc(resultq, feng):
-            rv = target_function[0](feng, *target_function[1], **target_function[2])
-            resultq.put_nowait((feng.input_number, rv))
-
-        num_fengs = len(self.fengines)
-        f_per_fpga = self.corr.f_per_fpga
-        returnval = {}
-        hosts_missing = [feng.input_number for feng in self.fengines]
-        for fpl in range(f_per_fpga):
-            result_queue = Queue.Queue(maxsize=num_fengs/f_per_fpga)
-            thread_list = []
-            for feng_ in self.fengines[fpl::f_per_fpga]:
-                thread = threading.Thread(target=jobfunc, args=(result_queue, feng_))
-                thread.setDaemon(True)
-                thread.start()
-                thread_list.append(thread)
-            for thread_ in thread_list:
-                thread_.join(timeout)
-                if thread_.isAlive():
-                    break
-            while True:
-                try:
-                    result = result_queue.get_nowait()
-                    self.logger.debug("Received response from feng {}".format(result[0]))
-                    returnval[result[0]] = result[1]
-                    hosts_missing.pop(hosts_missing.index(result[0]))
-                except Queue.Empty:
-                    break
-        if hosts_missing:
-            hosts_missing=[self.fengines[n_feng] for n_feng in hosts_missing]
-            missing_str=['%s(%s)'%(feng.name,feng.host.host) for feng in hosts_missing]
+        def jobfunc(host, feng):
+            return target_function[0](feng, *target_function[1], **target_function[2])
+
+        # the F-engines on a host run one after the other, on the
+        # instrument's host pool
+        pool = self.corr.host_pool
+        try:
+            return pool.collect(
+                {pool.submit(feng_.host, jobfunc, feng_): feng_.input_number
+                 for feng_ in self.fengines}, timeout * self.corr.f_per_fpga)
+        except HostPoolError as e:
+            hosts_missing = [self.fengines[n_feng] for n_feng in sorted(e.errors)]
+            missing_str = ['%s(%s): %s' % (feng.name, feng.host.host,
+                                           e.errors[feng.input_number])
+                           for feng in hosts_missing]
             errmsg = ('Did not complete Fengs: {}.'.format(missing_str))
             self.logger.error(errmsg)
             raise RuntimeError(errmsg)
-        return returnval
 
     def delay_set(self, input_name, loadtime=None, delay=0, delay_delta=0, phase=0, phase_delta=0):
         """
-        Set the delay and phase coefficients for a single input.
+        Set the delay and phase coefficients for a single input. The model
+        goes through self.delay_queue like delay_set_all's, so it takes its
+        place among the input's queued models rather than overwriting the
+        armed one.
         :param loadtime: the UNIX time at which to effect the changes. Default: immediately.
         :param delay: delay in seconds
         :param delay_delta: delay change in seconds per second
         :param phase: phase offset in radians
         :param phase_delta: phase rate of change in radians/second.
-        :return: True/False
+        :return: True if the model was queued, False if the load time
+        was too soon or in the past.
         """
         sample_rate_hz = self.corr.sample_rate_hz
         loadmcnt = self._delays_check_loadtime(loadtime)
         if not (loadmcnt > 0):
             self.logger.error("Dropping delay request.")
-        else:
-            delay = delayops.prepare_delay_vals(((delay, delay_delta), (phase, phase_delta)),
-                sample_rate_hz)
-            delay.load_mcnt = loadmcnt
-            feng = self.get_fengine(input_name)
-            feng.delay_set(delay)
-            if self.corr.sensor_manager:
-                self.corr.sensor_manager.sensors_feng_delays(feng)
+            return False
+        feng = self.get_fengine(input_name)
+        delay = delayops.prepare_delay_vals(((delay, delay_delta), (phase, phase_delta)),
+            sample_rate_hz)
+        delay.load_mcnt = loadmcnt
+        delays = delayops.DelayBatch.from_delays([delay])
+        self.delay_queue.put(delays, self.corr.time_from_mcnt(loadmcnt),
+                             input_number=feng.input_number)
+        return True
 
     def delay_set_all(self, loadtime, delay_list):
         """
-        Set the delays for all inputs in the system
+        Set the delays for all inputs in the system. The model is parsed
+        and converted to register words here, then queued and armed in
+        the background once any earlier models have loaded, so this
+        returns as soon as it is queued.
         :param loadtime: the UNIX time at which to effect the changes
         :param delay_list: a list of ICD strings, one for each input.
                             A list of strings (delay,rate:phase,rate) or
                              delay tuples ((delay,rate),(phase,rate))
-        :return: True if all success, False otherwise.
+        :return: True if the model was queued, False if the load time
+        was too soon or in the past.
+        :raises ValueError: if the delay list is malformed
         """
+        received = time.time()
         loadmcnt = self._delays_check_loadtime(loadtime)
         self.logger.debug("Received delay model update for {} (mcnt {}) at {}: {}.".format(loadtime,
                 loadmcnt, time.time(),delay_list.__str__()))
         if not (loadmcnt > 0):
             self.logger.error("Dropping delay request.")
-        else:
-            sample_rate_hz = self.corr.get_scale_factor()
-            delays = delayops.process_list(delay_list, sample_rate_hz)
-            if len(delays) != len(self.fengines):
-                raise ValueError('Have {} F-engines, received {} delay coefficient sets.'.format(
-                    len(self.fengines), len(delays)))
-            for delay in delays:
-                delay.load_mcnt = loadmcnt
-            rv = self.threaded_feng_operation(timeout=self.timeout,
-                target_function=(lambda feng_: feng_.delay_set(delays[feng_.input_number]),))
-            if len(rv) != len(self.fengines):
-                rv = False
-                self.logger.error("Only got {} delay responses.".format(len(rv)))
-            if self.corr.sensor_manager:
-                for feng in self.fengines:
-                    self.corr.sensor_manager.sensors_feng_delays(feng)
+            return False
+        if len(delay_list) != len(self.fengines):
+            raise ValueError('Have {} F-engines, received {} delay coefficient sets.'.format(
+                len(self.fengines), len(delay_list)))
+        loadtime = self.corr.time_from_mcnt(loadmcnt)
+        trace = self.delay_tracer.start(loadmcnt, loadtime)
+        start = time.time()
+        coeffs = delayops.parse_delay_list(delay_list)
+        parsed = time.time()
+        delays = delayops.DelayBatch.from_coeffs(
+            coeffs, self.corr.get_scale_factor(), load_mcnt=loadmcnt)
+        self.delay_tracer.stage(trace, 'parse', parsed - start)
+        self.delay_tracer.stage(trace, 'process', time.time() - parsed)
+        self.delay_queue.put(delays, loadtime, trace)
+        self.delay_tracer.stage(trace, 'request', time.time() - received)
+        return True
+
+    def delay_set_all_async(self, loadtime, delay_list):
+        """
+        delay_set_all, in the background - see async_ops. The future is
+        done once the model is queued, the delay queue arms it later.
+        :return: a concurrent.futures.Future
+        """
+        return self.corr.async_ops.submit('fops.delay_set_all',
+                                          self.delay_set_all,
+                                          loadtime, delay_list)
 
 #    def delays_get(self, input_name=None):
 #        """
@@ -605,15 +679,8 @@ class FEngineOperations(object):
             self.logger.error(errmsg)
             return None
 
-        #TODO this logic doesn't work correctly all the time, because this function can be called when setting random Fengines, and so shouldn't hardcode the reference to feng0. disabling for now.
-        #last_loadtime = self.corr.time_from_mcnt(
-        #    self.fengines[0].last_delay.load_mcnt)
-        #if time.time() < last_loadtime:
-        #    self.logger.warning(
-        #        "Received a delay update before the last one had a chance to load! "
-        #        "Queuing is not supported. The last load command (for time {}) will not be applied, "
-        #        "and will be overwritten by this command at time {}.".format(last_loadtime,
-        #            time.time()))
+        # models that arrive before earlier ones have loaded are queued by
+        # self.delay_queue, so there is no need to check the last load here
         loadtime_mcnt = self.corr.mcnt_from_time(loadtime)
         return loadtime_mcnt
 
@@ -700,27 +767,128 @@ class FEngineOperations(object):
                 self.corr.sensor_manager.sensors_feng_eq(feng)
         return rv
 
-    def set_eq(self, new_eq=None, input_name=None):
+    def auto_eq(self, input_names=None, target_output=0.1, max_averages=30,
+                min_averages=4, tolerance=0.01):
+        """
+        Set the EQ of many inputs automatically, so that their quantised
+        spectra sit at target_output. Snapshots are taken from all the
+        inputs at once and averaged as they arrive, and each input stops
+        being sampled once its estimate stops changing, judged on a cubic
+        fitted across the band. A polynomial is then fitted to all the
+        inputs' corrections together.
+        :param input_names: the inputs to equalise, None for all
+        :param target_output: the goal for numpy.abs(complex_snapshot)
+        :param max_averages: the most snapshots to average per input
+        :param min_averages: the fewest snapshots to average per input
+        :param tolerance: an input has converged when a snapshot changes
+            the cubic fitted to its estimate by less than this fraction
+            anywhere in the band
+        :return: a dict, by input name, of the snapshots averaged, the
+            seconds taken to converge and whether it converged
+        """
+        if input_names is None:
+            fengs = self.fengines
+        else:
+            fengs = [self.get_fengine(input_name) for input_name in input_names]
+        n_chans = self.corr.n_chans
+        #ignore band edges; only use central 80%:
+        start_chan = int(n_chans * 0.1)
+        stop_chan = int(n_chans * 0.9)
+        averages = {feng.input_number: SpectrumAverage(n_chans, start_chan,
+                                                       stop_chan)
+                    for feng in fengs}
+        report = {}
+        active = set(averages.keys())
+        start = time.time()
+        while active:
+            report_progress('averaging snapshots, {} inputs left'.format(
+                len(active)), 0.9 * len(report) / len(averages))
+            # one snapshot from every input still converging, all at once
+            spectra = self.threaded_feng_operation(
+                timeout=self.timeout * max(n_chans / 1024, 1),
+                target_function=(lambda feng_: numpy.abs(
+                    feng_.get_quant_snapshot())
+                    if feng_.input_number in active else None,))
+            for feng in fengs:
+                if feng.input_number not in active:
+                    continue
+                average = averages[feng.input_number]
+                average.add(spectra[feng.input_number])
+                converged = average.count >= min_averages and \
+                    average.change is not None and \
+                    average.change < tolerance
+                if converged or average.count >= max_averages:
+                    active.discard(feng.input_number)
+                    report[feng.name] = {
+                        'averages': average.count,
+                        'converge_time': time.time() - start,
+                        'converged': converged}
+                    self.logger.info('{}: auto-EQ estimate {} after {} '
+                                     'snapshots, {:.2f}s.'.format(
+                                         feng.name, 'converged' if converged
+                                         else 'did not converge',
+                                         average.count, time.time() - start))
+        fengs = [feng for feng in fengs if feng.name in report]
+        if not fengs:
+            return report
+        # fit the corrections for all the inputs in one go
+        chans = numpy.arange(n_chans)
+        errors = numpy.array([
+            target_output / numpy.maximum(averages[feng.input_number].mean,
+                                          1e-12) for feng in fengs])
+        polys = numpy.polyfit(chans[start_chan:stop_chan],
+                              errors[:, start_chan:stop_chan].T, 3)
+        corrections = numpy.array(
+            [numpy.polyval(polys[:, ctr], chans) for ctr in range(len(fengs))])
+        corrections = {feng.input_number: corrections[ctr]
+                       for ctr, feng in enumerate(fengs)}
+        # scale each input's current EQ by its correction
+        report_progress('writing eq', 0.9)
+        self.threaded_feng_operation(
+            timeout=self.timeout * max(n_chans / 1024, 1),
+            target_function=(lambda feng_: feng_.set_eq(
+                (numpy.array(feng_.get_eq()) *
+                 corrections[feng_.input_number]).tolist())
+                if feng_.input_number in corrections else None,))
+        for feng in fengs:
+            if self.corr.sensor_manager:
+                self.corr.sensor_manager.sensors_feng_eq(feng)
+        return report
+
+    def set_eq(self, new_eq=None, input_name=None, force=False):
         """
-        Set the EQ for a specific input, or all inputs.
+        Set the EQ for a specific input, or all inputs. Only the channels
+        that changed are written, unless force is given.
         :param new_eq: an eq list or value or poly
         :param input_name: the input name. None for all fengines.
+        :param force: rewrite every channel
         :return:
         """
         #neweq = utils.process_new_eq(new_eq)
+        if new_eq == 'auto':
+            self.auto_eq(None if input_name is None else [input_name])
+            return
         # if no input is given, apply the new eq to all inputs
         if input_name is None:
             self.logger.info('Applying EQ to all inputs.')
             fengs = self.fengines
             rv = self.threaded_feng_operation(timeout=self.timeout*(self.corr.n_chans/1024),
-                target_function=(lambda feng_: feng_.set_eq(new_eq),))
+                target_function=(lambda feng_: feng_.set_eq(new_eq, force),))
         else:
             fengs = [self.get_fengine(input_name)]
-            fengs[0].set_eq(eq_poly=new_eq)
+            fengs[0].set_eq(eq_poly=new_eq, force=force)
         for feng in fengs:
             if self.corr.sensor_manager:
                 self.corr.sensor_manager.sensors_feng_eq(feng)
 
+    def set_eq_async(self, new_eq=None, input_name=None, force=False):
+        """
+        set_eq, in the background - see async_ops.
+        :return: a concurrent.futures.Future
+        """
+        return self.corr.async_ops.submit('fops.set_eq', self.set_eq,
+                                          new_eq, input_name, force)
+
     def set_fft_shift_all(self, shift_value=None):
         """
         Set the FFT shift on all boards.
@@ -733,7 +901,8 @@ class FEngineOperations(object):
             timeout = numpy.log2(self.corr.n_chans)*3
         else:
             timeout = self.timeout
-        THREADED_FPGA_FUNC(self.hosts, timeout, ('set_fft_shift', (shift_value,),))
+        self.corr.map_hosts('set_fft_shift', self.hosts, timeout,
+                            args=(shift_value,))
         self.logger.info('done.')
         if self.corr.sensor_manager:
             self.corr.sensor_manager.sensors_feng_fft_shift()
@@ -744,7 +913,7 @@ class FEngineOperations(object):
         :return:
         """
         # get the fft shift values
-        rv = THREADED_FPGA_FUNC(self.hosts, 10, 'get_fft_shift')
+        rv = self.corr.map_hosts('get_fft_shift', self.hosts, 10)
         return rv
 
     def fengine_to_host_mapping(self):
@@ -763,7 +932,7 @@ class FEngineOperations(object):
         Clear the various status registers and counters on all the fengines
         :return:
         """
-        THREADED_FPGA_FUNC(self.hosts, 10, 'clear_status')
+        self.corr.map_hosts('clear_status', self.hosts, 10)
 
     def subscribe_to_multicast(self):
         """
@@ -808,6 +977,20 @@ class FEngineOperations(object):
         feng = self.get_fengine(input_name)
         return feng.get_quant_snapshot(channel_select=channel_select)
 
+    def get_quant_snap_timings(self, input_name):
+        """
+        Get the per-window timings of an input's last full-spectrum
+        quantiser snapshot.
+        :param input_name:
+        :return: (the capture's total seconds, a list of window timing
+        dicts - see quant_snapshot.QuantSnapshotCapture.timings), or
+        (None, []) if there has been no full-spectrum capture
+        """
+        capture = self.get_fengine(input_name).quant_capture
+        if capture is None or capture.capture_s is None:
+            return None, []
+        return capture.capture_s, capture.timings()
+
     def get_adc_snapshot(self, input_name=None, unix_time=-1):
         """
         Read the small voltage buffer for a input from a host.
@@ -817,6 +1000,41 @@ class FEngineOperations(object):
                   feng_name1: AdcData(),
                  }
         """
+        ldmcnt, timeout = self._adc_trigger(unix_time)
+        report_progress('waiting for trigger')
+        if input_name is None:
+            # get data for all F-engines triggered at the same time
+            res = self.corr.map_hosts('get_adc_snapshots', self.hosts,
+                                      timeout=timeout + 10,
+                                      kwargs={'loadcnt': ldmcnt,
+                                              'timeout': timeout})
+            rv = {}
+            for feng in self.fengines:
+                rv[feng.name] = res[feng.host.host]['p{}'.format(feng.offset)]
+            return rv
+        else:
+            # return the data only for one given input
+            rv = None
+            host = self.get_fengine(input_name).host
+            rv = host.get_adc_snapshots(input_name, timeout=timeout)
+            return {input_name: rv}
+
+    def get_adc_snapshot_async(self, input_name=None, unix_time=-1):
+        """
+        get_adc_snapshot, in the background - see async_ops.
+        :return: a concurrent.futures.Future
+        """
+        return self.corr.async_ops.submit('fops.get_adc_snapshot',
+                                          self.get_adc_snapshot,
+                                          input_name, unix_time)
+
+    def _adc_trigger(self, unix_time=-1):
+        """
+        Work out the trigger mcnt and read timeout for ADC snapshots.
+        :param unix_time: the time at which to trigger the snapshots, or
+        -1 to trigger straight away
+        :return: (trigger mcnt or None, timeout in seconds)
+        """
         # if no trigger time was specified, trigger in 2s' time.
         if unix_time < 0:
             #unix_time = time.time() + 2
@@ -830,21 +1048,69 @@ class FEngineOperations(object):
             if timeout < 0:
                 raise RuntimeError("Cannot trigger at a time in the past!")
             timeout += 1
+        return ldmcnt, timeout
 
-        if input_name is None:
-            # get data for all F-engines triggered at the same time
-            res = THREADED_FPGA_FUNC(self.hosts, timeout=timeout + 10,
-                target_function=('get_adc_snapshots', [], {'loadcnt': ldmcnt, 'timeout': timeout}))
-            rv = {}
-            for feng in self.fengines:
-                rv[feng.name] = res[feng.host.host]['p{}'.format(feng.offset)]
-            return rv
-        else:
-            # return the data only for one given input
-            rv = None
-            host = self.get_fengine(input_name).host
-            rv = host.get_adc_snapshots(input_name, timeout=timeout)
-            return {input_name: rv}
+    def capture_adc_snapshots(self, filename, unix_time=-1,
+                              compression='gzip', max_reads=8):
+        """
+        Trigger the ADC snapshots of all inputs at the same time and
+        stream them to an HDF5 file, host by host as the reads finish.
+        At most max_reads hosts' data is held in memory at once, however
+        many inputs there are.
+        :param filename: the HDF5 file to write
+        :param unix_time: the time at which to trigger the snapshots
+        :param compression: an h5py compression filter, or None
+        :param max_reads: how many hosts to read at once
+        :return: (the capture's summary dict, a dict of input name ->
+        stats), see transient_capture.TransientCaptureWriter
+        """
+        ldmcnt, timeout = self._adc_trigger(unix_time)
+        writer = TransientCaptureWriter(filename, compression=compression,
+                                        logger=self.logger)
+        try:
+            writer.set_trigger(ldmcnt, unix_time if unix_time >= 0 else None)
+            self.corr.map_hosts('arm_adc_snapshots', self.hosts,
+                                timeout=timeout + 10,
+                                kwargs={'loadcnt': ldmcnt})
+            hosts = Queue.Queue()
+            for host in self.hosts:
+                hosts.put(host)
+            # each reader holds one host's data until it is written, so
+            # the number of readers bounds the memory used
+            failed = []
+
+            def reader():
+                while True:
+                    try:
+                        host = hosts.get_nowait()
+                    except Queue.Empty:
+                        return
+                    try:
+                        data = host.read_adc_snapshots(timeout=timeout)
+                        for feng in host.fengines:
+                            writer.write_input(
+                                feng.name, data['p%i' % feng.offset],
+                                host=host.host, offset=feng.offset,
+                                input_number=feng.input_number)
+                    except Exception as e:
+                        self.logger.error('{}: ADC snapshot capture '
+                                          'failed - {}'.format(host.host, e))
+                        failed.append(host.host)
+            threads = [threading.Thread(target=reader)
+                       for _ in range(min(max_reads, len(self.hosts)))]
+            for thread in threads:
+                thread.setDaemon(True)
+                thread.start()
+            # the reads time out by themselves
+            for thread in threads:
+                thread.join()
+            if failed:
+                raise RuntimeError('ADC snapshot capture to {} incomplete, '
+                                   'failed hosts: {}'.format(writer.filename,
+                                                             failed))
+            return writer.summary(), dict(writer.stats)
+        finally:
+            writer.close()
 
     def get_version_info(self):
         """
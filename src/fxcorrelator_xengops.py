@@ -10,6 +10,7 @@ from casperfpga import utils as fpgautils
 
 import data_stream
 import fxcorrelator_speadops as speadops
+from async_ops import report_progress
 
 # from corr2LogHandlers import getLogger
 
@@ -190,12 +191,14 @@ class XEngineOperations(object):
             board_id += 1
 
         #configure the ethernet cores.
+        report_progress('ethernet cores', 0.1)
         THREADED_FPGA_FUNC(
                 self.hosts, timeout=self.timeout,
                 target_function=('setup_host_gbes',
                                  (), {}))
 
         #subscribe to multicast groups
+        report_progress('multicast', 0.4)
         self.subscribe_to_multicast()
 
         #set the tx_offset registers:
@@ -206,6 +209,7 @@ class XEngineOperations(object):
         # NNB: ensure that the compiled packet buffer is deep enough to accommodate these offsets.
         # for 64A, the shift of the last board will be over 516K!
         board_id = 0
+        report_progress('tx offsets', 0.6)
         self.logger.info("Setting TX offsets.")
         for f in self.hosts:
             offset=f.x_per_fpga*board_id*self.corr.n_antennas*self.xeng_acc_len/(256/32)
@@ -218,8 +222,17 @@ class XEngineOperations(object):
             self.corr.sensor_manager.sensors_stream_destinations()
 
         # set up accumulation length
+        report_progress('accumulation length', 0.9)
         self.set_acc_len(vacc_resync=False)
 
+    def initialise_async(self, *args, **kwargs):
+        """
+        initialise, in the background - see async_ops.
+        :return: a concurrent.futures.Future
+        """
+        return self.corr.async_ops.submit('xops.initialise', self.initialise,
+                                          *args, **kwargs)
+
     def configure(self, *args, **kwargs):
         """
         Configure the xengine operations - this is done whenever a correlator
@@ -279,8 +292,7 @@ class XEngineOperations(object):
         Clear the various status registers and counters on all the xengines
         :return:
         """
-        THREADED_FPGA_FUNC(self.hosts, timeout=self.timeout,
-                           target_function='clear_status')
+        self.corr.map_hosts('clear_status', self.hosts, self.timeout)
 
     def get_baseline_ordering(self):
         """
@@ -328,8 +340,8 @@ class XEngineOperations(object):
         x-engines.
         :return: {}
         """
-        return THREADED_FPGA_FUNC(self.hosts, timeout=self.timeout,
-                                  target_function='get_rx_reorder_status')
+        return self.corr.map_hosts('get_rx_reorder_status', self.hosts,
+                                   self.timeout)
     
     def vaccs_synchronised(self):
         """
@@ -337,8 +349,8 @@ class XEngineOperations(object):
         :return: True or False
         """ 
         t0 = time.time()
-        rv = THREADED_FPGA_FUNC(self.hosts, timeout=self.timeout,
-                                  target_function='get_vacc_timestamps')
+        rv = self.corr.map_hosts('get_vacc_timestamps', self.hosts,
+                                 self.timeout)
         t_delta = time.time() - t0
         
         acc_len = self.vacc_acc_len
@@ -368,8 +380,7 @@ class XEngineOperations(object):
         x-engines.
         :return: {}
         """
-        rv=THREADED_FPGA_FUNC(self.hosts, timeout=self.timeout,
-                                  target_function='get_vacc_status')
+        rv = self.corr.map_hosts('get_vacc_status', self.hosts, self.timeout)
         acc_len=int(self.vacc_acc_len)
         sync=True
         timestamp=rv[rv.keys()[0]][0]['timestamp']
@@ -389,8 +400,7 @@ class XEngineOperations(object):
         Reset all Xengine VACCs
         """
         self.logger.info('Resetting all VACCs.')
-        THREADED_FPGA_FUNC(self.hosts, timeout=self.timeout,
-                               target_function='vacc_reset')
+        self.corr.map_hosts('vacc_reset', self.hosts, self.timeout)
 
     def _vacc_sync_create_loadtime(self, load_time=None):
         """
@@ -542,16 +552,16 @@ class XEngineOperations(object):
 
         # set the load mcount on the x-engines
         self.logger.info('Applying load time: %i.' % load_mcount)
-        THREADED_FPGA_FUNC(
-            self.hosts, timeout=self.timeout,
-            target_function=('vacc_set_loadtime', (load_mcount,),))
+        report_progress('setting load time', 0.3)
+        self.corr.map_hosts('vacc_set_loadtime', self.hosts,
+                            timeout=self.timeout, args=(load_mcount,))
 
         # check the current counts
         #initial_status=self.get_vacc_status()
 
         # arm the xhosts
-        THREADED_FPGA_FUNC(
-            self.hosts, timeout=self.timeout, target_function='vacc_arm')
+        report_progress('arming', 0.6)
+        self.corr.map_hosts('vacc_arm', self.hosts, timeout=self.timeout)
 
         ## did the arm count increase?
         #JM 2019-07-08 Don't bother checking this anymore.
@@ -570,6 +580,14 @@ class XEngineOperations(object):
         #self.vacc_synch_running.clear()
         return synch_time
 
+    def vacc_sync_async(self, sync_time=None):
+        """
+        vacc_sync, in the background - see async_ops.
+        :return: a concurrent.futures.Future
+        """
+        return self.corr.async_ops.submit('xops.vacc_sync', self.vacc_sync,
+                                          sync_time)
+
     def acc_len_from_time(self, acc_time_s):
         """
         Given an acc time in seconds, get the number of cycles
@@ -647,17 +665,13 @@ class XEngineOperations(object):
         if(gapsize > 2**19-1):
             gapsize = 2**19
 
-        THREADED_FPGA_OP(
-            self.hosts, timeout=self.timeout,
-            target_function=(
-                lambda fpga_:
-                fpga_.registers.gapsize.write(gap_size=gapsize),))
+        self.corr.map_hosts(
+            lambda fpga_: fpga_.registers.gapsize.write(gap_size=gapsize),
+            self.hosts, self.timeout)
 
-        THREADED_FPGA_OP(
-            self.hosts, timeout=self.timeout,
-            target_function=(
-                lambda fpga_:
-                fpga_.vacc_set_acc_len(self.vacc_acc_len),))
+        self.corr.map_hosts(
+            lambda fpga_: fpga_.vacc_set_acc_len(self.vacc_acc_len),
+            self.hosts, self.timeout)
         if self.corr.sensor_manager:
             self.corr.sensor_manager.sensors_xeng_acc_time()
         self.logger.info('Set vacc accumulation length %d system-wide '
@@ -699,9 +713,8 @@ class XEngineOperations(object):
         Return the last time the VACCs were all loaded (synchronised),
         else, return -1
         """
-        results = THREADED_FPGA_FUNC(
-            self.hosts, timeout=self.timeout,
-            target_function=('get_vacc_loadtime'))
+        results = self.corr.map_hosts('get_vacc_loadtime', self.hosts,
+                                      self.timeout)
 
         first_loadtime=results.values()[0]
         for hostname,loadtime in results.iteritems():
@@ -0,0 +1,203 @@
+import logging
+import threading
+
+from collections import deque
+from concurrent import futures
+
+LOGGER = logging.getLogger(__name__)
+
+# default number of worker threads shared by all hosts
+MAX_WORKERS = 32
+# and for latency-critical operations, see HostPool.submit_urgent
+URGENT_WORKERS = 32
+
+
+class HostPoolError(RuntimeError):
+    """
+    Some hosts in a HostPool operation failed or timed out. The results
+    from the hosts that did complete are kept.
+    """
+    def __init__(self, results, errors):
+        """
+        :param results: a dict of host -> result for the hosts that completed
+        :param errors: a dict of host -> exception for the others
+        """
+        self.results = results
+        self.errors = errors
+        RuntimeError.__init__(self, 'Failed on {} of {} hosts: {}'.format(
+            len(errors), len(errors) + len(results),
+            ', '.join('{}({})'.format(host, error)
+                      for host, error in sorted(errors.items()))))
+
+
+class HostTimeout(RuntimeError):
+    pass
+
+
+class HostPool(object):
+    """
+    A long-lived, bounded pool of threads for running operations on
+    hosts, instead of starting a thread per host per call.
+
+    Operations on the same host run one at a time, in the order they were
+    submitted, so that no host has more than one request in flight. An
+    operation that times out is cancelled if it has not started, else it
+    finishes in the background while the host's later operations wait
+    behind it - no extra threads are started either way.
+
+    Latency-critical operations, e.g. arming delays, can be submitted
+    urgently: they go ahead of the host's queued operations and run on
+    their own threads, so they only ever wait for the one operation
+    already running on their host.
+    """
+    def __init__(self, max_workers=MAX_WORKERS, urgent_workers=URGENT_WORKERS,
+                 logger=None):
+        """
+        :param max_workers: the number of threads shared by all hosts
+        :param urgent_workers: the number of threads for urgent operations
+        :param logger:
+        :return:
+        """
+        self.max_workers = max_workers
+        self.logger = logger or LOGGER
+        self._executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._urgent_executor = futures.ThreadPoolExecutor(
+            max_workers=urgent_workers)
+        self._lock = threading.Lock()
+        # hostname -> operations waiting for that host
+        self._pending = {}
+        # hostname -> urgent operations waiting for that host
+        self._urgent = {}
+        # hostnames with an operation running or queued in the executor
+        self._busy = set()
+
+    def submit(self, host, fn, *args, **kwargs):
+        """
+        Run fn(host, *args, **kwargs) once the host is free.
+        :param host: the host, anything with a .host name
+        :param fn: the function, or the name of a method of host
+        :return: a concurrent.futures.Future for the result
+        """
+        return self._submit(self._pending, host, fn, args, kwargs)
+
+    def submit_urgent(self, host, fn, *args, **kwargs):
+        """
+        Run fn(host, *args, **kwargs) as soon as the host's current
+        operation is done, ahead of any queued ones.
+        :param host: the host, anything with a .host name
+        :param fn: the function, or the name of a method of host
+        :return: a concurrent.futures.Future for the result
+        """
+        return self._submit(self._urgent, host, fn, args, kwargs)
+
+    def _submit(self, queues, host, fn, args, kwargs):
+        if isinstance(fn, basestring):
+            fn = getattr(type(host), fn)
+        future = futures.Future()
+        with self._lock:
+            queues.setdefault(host.host, deque()).append(
+                (future, fn, host, args, kwargs))
+            if host.host in self._busy:
+                return future
+            self._busy.add(host.host)
+        self._next(host.host)
+        return future
+
+    def _next(self, hostname):
+        """
+        Start the host's next operation that has not been cancelled.
+        """
+        with self._lock:
+            operation, executor = self._pop(hostname)
+            if operation is None:
+                self._busy.discard(hostname)
+                return
+        executor.submit(self._run, hostname, operation)
+
+    def _pop(self, hostname):
+        """
+        Take the host's next operation, urgent ones first. Call with the
+        lock held.
+        :return: (the operation, the executor to run it on), or
+        (None, None) if there are none left
+        """
+        for queues, executor in ((self._urgent, self._urgent_executor),
+                                 (self._pending, self._executor)):
+            pending = queues.get(hostname)
+            while pending:
+                operation = pending.popleft()
+                if operation[0].set_running_or_notify_cancel():
+                    return operation, executor
+        return None, None
+
+    def _run(self, hostname, operation):
+        future, fn, host, args, kwargs = operation
+        try:
+            future.set_result(fn(host, *args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            self._next(hostname)
+
+    @staticmethod
+    def collect(futures_by_key, timeout=None):
+        """
+        Wait for submitted operations and gather their results.
+        :param futures_by_key: a dict of Future -> key, e.g. the host name
+        :param timeout: seconds to wait for all of them, None for ever
+        :return: a dict of key -> result
+        :raises HostPoolError: if any failed or timed out
+        """
+        done, not_done = futures.wait(futures_by_key, timeout)
+        results = {}
+        errors = {}
+        for future in done:
+            key = futures_by_key[future]
+            if future.exception() is None:
+                results[key] = future.result()
+            else:
+                errors[key] = future.exception()
+        for future in not_done:
+            future.cancel()
+            errors[futures_by_key[future]] = HostTimeout(
+                'timed out after {}s'.format(timeout))
+        if errors:
+            raise HostPoolError(results, errors)
+        return results
+
+    def map_hosts(self, fn, hosts, timeout=None, args=(), kwargs=None,
+                  urgent=False):
+        """
+        Run fn(host, *args, **kwargs) on each host, at most one operation
+        per host at a time.
+        :param fn: the function, or the name of a method of the hosts
+        :param hosts: the hosts
+        :param timeout: seconds to wait for all the hosts, None for ever
+        :param args: extra arguments for fn
+        :param kwargs: extra keyword arguments for fn
+        :param urgent: go ahead of queued operations, see submit_urgent
+        :return: a dict of host name -> result
+        :raises HostPoolError: if any hosts failed or timed out, with the
+        results of the others
+        """
+        kwargs = kwargs or {}
+        submit = self.submit_urgent if urgent else self.submit
+        return self.collect(
+            {submit(host, fn, *args, **kwargs): host.host
+             for host in hosts}, timeout)
+
+    def shutdown(self, wait=True):
+        """
+        Cancel the operations that have not started and stop the threads.
+        """
+        with self._lock:
+            for queues in (self._urgent, self._pending):
+                for pending in queues.values():
+                    for operation in pending:
+                        operation[0].cancel()
+            self._pending = {}
+            self._urgent = {}
+        self._urgent_executor.shutdown(wait=wait)
+        self._executor.shutdown(wait=wait)
+
+# end
@@ -0,0 +1,68 @@
+"""
+Compact katcp encoding of numpy arrays, for snapshot and spectrum
+replies that would otherwise be str(list) of thousands of values.
+
+A packed array is sent as five inform arguments:
+
+    encoding dtype shape timestamp data
+
+encoding    'b64' for base64 data, 'raw' for the bytes as they are
+dtype       the numpy dtype string of the data, e.g. <c8 or |i1
+shape       the dimensions joined with 'x', e.g. 4096 or 64x8
+timestamp   the time the data was captured, or '' if not known
+data        the array's bytes, C order
+
+Use unpack_array on the client to get the array back.
+"""
+import base64
+
+import numpy
+
+ENCODINGS = ['b64', 'raw']
+
+
+def pack_array(array, timestamp=None, encoding='b64'):
+    """
+    Pack an array for a katcp reply.
+    :param array: the array, or anything numpy.asarray takes
+    :param timestamp: the capture time of the data, if known
+    :param encoding: 'b64' or 'raw'
+    :return: a list of the five string arguments
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError('Unknown array encoding {}, expected one of '
+                         '{}'.format(encoding, ENCODINGS))
+    array = numpy.asarray(array)
+    # always little-endian, so the client need not know the server's
+    # and C order - unlike ascontiguousarray, require keeps 0-d arrays 0-d
+    array = numpy.require(array, dtype=array.dtype.newbyteorder('<'),
+                          requirements='C')
+    data = array.tostring()
+    if encoding == 'b64':
+        data = base64.b64encode(data)
+    return [encoding, array.dtype.str,
+            'x'.join(str(dim) for dim in array.shape),
+            '' if timestamp is None else repr(timestamp), data]
+
+
+def unpack_array(args):
+    """
+    Unpack an array packed by pack_array.
+    :param args: the five arguments, e.g. an inform's arguments after the
+    source name
+    :return: (the numpy array, the timestamp or None)
+    """
+    if len(args) != 5:
+        raise ValueError('Expected 5 packed array arguments, got '
+                         '{}'.format(len(args)))
+    encoding, dtype, shape, timestamp, data = args
+    if encoding == 'b64':
+        data = base64.b64decode(data)
+    elif encoding != 'raw':
+        raise ValueError('Unknown array encoding {}'.format(encoding))
+    shape = tuple(int(dim) for dim in shape.split('x')) if shape else ()
+    array = numpy.frombuffer(data, dtype=numpy.dtype(dtype)).reshape(shape)
+    timestamp = float(timestamp) if timestamp else None
+    return array, timestamp
+
+# end
@@ -0,0 +1,153 @@
+"""
+Decoding of snapshot fields into numpy arrays, and a planned capture of
+the full spectrum from a post-quantiser snapshot.
+
+A quantiser snapshot holds 2**snap_nsamples words of four channels each,
+so wide-band modes need a window per 4 * 2**snap_nsamples channels, each
+captured at a different trigger offset.
+"""
+import time
+import logging
+
+import numpy
+
+LOGGER = logging.getLogger(__name__)
+
+
+def interleave_fields(data, fields):
+    """
+    Interleave snapshot fields that each hold every nth sample.
+    :param data: the snapshot data dict
+    :param fields: the field names, in sample order
+    :return: a numpy array, field-by-field for each snapshot word
+    """
+    return numpy.column_stack([numpy.asarray(data[field])
+                               for field in fields]).reshape(-1)
+
+
+def snap_complex(data, lanes, out=None):
+    """
+    Build complex64 values from the realN/imagN fields of a snapshot.
+    :param data: the snapshot data dict
+    :param lanes: the N of the fields to use, in channel order
+    :param out: a complex64 array to decode into, the values that do not
+    fit are dropped
+    :return: a complex64 numpy array, out if it was given
+    """
+    real = interleave_fields(data, ['real%i' % lane for lane in lanes])
+    imag = interleave_fields(data, ['imag%i' % lane for lane in lanes])
+    if out is None:
+        out = numpy.empty(len(real), dtype=numpy.complex64)
+    out.real = real[0:len(out)]
+    out.imag = imag[0:len(out)]
+    return out
+
+
+class SnapshotWindow(object):
+    """
+    One capture of a quantiser snapshot: the channels it covers, the
+    trigger offset that selects them and how long it took.
+    """
+    def __init__(self, start_chan, stop_chan, offset):
+        self.start_chan = start_chan
+        self.stop_chan = stop_chan
+        self.offset = offset
+        self.read_s = None
+        self.arm_s = None
+        self.decode_s = None
+
+    def as_dict(self):
+        return {'start_chan': self.start_chan, 'stop_chan': self.stop_chan,
+                'offset': self.offset, 'read_s': self.read_s,
+                'arm_s': self.arm_s, 'decode_s': self.decode_s}
+
+    def __str__(self):
+        def _ms(seconds):
+            return 'none' if seconds is None else \
+                '{:.1f}ms'.format(seconds * 1000.0)
+        return 'chans {}-{} offset {}: read={} arm={} decode={}'.format(
+            self.start_chan, self.stop_chan - 1, self.offset,
+            _ms(self.read_s), _ms(self.arm_s), _ms(self.decode_s))
+
+
+class QuantSnapshotCapture(object):
+    """
+    Capture a full spectrum from a quantiser snapshot, window by window.
+
+    The snapshot has one BRAM, so a window can only be armed once the
+    one before it has been read out. Rather than a full arm, wait and
+    read per window, the next window is armed as soon as the last read
+    returns and the last window is decoded while the next one captures.
+    By the time the next read is issued its capture is done, so each
+    window costs about one BRAM read. The windows are decoded straight
+    into one preallocated buffer.
+    """
+    def __init__(self, snapshot, n_chans, logger=None):
+        """
+        :param snapshot: the casperfpga Snap to capture from
+        :param n_chans: the number of channels in the spectrum
+        :param logger:
+        :return:
+        """
+        self.snapshot = snapshot
+        self.n_chans = n_chans
+        self.logger = logger or LOGGER
+        self.chans_per_window = \
+            (2 ** int(snapshot.block_info['snap_nsamples'])) * 4
+        self.windows = self.plan(n_chans, self.chans_per_window)
+        self.capture_s = None
+
+    @staticmethod
+    def plan(n_chans, chans_per_window):
+        """
+        Work out the offset schedule for a spectrum.
+        :param n_chans: the number of channels in the spectrum
+        :param chans_per_window: channels per snapshot capture
+        :return: a list of SnapshotWindows, in channel order
+        """
+        windows = []
+        for start_chan in range(0, n_chans, chans_per_window):
+            # offset = (required_channel * 8) div 4, see get_quant_snapshot
+            windows.append(SnapshotWindow(
+                start_chan, min(start_chan + chans_per_window, n_chans),
+                start_chan * 8 / 4))
+        return windows
+
+    def capture(self, timeout=10):
+        """
+        Capture the spectrum. The timings of each window are left in
+        self.windows.
+        :param timeout: timeout for each snapshot read, seconds
+        :return: a complex64 numpy array, one value per channel
+        """
+        spectrum = numpy.empty(self.n_chans, dtype=numpy.complex64)
+        start = time.time()
+        self.snapshot.arm(offset=self.windows[0].offset)
+        for ctr, window in enumerate(self.windows):
+            stime = time.time()
+            sdata = self.snapshot.read(arm=False, timeout=timeout)['data']
+            window.read_s = time.time() - stime
+            stime = time.time()
+            if ctr + 1 < len(self.windows):
+                self.snapshot.arm(offset=self.windows[ctr + 1].offset)
+            window.arm_s = time.time() - stime
+            stime = time.time()
+            snap_complex(sdata, range(4),
+                         spectrum[window.start_chan:window.stop_chan])
+            window.decode_s = time.time() - stime
+        self.capture_s = time.time() - start
+        self.logger.debug('Captured {} channels in {} windows in '
+                          '{:.1f}ms'.format(self.n_chans, len(self.windows),
+                                            self.capture_s * 1000.0))
+        for window in self.windows:
+            self.logger.debug('  {}'.format(window))
+        return spectrum
+
+    def timings(self):
+        """
+        :return: a list of dicts with the timing of each window in the
+        last capture
+        """
+        return [window.as_dict() for window in self.windows]
+
+# end
@@ -0,0 +1,132 @@
+import logging
+
+from katcp import Sensor
+
+LOGGER = logging.getLogger(__name__)
+
+# how bad each status is, for picking the worst one
+SEVERITY = {
+    Sensor.NOMINAL: 0,
+    Sensor.WARN: 1,
+    Sensor.ERROR: 2,
+    Sensor.FAILURE: 3,
+}
+
+# common child severity mappings: child status -> parent status
+ERROR_AND_WARN = {Sensor.ERROR: Sensor.ERROR, Sensor.WARN: Sensor.WARN}
+ERROR_ONLY = {Sensor.ERROR: Sensor.ERROR}
+WARN_ONLY = {Sensor.WARN: Sensor.WARN}
+ERROR_AS_WARN = {Sensor.ERROR: Sensor.WARN}
+
+
+def device_status_value(status):
+    """
+    The device-status value that goes with a status.
+    """
+    if status == Sensor.NOMINAL:
+        return 'ok'
+    elif status == Sensor.WARN:
+        return 'degraded'
+    return 'fail'
+
+
+class StatusAggregate(object):
+    """
+    A parent device-status sensor whose status is the worst of its
+    children's statuses, each mapped through that child's severity mapping.
+    Child statuses not in a mapping count as NOMINAL.
+    """
+    def __init__(self, sensor, children):
+        """
+        :param sensor: the parent Corr2Sensor
+        :param children: a list of (child sensor name, severity mapping)
+        :return:
+        """
+        self.sensor = sensor
+        self.mappings = dict(children)
+        self.contributions = {name: Sensor.NOMINAL for name in self.mappings}
+        self.status = None
+
+    def child_changed(self, name, child_status):
+        """
+        Update one child's contribution.
+        :return: True if the parent's status needs recomputing
+        """
+        contribution = self.mappings[name].get(child_status, Sensor.NOMINAL)
+        if contribution == self.contributions[name]:
+            return False
+        self.contributions[name] = contribution
+        return True
+
+    def recompute(self):
+        status = Sensor.NOMINAL
+        for contribution in self.contributions.values():
+            if SEVERITY[contribution] > SEVERITY[status]:
+                status = contribution
+        self.status = status
+        self.sensor.set(value=device_status_value(status), status=status)
+
+
+class SensorAggregator(object):
+    """
+    Keeps aggregate device-status sensors up to date by recomputing a
+    parent only when the status of one of its children changes, instead
+    of polling every child on a timer. Parents can themselves be children
+    of other aggregates.
+    """
+    def __init__(self, sensor_manager, logger=None):
+        """
+        :param sensor_manager: the SensorManager whose sensors are aggregated
+        :param logger:
+        :return:
+        """
+        self.sensor_manager = sensor_manager
+        self.logger = logger or LOGGER
+        self.recomputes = 0
+        self._aggregates = {}
+        self._parents = {}
+
+    def add(self, sensor, children):
+        """
+        Make a sensor an aggregate of its children. The children need not
+        exist yet - they are picked up by name when they are first set.
+        :param sensor: the parent Corr2Sensor
+        :param children: a list of (child sensor name, severity mapping)
+        :return: the StatusAggregate
+        """
+        aggregate = StatusAggregate(sensor, children)
+        self._aggregates[sensor.name] = aggregate
+        for name in aggregate.mappings:
+            self._parents.setdefault(name, []).append(aggregate)
+            try:
+                child = self.sensor_manager.sensor_get(name)
+            except KeyError:
+                continue
+            aggregate.child_changed(name, child.status())
+        self._recompute(aggregate)
+        return aggregate
+
+    def clear(self):
+        self._aggregates = {}
+        self._parents = {}
+
+    def sensor_updated(self, sensor):
+        """
+        Called by the SensorManager whenever a sensor is set.
+        :param sensor: the Corr2Sensor that was set
+        :return:
+        """
+        for aggregate in self._parents.get(sensor.name, []):
+            if aggregate.child_changed(sensor.name, sensor.status()):
+                self._recompute(aggregate)
+
+    def _recompute(self, aggregate):
+        self.recomputes += 1
+        try:
+            aggregate.recompute()
+        except Exception as e:
+            self.logger.error('Error updating aggregate sensor {} - {}'.format(
+                aggregate.sensor.name, e.message))
+            aggregate.sensor.set(value='fail', status=Sensor.FAILURE)
+
+# end
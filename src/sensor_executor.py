@@ -0,0 +1,113 @@
+import time
+import logging
+
+import tornado.gen as gen
+
+from tornado.ioloop import IOLoop
+
+LOGGER = logging.getLogger(__name__)
+
+
+@gen.coroutine
+def host_call(executor, function, *args, **kwargs):
+    """
+    Run a blocking host function on that host's executor and hand the
+    result back on the IOLoop. Callers must only touch sensors once this
+    has returned, so that all Corr2Sensor.set calls stay on the loop.
+    :param executor: the per-host executor, or None to call inline
+    :param function: the blocking function to call
+    :return: whatever function returned
+    """
+    if executor is None:
+        raise gen.Return(function(*args, **kwargs))
+    result = yield executor.submit(function, *args, **kwargs)
+    raise gen.Return(result)
+
+
+def host_snapshot(sensor_manager, host, executor, max_age_s=None):
+    """
+    Get the current status snapshot for a host from the instrument's
+    StatusSnapshotCache, reading the hardware on the host's executor if
+    the cached one is too old.
+    :param sensor_manager: the SensorManager, for its instrument
+    :param host: the host to get a snapshot of
+    :param executor: the host's executor
+    :param max_age_s: freshness bound, None for the cache default
+    :return: a Future resolving to a StatusSnapshot
+    """
+    cache = sensor_manager.instrument.status_cache
+    return host_call(executor, cache.get, host, max_age_s)
+
+
+class LoopBlockMonitor(object):
+    """
+    Measure how long the IOLoop is blocked, by scheduling a tick at a
+    fixed interval and recording how late each tick actually runs.
+    """
+    def __init__(self, interval_s=0.1, report_interval_s=10.0,
+                 sensor=None, logger=None):
+        """
+        :param interval_s: how often to tick the loop
+        :param report_interval_s: how often to report the worst-case block
+        :param sensor: an optional float sensor, set to the max block in ms
+        :param logger: where to log the reports
+        :return:
+        """
+        self.interval_s = interval_s
+        self.report_interval_s = report_interval_s
+        self.sensor = sensor
+        self.logger = logger or LOGGER
+        self.ioloop = None
+        self.running = False
+        self._expected = 0
+        self._next_report = 0
+        self._reset()
+
+    def _reset(self):
+        self.max_block_s = 0.0
+        self.total_block_s = 0.0
+        self.ticks = 0
+
+    def start(self, ioloop=None):
+        """
+        Start ticking on the given (or current) IOLoop.
+        :param ioloop:
+        :return:
+        """
+        self.ioloop = ioloop or IOLoop.current()
+        self.running = True
+        now = self.ioloop.time()
+        self._next_report = now + self.report_interval_s
+        self._expected = now + self.interval_s
+        self.ioloop.call_at(self._expected, self._tick)
+
+    def stop(self):
+        self.running = False
+
+    def _tick(self):
+        if not self.running:
+            return
+        now = self.ioloop.time()
+        block = max(now - self._expected, 0.0)
+        self.max_block_s = max(self.max_block_s, block)
+        self.total_block_s += block
+        self.ticks += 1
+        if now >= self._next_report:
+            self._report()
+            self._next_report = now + self.report_interval_s
+        self._expected = now + self.interval_s
+        self.ioloop.call_at(self._expected, self._tick)
+
+    def _report(self):
+        if self.ticks == 0:
+            return
+        mean_ms = self.total_block_s / self.ticks * 1000.0
+        max_ms = self.max_block_s * 1000.0
+        self.logger.info('IOLoop blocked for up to %.2fms (mean %.2fms) over '
+                         'the last %i ticks.' % (max_ms, mean_ms, self.ticks))
+        if self.sensor is not None:
+            self.sensor.set(value=max_ms, timestamp=time.time(),
+                            status=self.sensor.NOMINAL)
+        self._reset()
+
+# end
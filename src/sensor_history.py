@@ -0,0 +1,212 @@
+import time
+import fnmatch
+import logging
+
+import numpy as np
+
+from katcp import Sensor
+
+LOGGER = logging.getLogger(__name__)
+
+# sensor types that can be stored as a float
+NUMERIC_TYPES = (Sensor.INTEGER, Sensor.FLOAT, Sensor.BOOLEAN)
+
+
+class SensorHistory(object):
+    """
+    A fixed-size ring of (timestamp, value) readings for one numeric
+    sensor, preallocated so recording a reading never allocates.
+    """
+    def __init__(self, length):
+        """
+        :param length: the number of readings to keep
+        :return:
+        """
+        self.length = length
+        self.timestamps = np.zeros(length, dtype=np.float64)
+        self.values = np.zeros(length, dtype=np.float64)
+        self._next = 0
+        self.count = 0
+
+    def nbytes(self):
+        return self.timestamps.nbytes + self.values.nbytes
+
+    def append(self, timestamp, value):
+        self.timestamps[self._next] = timestamp
+        self.values[self._next] = value
+        self._next = (self._next + 1) % self.length
+        self.count = min(self.count + 1, self.length)
+
+    def readings(self, start=None, end=None):
+        """
+        The stored readings in time order, optionally limited to a window.
+        :param start: earliest timestamp to return, None for all
+        :param end: latest timestamp to return, None for all
+        :return: (timestamps, values) numpy arrays
+        """
+        if self.count < self.length:
+            timestamps = self.timestamps[:self.count]
+            values = self.values[:self.count]
+        else:
+            timestamps = np.roll(self.timestamps, -self._next)
+            values = np.roll(self.values, -self._next)
+        mask = np.ones(len(timestamps), dtype=bool)
+        if start is not None:
+            mask &= timestamps >= start
+        if end is not None:
+            mask &= timestamps <= end
+        return timestamps[mask], values[mask]
+
+    def decimate(self, start=None, end=None, buckets=100):
+        """
+        Summarise the readings in a window as equal-width time buckets.
+        Readings are only stored when a sensor changes, so each value is
+        held until the next reading: means are weighted by how long a value
+        was held, and a bucket with no readings of its own still reports the
+        value held through it. Buckets before the first reading, or while
+        the sensor was unknown, are left out.
+        :param start: start of the window, default the oldest reading
+        :param end: end of the window, default the newest reading
+        :param buckets: how many buckets to split the window into
+        :return: a list of (bucket start, min, max, mean, count) tuples,
+        count being the number of readings stored in the bucket
+        """
+        timestamps, values = self.readings(None, end)
+        if len(timestamps) == 0:
+            return []
+        start = timestamps[0] if start is None else start
+        end = timestamps[-1] if end is None else end
+        end = max(end, start + 1e-9)
+        width = (end - start) / buckets
+        edges = start + width * np.arange(buckets + 1)
+        edges[-1] = end
+        # split the window at the bucket edges and at every reading, the
+        # value over each segment being the last reading before it
+        inside = timestamps[(timestamps > start) & (timestamps < end)]
+        points = np.union1d(edges, inside)
+        seg_start = points[:-1]
+        seg_len = np.diff(points)
+        held = np.searchsorted(timestamps, seg_start, side='right') - 1
+        seg_value = values[np.maximum(held, 0)]
+        valid = (held >= 0) & (seg_len > 0) & ~np.isnan(seg_value)
+        seg_bucket = np.minimum(
+            np.searchsorted(edges, seg_start, side='right') - 1, buckets - 1)
+        seg_bucket = seg_bucket[valid]
+        seg_value = seg_value[valid]
+        seg_len = seg_len[valid]
+        held_for = np.bincount(seg_bucket, weights=seg_len, minlength=buckets)
+        sums = np.bincount(seg_bucket, weights=seg_value * seg_len,
+                           minlength=buckets)
+        mins = np.full(buckets, np.inf)
+        maxs = np.full(buckets, -np.inf)
+        np.minimum.at(mins, seg_bucket, seg_value)
+        np.maximum.at(maxs, seg_bucket, seg_value)
+        recorded = (timestamps >= start) & ~np.isnan(values)
+        index = np.minimum(
+            ((timestamps[recorded] - start) / width).astype(np.int64),
+            buckets - 1)
+        counts = np.bincount(index, minlength=buckets)
+        used = np.nonzero(held_for)[0]
+        return [(edges[ctr], mins[ctr], maxs[ctr],
+                 sums[ctr] / held_for[ctr], int(counts[ctr])) for ctr in used]
+
+
+class SensorHistoryStore(object):
+    """
+    Opt-in history for the numeric sensors of a SensorManager. Memory is
+    bounded by length * max_sensors readings of 16 bytes each.
+    """
+    def __init__(self, length, max_sensors=1000, patterns=None, logger=None):
+        """
+        :param length: readings kept per sensor
+        :param max_sensors: the most sensors that will get a history
+        :param patterns: fnmatch patterns of sensor names to record, None
+        for all numeric sensors
+        :param logger:
+        :return:
+        """
+        self.length = length
+        self.max_sensors = max_sensors
+        self.patterns = patterns or ['*']
+        self.logger = logger or LOGGER
+        self._histories = {}
+        self._ignored = set()
+
+    def nbytes(self):
+        return sum(history.nbytes() for history in self._histories.values())
+
+    def _wanted(self, sensor):
+        if sensor.type not in NUMERIC_TYPES:
+            return False
+        for pattern in self.patterns:
+            if fnmatch.fnmatch(sensor.name, pattern):
+                return True
+        return False
+
+    def record(self, sensor):
+        """
+        Store a sensor's current reading, if it is being recorded.
+        :param sensor: a katcp Sensor
+        :return:
+        """
+        name = sensor.name
+        history = self._histories.get(name)
+        if history is None:
+            if name in self._ignored:
+                return
+            if not self._wanted(sensor):
+                self._ignored.add(name)
+                return
+            if len(self._histories) >= self.max_sensors:
+                self.logger.warning('Sensor history full, not recording '
+                                    '{}.'.format(name))
+                self._ignored.add(name)
+                return
+            history = SensorHistory(self.length)
+            self._histories[name] = history
+        timestamp, status, value = sensor.read()
+        if status in (Sensor.UNKNOWN, Sensor.INACTIVE) or value is None:
+            # a gap, so the last good value is not held through it
+            value = np.nan
+        history.append(timestamp, float(value))
+
+    def get(self, sensor_name):
+        """
+        :param sensor_name:
+        :return: the SensorHistory for a sensor
+        """
+        if sensor_name not in self._histories:
+            raise KeyError('No history for sensor {}'.format(sensor_name))
+        return self._histories[sensor_name]
+
+    def clear(self):
+        self._histories = {}
+        self._ignored = set()
+
+
+def summarise_history(sensor_manager, sensor_name, period, buckets):
+    """
+    Summarise the recent history of a numeric sensor, for the servlets'
+    ?sensor-history requests.
+    :param sensor_manager: the instrument's SensorManager, or None if the
+    sensors have not been set up
+    :param sensor_name: the sensor to query
+    :param period: how many seconds of history to summarise
+    :param buckets: how many time buckets to split the period into
+    :return: a list of (start-time, min, max, mean, num-readings), one
+    per bucket
+    :raises ValueError: if there is no history to summarise
+    """
+    if sensor_manager is None:
+        raise ValueError('Sensors have not been set up yet.')
+    if sensor_manager.history is None:
+        raise ValueError('Sensor history is disabled - set '
+                         'sensor_history_length in the config.')
+    try:
+        ring = sensor_manager.history.get(sensor_name)
+    except KeyError:
+        raise ValueError('No history recorded for {}.'.format(sensor_name))
+    end = time.time()
+    return ring.decimate(end - period, end, buckets)
+
+# end
@@ -1,81 +1,354 @@
-import time;
-import math;
+import heapq
+import random
+import logging
+import itertools
 
+from collections import deque
 
-sensor_call_gap_time_s = 0.003;
-sensor_loop_runtime = 0;
-sensor_loop_running_tasks = 0;
-sensor_loop_start_time = round(time.time())+4;
-sensor_loop_flow_control_padding = 0;
-logger = None;
+from tornado.ioloop import IOLoop
 
-class SensorTask:
-    def __init__(self,function_name,minimum_time_between_calls_s=0):
+LOGGER = logging.getLogger(__name__)
+
+# consecutive over/under-runs before a task's period is adjusted
+FLOW_CONTROL_RUNS = 5
+
+# recent runtimes and periods kept per task, for the runtime statistics
+RUNTIME_HISTORY = 256
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a sequence.
+    :param values:
+    :param fraction: 0.5 for the median, 0.95 for p95, etc.
+    :return: the percentile, or zero for no values
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+class SensorTask(object):
+    """
+    A periodic sensor callback and its scheduling state.
+    """
+    def __init__(self, function_name, minimum_time_between_calls_s=0,
+                 host=None, period_s=None, offset_s=None):
+        """
+        :param function_name: a name for logging
+        :param minimum_time_between_calls_s: never call more often than this
+        :param host: the host this task talks to, None if it is not tied to
+        a single host (and so not subject to the per-host limit)
+        :param period_s: the nominal period, None for the scheduler default
+        :param offset_s: run at this fixed offset into each period, counted
+        from the top of the minute, instead of at a random phase. Used to
+        stagger tasks deterministically.
+        :return:
+        """
+        self.name = function_name
+        self.offset_s = offset_s
+        # the callback's name, set when the task is added
+        self.kind = function_name
+        self.host = host
+        self.period_s = period_s
+        self.minimum_time_between_calls_s = minimum_time_between_calls_s
+        self.callback = None
+        self.args = ()
+        # runtime bookkeeping
+        self.calls = 0
+        self.last_start = 0
         self.last_runtime_length = 0
-        self.last_runtime_utc = 0;
-        self.executed = False;
-        self.name = function_name;
-        self.num_time_overruns = 0;
-        self.flow_control_increments = 0;
-        self.minimum_time_between_calls_ms = minimum_time_between_calls_s;
-        logger.debug(self.name)
-
-    def getNextSensorCallTime(self,current_function_runtime=0):
-        global sensor_loop_runtime;
-        global sensor_call_gap_time_s;
-        global sensor_loop_running_tasks;
-        global sensor_loop_start_time;
-        global sensor_loop_flow_control_padding;
-        global logger
-        
-        #printTime = False;
-        last_runtime_length = self.last_runtime_length;
-        if(self.executed == False):
-            self.executed = True;
-            sensor_loop_running_tasks+=1
-            self.last_runtime_utc = sensor_loop_start_time;
-        #    printTime = True;
-
-        self.last_runtime_length = current_function_runtime
-        
-	time_increment = (sensor_loop_running_tasks+sensor_loop_flow_control_padding)*sensor_call_gap_time_s
-
-	#This ensures that a sensor is not called within a specified minimum time - this ensures we play nicely with some CAM
-	if(time_increment<self.minimum_time_between_calls_ms):
-		num_time_increments_required = math.ceil(self.minimum_time_between_calls_ms/time_increment)
-		time_increment = time_increment * num_time_increments_required
-		#print( time.time()," Time increments required: ",num_time_increments_required)
-		#print( time.time()," Total Time Incrementing: ",time_increment)
-
-
-        next_sensor_call_time = self.last_runtime_utc + time_increment
-        self.last_runtime_utc = next_sensor_call_time
-
-        #Network Flow Control
-        if(current_function_runtime>sensor_call_gap_time_s*(self.flow_control_increments+1)):
-            self.num_time_overruns+=1;
-        elif(current_function_runtime<sensor_call_gap_time_s*(self.flow_control_increments)):
-            self.num_time_overruns-=1;
+        self.max_runtime_length = 0
+        self.max_lateness = 0
+        self.overruns = 0
+        self.num_time_overruns = 0
+        self.flow_control_increments = 0
+        self.runtimes = deque(maxlen=RUNTIME_HISTORY)
+        self.periods = deque(maxlen=RUNTIME_HISTORY)
+
+    def effective_period(self, default_period_s):
+        """
+        The period this task is currently run at: its nominal period,
+        stretched by any flow control, and never less than the minimum.
+        :param default_period_s: the scheduler's default period
+        :return:
+        """
+        period = self.period_s if self.period_s is not None \
+            else default_period_s
+        period += self.flow_control_increments * period
+        return max(period, self.minimum_time_between_calls_s)
+
+    def next_slot(self, now, default_period_s):
+        """
+        The next time after now that falls on this task's offset.
+        :param now:
+        :param default_period_s: the scheduler's default period
+        :return:
+        """
+        period = self.effective_period(default_period_s)
+        # periods should divide into a minute to keep slots aligned
+        slot = now - now % 60 + self.offset_s % period
+        if slot < now:
+            slot += ((now - slot) // period + 1) * period
+        return slot
+
+    def record_runtime(self, runtime, default_period_s):
+        """
+        Update the overrun counters after a call. After FLOW_CONTROL_RUNS
+        consecutive overruns the task backs off by one period; after as
+        many comfortable runs it speeds back up.
+        :param runtime: how long the call took, seconds
+        :param default_period_s: the scheduler's default period
+        :return:
+        """
+        self.calls += 1
+        self.last_runtime_length = runtime
+        self.runtimes.append(runtime)
+        self.max_runtime_length = max(self.max_runtime_length, runtime)
+        period = self.effective_period(default_period_s)
+        if runtime > period:
+            self.overruns += 1
+            self.num_time_overruns = max(self.num_time_overruns, 0) + 1
+        elif runtime < period / 2.0:
+            self.num_time_overruns = min(self.num_time_overruns, 0) - 1
         else:
-            self.num_time_overruns=0
-        
-        if(self.num_time_overruns > 5):
-            #print("%s took %fs longer to run than allocated - this occured five times in a row, performing flow control"%(self.name,current_function_runtime-(1+self.flow_control_increments)*sensor_call_gap_time_s))
-            self.num_time_overruns=0
-            self.flow_control_increments+=1
-            sensor_loop_flow_control_padding+=1
-
-        if(self.num_time_overruns < -5):
-            #print("%s took %fs less to run than allocated - this occured five times in a row, performing flow control"%((1+self.flow_control_increments)*sensor_call_gap_time_s)-self.name,current_function_runtime)
-            self.num_time_overruns=0
-            self.flow_control_increments-=1
-            sensor_loop_flow_control_padding-=1
-
-        logger.debug('{0:} finished at {1:.4f}. Next Call:{2:.4f} Runtime: {3:.5f}.'.format(self.name,time.time(),next_sensor_call_time,current_function_runtime))
-        #if(printTime):
-        #    print ("Sensor function: {0:} First Call: {1:.4f} Next Call: {2:.4f}".format(self.name,time.time(),next_sensor_call_time))
-        return next_sensor_call_time
-
-        
-    
-    
+            self.num_time_overruns = 0
+        if self.num_time_overruns >= FLOW_CONTROL_RUNS:
+            self.num_time_overruns = 0
+            self.flow_control_increments += 1
+        elif self.num_time_overruns <= -FLOW_CONTROL_RUNS:
+            self.num_time_overruns = 0
+            self.flow_control_increments = max(
+                self.flow_control_increments - 1, 0)
+
+    def __repr__(self):
+        return '<SensorTask {}>'.format(self.name)
+
+
+class SensorScheduler(object):
+    """
+    Run SensorTasks off a heap of deadlines on an IOLoop, limiting how many
+    calls run on any one host at a time and how many calls are started
+    per second overall.
+    """
+    def __init__(self, ioloop=None, default_period_s=2.0, max_calls_per_s=0,
+                 max_concurrent_per_host=1, jitter_fraction=0.1,
+                 logger=None):
+        """
+        :param ioloop: the IOLoop to run on, default the current one
+        :param default_period_s: period for tasks that don't specify one
+        :param max_calls_per_s: global I/O budget, zero for no limit
+        :param max_concurrent_per_host: calls allowed in flight per host
+        :param jitter_fraction: random fraction of a period added to each
+        deadline, to stop tasks bunching up
+        :param logger:
+        :return:
+        """
+        self.ioloop = ioloop or IOLoop.current()
+        self.default_period_s = default_period_s
+        self.max_calls_per_s = max_calls_per_s
+        self.max_concurrent_per_host = max_concurrent_per_host
+        self.jitter_fraction = jitter_fraction
+        self.logger = logger or LOGGER
+        self.tasks = []
+        self._heap = []
+        self._seq = itertools.count()
+        self._running = {}
+        self._blocked = {}
+        self._tokens = float(max(max_calls_per_s, 1))
+        self._token_time = self.ioloop.time()
+        self._timeout = None
+        self._timeout_deadline = None
+        self._started = False
+        self._dispatching = False
+
+    def add_task(self, task, callback, *args):
+        """
+        Add a task to the scheduler. The callback is called with args every
+        period; it may return a Future, in which case the task only counts
+        as finished when that resolves.
+        :param task: a SensorTask
+        :param callback: the function to call
+        :param args: arguments to the callback
+        :return:
+        """
+        task.callback = callback
+        task.kind = getattr(callback, '__name__', task.name)
+        task.args = args
+        self.tasks.append(task)
+        now = self.ioloop.time()
+        if task.offset_s is not None:
+            self._push(task, task.next_slot(now, self.default_period_s))
+            return
+        # spread the first calls over one period
+        period = task.effective_period(self.default_period_s)
+        self._push(task, now + random.uniform(0, period))
+
+    def start(self):
+        self._started = True
+        self._wake()
+
+    def stop(self):
+        self._started = False
+        if self._timeout is not None:
+            self.ioloop.remove_timeout(self._timeout)
+            self._timeout = None
+
+    def _push(self, task, deadline):
+        heapq.heappush(self._heap, (deadline, next(self._seq), task))
+        if not self._started or self._dispatching:
+            return
+        if self._timeout_deadline is None or \
+                deadline < self._timeout_deadline:
+            self._wake()
+
+    def _wake(self, when=None):
+        if not self._started:
+            return
+        if when is None:
+            if not self._heap:
+                return
+            when = self._heap[0][0]
+        if self._timeout is not None:
+            self.ioloop.remove_timeout(self._timeout)
+        self._timeout_deadline = when
+        self._timeout = self.ioloop.call_at(when, self._dispatch)
+
+    def _take_token(self, now):
+        """
+        Token bucket for the global calls/s budget.
+        :return: zero if a call may start now, else seconds until one may
+        """
+        if self.max_calls_per_s <= 0:
+            return 0
+        self._tokens = min(
+            self._tokens + (now - self._token_time) * self.max_calls_per_s,
+            float(max(self.max_calls_per_s, 1)))
+        self._token_time = now
+        # allow for float rounding, else the wait can round to nothing
+        if self._tokens >= 1 - 1e-9:
+            self._tokens = max(self._tokens - 1, 0.0)
+            return 0
+        return (1 - self._tokens) / self.max_calls_per_s
+
+    def _dispatch(self):
+        self._timeout = None
+        self._timeout_deadline = None
+        now = self.ioloop.time()
+        self._dispatching = True
+        try:
+            self._dispatch_due(now)
+        finally:
+            self._dispatching = False
+
+    def _dispatch_due(self, now):
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, task = self._heap[0]
+            if task.host is not None and \
+                    self._running.get(task.host, 0) >= \
+                    self.max_concurrent_per_host:
+                # park it until the host frees up
+                heapq.heappop(self._heap)
+                self._blocked.setdefault(task.host, []).append(
+                    (deadline, task))
+                continue
+            wait = self._take_token(now)
+            if wait > 0:
+                self._wake(now + wait)
+                return
+            heapq.heappop(self._heap)
+            self._run(task, deadline, now)
+        self._wake()
+
+    def _run(self, task, deadline, now):
+        if task.host is not None:
+            self._running[task.host] = self._running.get(task.host, 0) + 1
+        if task.calls > 0:
+            task.periods.append(now - task.last_start)
+        task.last_start = now
+        task.max_lateness = max(task.max_lateness, now - deadline)
+        try:
+            result = task.callback(*task.args)
+        except Exception as e:
+            self.logger.error('Sensor task {} failed - {}'.format(
+                task.name, e.message))
+            result = None
+        if hasattr(result, 'add_done_callback'):
+            self.ioloop.add_future(
+                result, lambda future: self._finished(task, future))
+        else:
+            self._finished(task)
+
+    def _finished(self, task, future=None):
+        if future is not None and future.exception() is not None:
+            self.logger.error('Sensor task {} failed - {}'.format(
+                task.name, future.exception()))
+        now = self.ioloop.time()
+        task.record_runtime(now - task.last_start, self.default_period_s)
+        period = task.effective_period(self.default_period_s)
+        if task.offset_s is not None:
+            # keep to its slot, skipping any it overran into
+            deadline = task.next_slot(max(now, task.last_start + period / 2.0),
+                                      self.default_period_s)
+        else:
+            jitter = random.uniform(0, self.jitter_fraction * period)
+            deadline = max(task.last_start + period + jitter, now)
+        self.logger.debug('{0:} finished at {1:.4f}. Next Call:{2:.4f} '
+                          'Runtime: {3:.5f}.'.format(
+                              task.name, now, deadline,
+                              task.last_runtime_length))
+        if task.host is not None:
+            self._running[task.host] -= 1
+            for blocked_deadline, blocked_task in \
+                    self._blocked.pop(task.host, []):
+                self._push(blocked_task, blocked_deadline)
+        self._push(task, deadline)
+
+    @staticmethod
+    def _summarise(tasks, default_period_s):
+        runtimes = []
+        periods = []
+        for task in tasks:
+            runtimes.extend(task.runtimes)
+            periods.extend(task.periods)
+        target = sum(task.effective_period(default_period_s)
+                     for task in tasks) / len(tasks)
+        return {
+            'calls': sum(task.calls for task in tasks),
+            'runtime_p50': percentile(runtimes, 0.5),
+            'runtime_p95': percentile(runtimes, 0.95),
+            'runtime_max': max(task.max_runtime_length for task in tasks),
+            'overruns': sum(task.overruns for task in tasks),
+            'max_lateness': max(task.max_lateness for task in tasks),
+            'target_period': target,
+            'achieved_period': (sum(periods) / len(periods)
+                                if periods else 0.0),
+        }
+
+    def stats(self, group_by=None):
+        """
+        Runtime statistics over each task's recent calls.
+        :param group_by: None for one entry per task, 'kind' to combine the
+        tasks for each callback, or 'host' to combine the tasks on each host
+        (tasks not tied to a host are left out)
+        :return: a dict of key -> dict of calls, runtime_p50, runtime_p95,
+        runtime_max, overruns, max_lateness, target_period and
+        achieved_period. Keys are (kind, host) tuples per task, else the
+        kind or host.
+        """
+        groups = {}
+        for task in self.tasks:
+            if group_by == 'kind':
+                key = task.kind
+            elif group_by == 'host':
+                if task.host is None:
+                    continue
+                key = task.host
+            else:
+                key = (task.kind, task.host)
+            groups.setdefault(key, []).append(task)
+        return {key: self._summarise(tasks, self.default_period_s)
+                for key, tasks in groups.items()}
+
+# end
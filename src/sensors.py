@@ -2,6 +2,8 @@
 # Yes, I know it's just an integer value
 from logging import ERROR
 import time
+import threading
+from collections import OrderedDict
 
 import pkginfo
 
@@ -14,6 +16,10 @@ import corr2
 from corr2.corr2LogHandlers import getKatcpLogger
 
 import data_stream
+from sensor_aggregate import SensorAggregator
+from sensor_history import SensorHistoryStore
+from counter_engine import CounterEngine
+from delay_trace import HISTOGRAM_EDGES_MS
 
 # LOGGER = logging.getLogger(__name__)
 
@@ -193,6 +199,123 @@ class Corr2Sensor(Sensor):
         self.set(time.time(), self.INACTIVE, None)
 
 
+class SensorInformPublisher(object):
+    """
+    Collect updated sensors and send their #sensor-status informs in
+    batches on a tick, rather than one mass_inform per Corr2Sensor.set.
+    Only the latest value of a sensor is sent in each batch.
+    """
+    def __init__(self, katcp_server, interval=0.1, byte_budget=0,
+                 logger=None):
+        """
+        :param katcp_server: the KATCP server to mass_inform on
+        :param interval: seconds between flushes, zero to send immediately
+        :param byte_budget: bytes/second allowed to each client, zero for
+        no limit. mass_inform sends every inform to every client, so this
+        is applied per flush and holds for each client alike.
+        :param logger:
+        :return:
+        """
+        self.katcp_server = katcp_server
+        self.interval = interval
+        self.byte_budget = byte_budget
+        self.logger = logger
+        self.informs_sent = 0
+        self.informs_suppressed = 0
+        self.informs_deferred = 0
+        self.bytes_sent = 0
+        self._dirty = OrderedDict()
+        self._lock = threading.Lock()
+        self._flush_pending = False
+
+    def _ioloop(self):
+        return getattr(self.katcp_server, 'ioloop', None)
+
+    def stats(self):
+        """
+        :return: a dictionary of the publisher counters
+        """
+        with self._lock:
+            return {'informs_sent': self.informs_sent,
+                    'informs_suppressed': self.informs_suppressed,
+                    'informs_deferred': self.informs_deferred,
+                    'bytes_sent': self.bytes_sent,
+                    'pending': len(self._dirty)}
+
+    def publish(self, sensor):
+        """
+        Queue a sensor for the next flush. If it is already queued, the
+        older value is dropped and counted as suppressed.
+        :param sensor: A katcp.Sensor object
+        :return:
+        """
+        ioloop = self._ioloop()
+        if self.interval <= 0 or ioloop is None:
+            self._send(self._inform(sensor))
+            return
+        with self._lock:
+            if sensor.name in self._dirty:
+                self.informs_suppressed += 1
+            self._dirty[sensor.name] = sensor
+            if self._flush_pending:
+                return
+            self._flush_pending = True
+        # add_callback is the only thread-safe IOLoop method
+        ioloop.add_callback(ioloop.call_later, self.interval, self.flush)
+
+    def flush(self):
+        """
+        Send the queued informs, up to the byte budget for this tick. Any
+        left over are kept, oldest first, for the next tick.
+        :return:
+        """
+        with self._lock:
+            pending = self._dirty
+            self._dirty = OrderedDict()
+            self._flush_pending = False
+        budget = self.byte_budget * self.interval
+        used = 0
+        deferred = OrderedDict()
+        for name, sensor in pending.items():
+            if deferred:
+                deferred[name] = sensor
+                continue
+            msg = self._inform(sensor)
+            size = len(str(msg)) + 1
+            # always allow one inform per tick so a tiny budget can't stall
+            if budget and used and (used + size > budget):
+                deferred[name] = sensor
+                continue
+            used += size
+            self._send(msg, size)
+        if not deferred:
+            return
+        with self._lock:
+            self.informs_deferred += len(deferred)
+            # deferred informs go out first next time
+            merged = deferred
+            for name in deferred.keys():
+                self._dirty.pop(name, None)
+            merged.update(self._dirty)
+            self._dirty = merged
+            if self._flush_pending:
+                return
+            self._flush_pending = True
+        self._ioloop().call_later(self.interval, self.flush)
+
+    @staticmethod
+    def _inform(sensor):
+        return Message.inform(
+            'sensor-status', time.time(), 1, sensor.name,
+            sensor.STATUSES[sensor.status()], sensor.value())
+
+    def _send(self, msg, size=None):
+        self.katcp_server.mass_inform(msg)
+        with self._lock:
+            self.informs_sent += 1
+            self.bytes_sent += size or (len(str(msg)) + 1)
+
+
 class SensorManager(object):
     """
     A place to store information and functionality relevant to corr2 sensors.
@@ -207,15 +330,35 @@ class SensorManager(object):
         :param instrument: a corr2 instance
         :param katcp_sensors: add sensors to the Katcp server itself
         :param kcs_sensors: manually emit informs to the attached KCS
+        :param inform_interval: seconds between batched sensor-status
+        informs, defaults to the instrument's sensor_inform_interval
+        :param inform_byte_budget: bytes/second of sensor-status informs
+        per client, defaults to the instrument's sensor_inform_byte_budget
+        :param history_length: readings of history to keep per numeric
+        sensor, defaults to the instrument's sensor_history_length. Zero
+        keeps no history.
+        :param name: name for the logger when there is no instrument,
+        defaults to the katcp server's host
         :return:
         """
         self.katcp_server = katcp_server
         self.instrument = instrument
+        inform_interval = kwargs.pop(
+            'inform_interval',
+            getattr(instrument, 'sensor_inform_interval', 0.1))
+        inform_byte_budget = kwargs.pop(
+            'inform_byte_budget',
+            getattr(instrument, 'sensor_inform_byte_budget', 0))
+        history_length = kwargs.pop(
+            'history_length',
+            getattr(instrument, 'sensor_history_length', 0))
+        name = kwargs.pop('name', None)
 
         if instrument is None:
             # You are a strong, independent SensorManager
             self.getLogger = getKatcpLogger
-            logger_name = '{}_sens_man'.format(katcp_server.host.host)
+            logger_name = '{}_sens_man'.format(
+                name or katcp_server.host.host)
         else:
             # The instrument already has a getLogger attribute
             self.getLogger = instrument.getLogger
@@ -234,6 +377,20 @@ class SensorManager(object):
         self.kcs_sensors = kcs_sensors
         self._sensors = {}
         self._debug_mode = False
+        self.scheduler = None
+        self.publisher = SensorInformPublisher(
+            katcp_server, interval=inform_interval,
+            byte_budget=inform_byte_budget, logger=self.logger)
+        self.aggregator = SensorAggregator(self, logger=self.logger)
+        self.counters = CounterEngine(logger=self.logger)
+        self.history = None
+        if history_length > 0:
+            self.history = SensorHistoryStore(
+                history_length,
+                max_sensors=getattr(instrument, 'sensor_history_max_sensors',
+                                    1000),
+                patterns=getattr(instrument, 'sensor_history_sensors', None),
+                logger=self.logger)
 
     def sensors(self):
         return self._sensors
@@ -244,6 +401,10 @@ class SensorManager(object):
         :return:
         """
         self._sensors = {}
+        self.aggregator.clear()
+        self.counters.forget()
+        if self.history is not None:
+            self.history.clear()
 
     def sensor_add(self, sensor):
         """
@@ -311,6 +472,9 @@ class SensorManager(object):
         """
         if self.kcs_sensors:
             self._kcs_sensor_set(sensor)
+        self.aggregator.sensor_updated(sensor)
+        if self.history is not None:
+            self.history.record(sensor)
 
     def _kcs_sensor_set(self, sensor):
         """
@@ -328,10 +492,7 @@ class SensorManager(object):
                         str(sensor.value()))
             return
         assert self.kcs_sensors
-        supdate_inform = Message.inform(
-            'sensor-status', time.time(), 1, sensor.name,
-            sensor.STATUSES[sensor.status()], sensor.value())
-        self.katcp_server.mass_inform(supdate_inform)
+        self.publisher.publish(sensor)
 
     def _kcs_sensor_create(self, sensor):
         """
@@ -656,8 +817,11 @@ class Corr2SensorManager(SensorManager):
         sensor = self.do_sensor(
             Corr2Sensor.string, '{}-eq'.format(pref),
             'The unitless, per-channel digital scaling factors '
-            'implemented prior to requantisation. Complex.')
-        sensor.set_value(str(feng.last_eq))
+            'implemented prior to requantisation. Complex. Encoded as '
+            '"poly c0,c1,..." polynomial coefficients, "rle n*value ..." '
+            'runs of equal values, or "b64 data" big-endian int16 real, '
+            'imag pairs - ?eq-array gets the full array.')
+        sensor.set_value(feng.eq_encoded())
 
     def sensors_feng_delays(self, feng):
         """
@@ -707,6 +871,49 @@ class Corr2SensorManager(SensorManager):
                     phase_offset,
                     phase_offset_delta))
 
+    def sensors_delay_trace(self, tracer):
+        """
+        Delay update latency sensors, from a delay_trace.DelayTracer.
+        :return:
+        """
+        stages, hosts = tracer.stats()
+        host_names = {host.host: 'fhost{:02}'.format(ctr)
+                      for ctr, host in enumerate(self.instrument.fhosts)}
+
+        def set_stage(prefix, name, stats):
+            for stat in ['p95', 'max']:
+                sensor = self.do_sensor(
+                    Corr2Sensor.float, '{}.{}.{}'.format(prefix, name, stat),
+                    'Delay update time spent in the {} stage, {}.'.format(
+                        name, stat), unit='ms')
+                sensor.set(value=stats[stat] * 1000.0, status=Sensor.NOMINAL)
+            sensor = self.do_sensor(
+                Corr2Sensor.string, '{}.{}.histogram'.format(prefix, name),
+                'Delay updates per {} stage time bucket, bucket upper edges '
+                '{} ms and slower.'.format(
+                    name, ','.join(str(edge) for edge in HISTOGRAM_EDGES_MS)))
+            sensor.set(value=stats['histogram'], status=Sensor.NOMINAL)
+
+        for name, stats in stages.items():
+            set_stage('delay-trace', name, stats)
+        for host, host_stages in hosts.items():
+            for name, stats in host_stages.items():
+                set_stage('{}.delay-trace'.format(
+                    host_names.get(host, host)), name, stats)
+        traces = tracer.last(1)
+        sensor = self.do_sensor(
+            Corr2Sensor.integer, 'delay-trace.late',
+            'Delay updates armed less than {:.0f} ms before their load '
+            'time.'.format(tracer.late_margin_s * 1000.0))
+        late = traces and traces[-1].late
+        sensor.set(value=tracer.late,
+                   status=Sensor.WARN if late else Sensor.NOMINAL)
+        sensor = self.do_sensor(
+            Corr2Sensor.integer, 'delay-trace.failed-loads',
+            'Delay models that did not load, per input.')
+        sensor.set(value=tracer.failed_loads,
+                   status=Sensor.WARN if tracer.failed_loads else Sensor.NOMINAL)
+
     def sensors_feng_streams(self):
         """
         F-engine stream sensors
@@ -795,7 +1002,8 @@ class Corr2SensorManager(SensorManager):
 
     def sensors_beng_weights(self):
         """
-
+        The beam weight sensors, from the weights read back after they
+        were written.
         :return:
         """
         streams = self.instrument.get_data_streams_by_type(
@@ -804,9 +1012,15 @@ class Corr2SensorManager(SensorManager):
             strmnm = stream.name
             sensor = self.do_sensor(
                 Corr2Sensor.string, '{strm}-weight'.format(strm=strmnm),
-                'The summing weights applied to the inputs of this beam.')
-            sensor.set_value(
-                str(self.instrument.bops.get_beam_weights(strmnm)))
+                'The summing weights applied to the inputs of this beam, '
+                'as read back from the hardware.')
+            # WARN if the hardware does not hold the requested weights
+            if self.instrument.bops.beam_weights_verified(strmnm):
+                status = Corr2Sensor.NOMINAL
+            else:
+                status = Corr2Sensor.WARN
+            sensor.set(value=str(self.instrument.bops.get_beam_weights(strmnm)),
+                       status=status)
 
     def sensors_beng_gains(self):
         """
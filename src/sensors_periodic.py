@@ -10,8 +10,10 @@ import sensors_periodic_fhost as sensors_fhost
 import sensors_periodic_xhost as sensors_xhost
 import sensors_periodic_bhost as sensors_bhost
 import sensor_scheduler
+from sensor_executor import LoopBlockMonitor
 
 host_offset_lookup = {}
+loop_block_monitor = None
 
 def setup_sensors(sensor_manager):
     """
@@ -29,10 +31,6 @@ def setup_sensors(sensor_manager):
         assert host.host not in host_offset_lookup
         host_offset_lookup[host.host] = 'fhost{:02}'.format(ctr)
 
-    sensor_poll_interval = sensor_manager.instrument.sensor_poll_interval;
-    sensor_scheduler.sensor_call_gap_time_s = sensor_poll_interval;
-    sensor_scheduler.logger = sensor_manager.logger;
-        
     # Set up a one-worker pool per host to serialise interactions with each host
     host_executors = {
         host.host: futures.ThreadPoolExecutor(max_workers=1)
@@ -51,8 +49,24 @@ def setup_sensors(sensor_manager):
                            'no further.')
     
     sensor_manager.sensors_clear()
+
+    # sensor_poll_interval is the minimum gap between hardware calls,
+    # so it sets the global I/O budget
+    instrument = sensor_manager.instrument
+    sensor_poll_interval = instrument.sensor_poll_interval
+    scheduler = sensor_scheduler.SensorScheduler(
+        ioloop=ioloop,
+        default_period_s=instrument.sensor_default_period,
+        max_calls_per_s=(1.0 / sensor_poll_interval
+                         if sensor_poll_interval > 0 else 0),
+        max_concurrent_per_host=1,
+        logger=sensor_manager.logger)
+    if sensor_manager.scheduler is not None:
+        sensor_manager.scheduler.stop()
+    sensor_manager.scheduler = scheduler
+
     args = [sensor_manager, general_executor,
-            host_executors, ioloop, host_offset_lookup]
+            host_executors, ioloop, host_offset_lookup, scheduler]
 
     # create 'static' sensors
     sensor = sensor_manager.do_sensor(
@@ -66,7 +80,122 @@ def setup_sensors(sensor_manager):
     sensors_fhost.setup_sensors_fengine(*args)
     sensors_xhost.setup_sensors_xengine(*args)
     sensors_bhost.setup_sensors_bengine(*args)
+    setup_sensor_loop_stats(sensor_manager, scheduler)
+    scheduler.start()
+
+    # optionally report how long the IOLoop is blocked for
+    if getattr(sensor_manager.instrument, 'sensor_loop_block_report', False):
+        setup_loop_block_monitor(sensor_manager, ioloop)
 
     all_hosts = sensor_manager.instrument.fhosts + sensor_manager.instrument.xhosts
 
+
+def _kind_sensor_name(kind):
+    """
+    _cb_feng_ct -> feng-ct
+    """
+    kind = kind.lstrip('_')
+    if kind.startswith('cb_'):
+        kind = kind[3:]
+    return kind.replace('_', '-')
+
+
+def _cb_sensor_loop_stats(kind_sensors, host_sensors, scheduler):
+    """
+    Publish the sensor callbacks' runtime statistics.
+    :param kind_sensors: per callback kind, a dict of stat -> sensor
+    :param host_sensors: per host, a dict of stat -> sensor
+    :param scheduler: the SensorScheduler running the callbacks
+    :return:
+    """
+    for group, sensors in [(scheduler.stats(group_by='kind'), kind_sensors),
+                           (scheduler.stats(group_by='host'), host_sensors)]:
+        for key, stats in group.items():
+            if key not in sensors:
+                continue
+            for stat, sensor in sensors[key].items():
+                value = stats[stat]
+                if stat == 'overruns':
+                    status = Corr2Sensor.WARN if value else Corr2Sensor.NOMINAL
+                    sensor.set(value=value, status=status)
+                elif stat.startswith('runtime'):
+                    sensor.set(value=value * 1000.0,
+                               status=Corr2Sensor.NOMINAL)
+                else:
+                    sensor.set(value=value, status=Corr2Sensor.NOMINAL)
+
+
+def setup_sensor_loop_stats(sensor_manager, scheduler):
+    """
+    Set up *.sensor-loop.* sensors with the runtime statistics of every
+    sensor callback kind and of every host, updated periodically.
+    :param sensor_manager: A SensorManager instance
+    :param scheduler: the SensorScheduler running the callbacks
+    :return:
+    """
+    def _make(prefix, stats):
+        sensors = {}
+        for stat, sensor_type, unit, descr in stats:
+            sensors[stat] = sensor_manager.do_sensor(
+                sensor_type, '{}.{}'.format(prefix, stat.replace('_', '-')),
+                descr, Corr2Sensor.UNKNOWN, unit, None)
+        return sensors
+
+    kind_stats = [
+        ('runtime_p50', Corr2Sensor.float, 'ms', 'Median callback runtime.'),
+        ('runtime_p95', Corr2Sensor.float, 'ms',
+         '95th percentile callback runtime.'),
+        ('runtime_max', Corr2Sensor.float, 'ms', 'Longest callback runtime.'),
+        ('overruns', Corr2Sensor.integer, '',
+         'Calls that took longer than their period.'),
+        ('target_period', Corr2Sensor.float, 's',
+         'Mean period the callbacks are scheduled at.'),
+        ('achieved_period', Corr2Sensor.float, 's',
+         'Mean period the callbacks actually ran at.'),
+    ]
+    host_stats = [
+        ('runtime_p95', Corr2Sensor.float, 'ms',
+         '95th percentile runtime of the callbacks for this host.'),
+        ('runtime_max', Corr2Sensor.float, 'ms',
+         'Longest runtime of the callbacks for this host.'),
+        ('overruns', Corr2Sensor.integer, '',
+         'Calls for this host that took longer than their period.'),
+    ]
+    kind_sensors = {}
+    host_sensors = {}
+    for task in scheduler.tasks:
+        if task.kind not in kind_sensors:
+            kind_sensors[task.kind] = _make('sensor-loop.{}'.format(
+                _kind_sensor_name(task.kind)), kind_stats)
+        if task.host is not None and task.host not in host_sensors:
+            host_sensors[task.host] = _make('{}.sensor-loop'.format(
+                host_offset_lookup[task.host]), host_stats)
+    period = getattr(sensor_manager.instrument, 'sensor_loop_stats_period',
+                     10.0)
+    sensor_task = sensor_scheduler.SensorTask(
+        '{0: <25}'.format('_cb_sensor_loop_stats'), period_s=period)
+    scheduler.add_task(sensor_task, _cb_sensor_loop_stats,
+                       kind_sensors, host_sensors, scheduler)
+
+
+def setup_loop_block_monitor(sensor_manager, ioloop):
+    """
+    Start measuring how long the IOLoop is blocked between ticks, and
+    report the worst case on a sensor.
+    :param sensor_manager: A SensorManager instance
+    :param ioloop: the IOLoop running the sensor callbacks
+    :return: the LoopBlockMonitor
+    """
+    global loop_block_monitor
+    if loop_block_monitor is not None:
+        loop_block_monitor.stop()
+    sensor = sensor_manager.do_sensor(
+        Corr2Sensor.float, 'sensor-loop.max-block-time',
+        'Longest time the sensor IOLoop was blocked over the last '
+        'reporting period.', Corr2Sensor.UNKNOWN, 'ms', None)
+    loop_block_monitor = LoopBlockMonitor(sensor=sensor,
+                                          logger=sensor_manager.logger)
+    loop_block_monitor.start(ioloop)
+    return loop_block_monitor
+
 # end
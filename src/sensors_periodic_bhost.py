@@ -108,7 +108,7 @@ def _cb_beng_pack(sensors, general_executor, sens_man, time):
 
 
 def setup_sensors_bengine(sens_man, general_executor, host_executors, ioloop,
-                          host_offset_dict):
+                          host_offset_dict, scheduler):
     """
     Set up the B-engine specific sensors.
     :param sens_man:
@@ -116,6 +116,7 @@ def setup_sensors_bengine(sens_man, general_executor, host_executors, ioloop,
     :param host_executors:
     :param ioloop:
     :param host_offset_dict:
+    :param scheduler: the SensorScheduler to run the callbacks on
     :return: none
     """
     #TODO: update the docstring once it's clearly understood what everything actually *does*.
@@ -3,88 +3,34 @@ import tornado.gen as gen
 import tornado
 import time
 
-from tornado.ioloop import IOLoop
-
 from casperfpga.transport_katcp import KatcpRequestError, KatcpRequestFail, \
     KatcpRequestInvalid
 from casperfpga.transport_skarab import \
     SkarabReorderError, SkarabReorderWarning
 
 import sensor_scheduler
+from sensor_executor import host_call, host_snapshot
 from sensors import Corr2Sensor, boolean_sensor_do
+from sensor_aggregate import ERROR_AND_WARN, ERROR_ONLY, ERROR_AS_WARN, \
+    WARN_ONLY
+from counter_engine import set_counter_sensors
 
 LOGGER = logging.getLogger(__name__)
 
 host_offset_lookup = {}
 
-@gen.coroutine
-def _cb_fhost_lru(sensor_manager, sensor, f_host,sensor_task):
-    """
-    Sensor call back function for F-engine LRU
-    :param sensor:
-    :return:
-    """
-    
-    functionStartTime = time.time();
-    ##print("1 on %s Started at %f" % (f_host.host ,functionStartTime))
-
-    try:
-        h = host_offset_lookup[f_host.host]
-        if sensor_manager.sensor_get(
-                "{}.network.device-status".format(h)).status() == Corr2Sensor.ERROR:
-            status = Corr2Sensor.ERROR
-        elif sensor_manager.sensor_get("{}.network-reorder.device-status".format(h)).status() == Corr2Sensor.ERROR:
-            status = Corr2Sensor.ERROR
-        elif sensor_manager.sensor_get("{}.cd.device-status".format(h)).status() == Corr2Sensor.ERROR:
-            status = Corr2Sensor.ERROR
-        elif sensor_manager.sensor_get("{}.ct.device-status".format(h)).status() == Corr2Sensor.ERROR:
-            status = Corr2Sensor.ERROR
-        elif sensor_manager.sensor_get("{}.sync.device-status".format(h)).status() == Corr2Sensor.ERROR:
-            status = Corr2Sensor.WARN
-        elif sensor_manager.sensor_get("{}.rx-timestamp".format(h)).status() == Corr2Sensor.ERROR:
-            status = Corr2Sensor.WARN
-        elif sensor_manager.sensor_get("{}.network.device-status".format(h)).status() == Corr2Sensor.ERROR:
-            status = Corr2Sensor.ERROR
-        elif sensor_manager.sensor_get("{}.network.device-status".format(h)).status() == Corr2Sensor.WARN:
-            status = Corr2Sensor.WARN
-        elif sensor_manager.sensor_get("{}.pfb.device-status".format(h)).status() == Corr2Sensor.WARN:
-            status = Corr2Sensor.WARN
-        elif sensor_manager.sensor_get("{}.quant.device-status".format(h)).status() == Corr2Sensor.WARN:
-            status = Corr2Sensor.WARN
-        elif sensor_manager.sensor_get("{}.cd.device-status".format(h)).status() == Corr2Sensor.WARN:
-            status = Corr2Sensor.WARN
-        elif sensor_manager.sensor_get("{}.dig.device-status".format(h)).status() == Corr2Sensor.WARN:
-            status = Corr2Sensor.WARN
-        else:
-            status = Corr2Sensor.NOMINAL
-
-        sens_val = 'fail'
-        if(status == Corr2Sensor.NOMINAL):
-            sens_val = 'ok'
-        elif(status == Corr2Sensor.WARN):
-            sens_val = 'degraded'
-
-        sensor.set(value=sens_val, status=status)
-    except Exception as e:
-        sensor_manager.logger.error(
-            'Error updating LRU sensor for {} - {}'.format(
-                f_host.host, e.message))
-        sensor.set(value="ok", status=Corr2Sensor.FAILURE)
-
-    
-    
-
-    functionRunTime = time.time() - functionStartTime;
-    nextCallTime = sensor_task.getNextSensorCallTime(current_function_runtime=functionRunTime);
-    #sensor_manager.logger.debug('Sensor {0: >20} ran on {1: >15} at {2:.4f}. Next Call:{3:.4f} Runtime: {4:.5f}.'.format('_cb_fhost_lru',f_host.host,time.time(),nextCallTime,functionRunTime))
-
-    IOLoop.current().call_at(
-        nextCallTime,
-        _cb_fhost_lru,
-        sensor_manager,
-        sensor,
-        f_host,sensor_task)
-
+# counters fed through the SensorManager's CounterEngine, and the status
+# to set when each one does or does not change
+NETWORK_COUNTERS = ['tx_over_err_cnt', 'rx_bad_pkt_cnt']
+NETWORK_COUNTER_RULES = {
+    'tx_over_err_cnt': ('changed', Corr2Sensor.ERROR),
+    'rx_bad_pkt_cnt': ('changed', Corr2Sensor.ERROR),
+}
+SPEAD_RX_COUNTERS = ['time_err_cnt', 'pkt_cnt']
+SPEAD_RX_COUNTER_RULES = {
+    'time_err_cnt': ('changed', Corr2Sensor.WARN),
+    'pkt_cnt': ('notchanged', Corr2Sensor.WARN),
+}
 
 @gen.coroutine
 def _cb_feng_rxtime(sensor_ok, sensors_value, sensor_manager,sensor_task):
@@ -95,12 +41,10 @@ def _cb_feng_rxtime(sensor_ok, sensors_value, sensor_manager,sensor_task):
     :return:
     """
 
-    functionStartTime = time.time();
-    ##print("2 on all Started at %f" % (functionStartTime))
-
     instrument = sensor_ok.manager.instrument
     try:
-        result, times = instrument.fops.get_rx_timestamps()
+        result, times = yield host_call(sensor_ok.executor,
+                                        instrument.fops.get_rx_timestamps)
         if result:
             sensor_ok.set(value=result, status=Corr2Sensor.NOMINAL)
         else:
@@ -122,13 +66,6 @@ def _cb_feng_rxtime(sensor_ok, sensors_value, sensor_manager,sensor_task):
         sensor_manager.logger.error('Error updating feng rxtime sensor '
                      '- {}.'.format(e.message))
     sensor_manager.logger.debug('_cb_feng_rxtime ran')
-    
-    functionRunTime = time.time() - functionStartTime;
-    ##print("2 on all Ended End Time %f, Run Time %f" % (time.time(), functionRunTime))
-    #print("%.4f %.4f %f %i %s" % (functionStartTime,sensor_task.last_runtime_utc,functionRunTime,sensor_task.flow_control_increments,'2'))
-
-    IOLoop.current().call_at(sensor_task.getNextSensorCallTime(current_function_runtime=functionRunTime), _cb_feng_rxtime,
-                                sensor_ok, sensors_value, sensor_manager,sensor_task)
 
 
 @gen.coroutine
@@ -143,14 +80,14 @@ def _cb_feng_delays(sensors, f_host, sensor_manager,sensor_task):
             sensor.set(status=Corr2Sensor.FAILURE,
                        value=Corr2Sensor.SENSOR_TYPES[Corr2Sensor.SENSOR_TYPE_LOOKUP[sensor.type]][1])
 
-    functionStartTime = time.time();
-    ##print("3 on %s Started at %f" % (f_host.host ,functionStartTime))
-
+    executor = sensors['device_status'].executor
     device_status = Corr2Sensor.NOMINAL
     device_status_value = 'ok'
     try:
-        cd0_cnt = f_host.registers.tl_cd0_status.read()['data']['load_count']
-        cd1_cnt = f_host.registers.tl_cd1_status.read()['data']['load_count']
+        snapshot = yield host_snapshot(sensor_manager, f_host, executor)
+        cd0_cnt = snapshot['tl_cd']['tl_cd0_load_count']
+        cd1_cnt = snapshot['tl_cd']['tl_cd1_load_count']
+        results = snapshot['cd']
         if cd0_cnt == sensors['delay0_updating'].tempstore:
             sensors['delay0_updating'].set(
                 value=False, status=Corr2Sensor.WARN)
@@ -166,7 +103,6 @@ def _cb_feng_delays(sensors, f_host, sensor_manager,sensor_task):
         sensors['delay0_updating'].tempstore = cd0_cnt
         sensors['delay1_updating'].tempstore = cd1_cnt
 
-        results = f_host.get_cd_status()
         sensors['current_cd0'].set(
             value=results['current_cd0'], status=Corr2Sensor.NOMINAL)
         sensors['current_cd1'].set(
@@ -186,7 +122,9 @@ def _cb_feng_delays(sensors, f_host, sensor_manager,sensor_task):
             device_status = Corr2Sensor.ERROR
             device_status_value = 'fail'
             f_host.logger.error("CD error: %s"%str(results))
-            f_host.logger.error("CD HMC status: %s"%str(f_host.hmcs.cd_hmc_hmc_delay_hmc.get_hmc_status()))
+            hmc_status = yield host_call(
+                executor, f_host.hmcs.cd_hmc_hmc_delay_hmc.get_hmc_status)
+            f_host.logger.error("CD HMC status: %s"%str(hmc_status))
 
         sensors['device_status'].set(value=device_status_value,
                                      status=device_status)
@@ -198,12 +136,6 @@ def _cb_feng_delays(sensors, f_host, sensor_manager,sensor_task):
         set_failure()
     sensor_manager.logger.debug('_sensor_feng_delays ran on {}'.format(f_host.host))
 
-    functionRunTime = time.time() - functionStartTime;
-    ##print("3 on %s Ended End Time %f, Run Time %f" % (f_host.host,time.time(), functionRunTime))
-    #print("%.4f %.4f %f %i %s %s" % (functionStartTime,sensor_task.last_runtime_utc,functionRunTime,sensor_task.flow_control_increments,f_host.host,'3'))
-
-    IOLoop.current().call_at(sensor_task.getNextSensorCallTime(current_function_runtime=functionRunTime), _cb_feng_delays, sensors, f_host, sensor_manager,sensor_task)
-
 
 @gen.coroutine
 def _cb_feng_ct(sensors, f_host, sensor_manager,sensor_task):
@@ -217,11 +149,10 @@ def _cb_feng_ct(sensors, f_host, sensor_manager,sensor_task):
             sensor.set(status=Corr2Sensor.FAILURE,
                        value=Corr2Sensor.SENSOR_TYPES[Corr2Sensor.SENSOR_TYPE_LOOKUP[sensor.type]][1])
 
-    functionStartTime = time.time();
-    ##print("4 on %s Started at %f" % (f_host.host ,functionStartTime))
-
+    executor = sensors['device_status'].executor
     try:
-        results = f_host.get_ct_status()
+        snapshot = yield host_snapshot(sensor_manager, f_host, executor)
+        results = snapshot['ct']
         common_errs = results['obuff_bank_err_cnt'] + results['rd_go_err_cnt'] + \
             results['sync_in_err_cnt'] + results['fifo_full_err_cnt']
         pol0_errs = results['bank_err_cnt_pol0'] + \
@@ -239,12 +170,16 @@ def _cb_feng_ct(sensors, f_host, sensor_manager,sensor_task):
             device_value = 'fail'
             device_status = Corr2Sensor.ERROR
             f_host.logger.error("CT pol0 error: %s"%str(results))
-            f_host.logger.error("CT HMC pol0 status: %s"%str(f_host.hmcs.hmc_ct_hmc.get_hmc_status()))
+            hmc_status = yield host_call(
+                executor, f_host.hmcs.hmc_ct_hmc.get_hmc_status)
+            f_host.logger.error("CT HMC pol0 status: %s"%str(hmc_status))
         if (sensors['pol1_err_cnt'].status() == Corr2Sensor.ERROR):
             device_value = 'fail'
             device_status = Corr2Sensor.ERROR
             f_host.logger.error("CT pol1 error: %s"%str(results))
-            f_host.logger.error("CT HMC pol1 status: %s"%str(f_host.hmcs.hmc_ct_hmc.get_hmc_status()))
+            hmc_status = yield host_call(
+                executor, f_host.hmcs.hmc_ct_hmc.get_hmc_status)
+            f_host.logger.error("CT HMC pol1 status: %s"%str(hmc_status))
         #if(device_status == Corr2Sensor.WARN):
         #    device_value = 'degraded'
         sensors['device_status'].set(value=device_value, status=device_status)
@@ -254,11 +189,6 @@ def _cb_feng_ct(sensors, f_host, sensor_manager,sensor_task):
                 f_host.host, e.message))
     sensor_manager.logger.debug('_cb_feng_ct ran on {}'.format(f_host.host))
 
-    functionRunTime = time.time() - functionStartTime;
-    #print("%.4f %.4f %f %i %s %s" % (functionStartTime,sensor_task.last_runtime_utc,functionRunTime,sensor_task.flow_control_increments,f_host.host,'4'))
-    IOLoop.current().call_at(sensor_task.getNextSensorCallTime(current_function_runtime=functionRunTime), _cb_feng_ct, sensors, f_host, sensor_manager,sensor_task)
-    ##print("4 on %s Ended End Time %f, Run Time %f" % (f_host.host,time.time(), functionRunTime))
-
 
 @gen.coroutine
 def _cb_feng_pack(sensors, f_host, sensor_manager,sensor_task):
@@ -268,11 +198,10 @@ def _cb_feng_pack(sensors, f_host, sensor_manager,sensor_task):
     :return:
     """
 
-    functionStartTime = time.time();
-    ##print("5 on %s Started at %f" % (f_host.host ,functionStartTime))
-
     try:
-        results = f_host.get_pack_status()
+        snapshot = yield host_snapshot(sensor_manager, f_host,
+                                       sensors['device_status'].executor)
+        results = snapshot['pack']
         sensors['err_cnt'].set(
             value=results['dvblock_err_cnt'],
             errif='changed')
@@ -291,11 +220,6 @@ def _cb_feng_pack(sensors, f_host, sensor_manager,sensor_task):
         sensors['err_cnt'].set(value=-1, status=Corr2Sensor.FAILURE)
     sensor_manager.logger.debug('_cb_feng_pack ran on {}'.format(f_host.host))
 
-    functionRunTime = time.time() - functionStartTime;
-    ##print("5 on %s Ended End Time %f, Run Time %f" % (f_host.host,time.time(), functionRunTime))
-    #print("%.4f %.4f %f %i %s %s" % (functionStartTime,sensor_task.last_runtime_utc,functionRunTime,sensor_task.flow_control_increments,f_host.host,'5'))
-
-    IOLoop.current().call_at(sensor_task.getNextSensorCallTime(current_function_runtime=functionRunTime), _cb_feng_pack, sensors, f_host, sensor_manager,sensor_task)
 
 @gen.coroutine
 def _cb_feng_adcs(sensors, f_host, sensor_manager,sensor_task):
@@ -309,11 +233,10 @@ def _cb_feng_adcs(sensors, f_host, sensor_manager,sensor_task):
             sensor.set(status=Corr2Sensor.FAILURE,
                        value=Corr2Sensor.SENSOR_TYPES[Corr2Sensor.SENSOR_TYPE_LOOKUP[sensor.type]][1])
 
-    functionStartTime = time.time();
-    ##print("6 on %s Started at %f" % (f_host.host ,functionStartTime))
-
     try:
-        results = f_host.get_adc_status()
+        snapshot = yield host_snapshot(sensor_manager, f_host,
+                                       sensors['device_status'].executor)
+        results = snapshot['adc']
         device_status = Corr2Sensor.NOMINAL
 
         for key in ['p0_min', 'p1_min']:
@@ -361,11 +284,6 @@ def _cb_feng_adcs(sensors, f_host, sensor_manager,sensor_task):
 
     sensor_manager.logger.debug('_sensor_feng_adc ran on {}'.format(f_host.host))
 
-    functionRunTime = time.time() - functionStartTime;
-    ##print("6 on %s Ended End Time %f, Run Time %f" % (f_host.host,time.time(), functionRunTime))
-    #print("%.4f %.4f %f %i %s %s" % (functionStartTime,sensor_task.last_runtime_utc,functionRunTime,sensor_task.flow_control_increments,f_host.host,'6'))
-
-    IOLoop.current().call_at(sensor_task.getNextSensorCallTime(current_function_runtime=functionRunTime), _cb_feng_adcs, sensors, f_host, sensor_manager,sensor_task)
 
 @gen.coroutine
 def _cb_feng_pfbs(sensors, f_host, min_pfb_pwr, sensor_manager, sensor_task):
@@ -379,11 +297,10 @@ def _cb_feng_pfbs(sensors, f_host, min_pfb_pwr, sensor_manager, sensor_task):
             sensor.set(status=Corr2Sensor.FAILURE,
                        value=Corr2Sensor.SENSOR_TYPES[Corr2Sensor.SENSOR_TYPE_LOOKUP[sensor.type]][1])
 
-    functionStartTime = time.time();
-    ##print("7 on %s Started at %f" % (f_host.host ,functionStartTime))
-
     try:
-        results = f_host.get_pfb_status()
+        snapshot = yield host_snapshot(sensor_manager, f_host,
+                                       sensors['device_status'].executor)
+        results = snapshot['pfb']
         device_status = Corr2Sensor.NOMINAL
         for key in ['pol0_or_err_cnt', 'pol1_or_err_cnt']:
             sensor = sensors[key]
@@ -415,11 +332,6 @@ def _cb_feng_pfbs(sensors, f_host, min_pfb_pwr, sensor_manager, sensor_task):
         set_failure()
     sensor_manager.logger.debug('_sensor_feng_pfbs ran on {}'.format(f_host.host))
 
-    functionRunTime = time.time() - functionStartTime;
-    ##print("7 on %s Ended End Time %f, Run Time %f" % (f_host.host,time.time(), functionRunTime))
-    #print("%.4f %.4f %f %i %s %s" % (functionStartTime,sensor_task.last_runtime_utc,functionRunTime,sensor_task.flow_control_increments,f_host.host,'7'))
-    IOLoop.current().call_at(sensor_task.getNextSensorCallTime(current_function_runtime=functionRunTime), _cb_feng_pfbs, sensors, f_host, min_pfb_pwr, sensor_manager,sensor_task)
-
 
 @gen.coroutine
 def _cb_feng_quant(sensors, f_host, sensor_manager,sensor_task):
@@ -433,11 +345,10 @@ def _cb_feng_quant(sensors, f_host, sensor_manager,sensor_task):
             sensor.set(status=Corr2Sensor.FAILURE,
                        value=Corr2Sensor.SENSOR_TYPES[Corr2Sensor.SENSOR_TYPE_LOOKUP[sensor.type]][1])
 
-    functionStartTime = time.time();
-    ##print("8 on %s Started at %f" % (f_host.host ,functionStartTime))
-
     try:
-        results = f_host.get_quant_status()
+        snapshot = yield host_snapshot(sensor_manager, f_host,
+                                       sensors['device_status'].executor)
+        results = snapshot['quant']
         device_status = Corr2Sensor.NOMINAL
 
         for key in ['p0_quant_out_dBFS','p1_quant_out_dBFS']:
@@ -464,10 +375,6 @@ def _cb_feng_quant(sensors, f_host, sensor_manager,sensor_task):
         set_failure()
     sensor_manager.logger.debug('_sensor_feng_quant ran on {}'.format(f_host.host))
 
-    functionRunTime = time.time() - functionStartTime;
-    ##print("8 on %s Ended End Time %f, Run Time %f" % (f_host.host,time.time(), functionRunTime))
-    #print("%.4f %.4f %f %i %s %s" % (functionStartTime,sensor_task.last_runtime_utc,functionRunTime,sensor_task.flow_control_increments,f_host.host,'8'))
-    IOLoop.current().call_at(sensor_task.getNextSensorCallTime(current_function_runtime=functionRunTime), _cb_feng_quant, sensors, f_host, sensor_manager,sensor_task)
 
 @gen.coroutine
 def _cb_fhost_check_network(sensors, f_host, sensor_manager,sensor_task):
@@ -477,8 +384,6 @@ def _cb_fhost_check_network(sensors, f_host, sensor_manager,sensor_task):
     :return:
     """
     # GBE CORE
-    functionStartTime = time.time();
-    ##print("9 on %s Started at %f" % (f_host.host ,functionStartTime))
 
     device_status = Corr2Sensor.NOMINAL
 
@@ -487,12 +392,23 @@ def _cb_fhost_check_network(sensors, f_host, sensor_manager,sensor_task):
             sensor.set(status=Corr2Sensor.FAILURE,
                        value=Corr2Sensor.SENSOR_TYPES[Corr2Sensor.SENSOR_TYPE_LOOKUP[sensor.type]][1])
             # heck dictionary
-    try:
+
+    def read_hw():
         result = f_host.gbes.gbe0.get_hw_gbe_stats()
         tx_enabled = f_host.registers.control.read()['data']['gbe_txen']
+        return result, tx_enabled, time.time()
+
+    try:
+        result, tx_enabled, read_time = yield host_call(
+            sensors['device_status'].executor, read_hw)
         sensors['tx_enabled'].set(errif='False', value=tx_enabled)
-        sensors['tx_err_cnt'].set(errif='changed', value=result['tx_over_err_cnt'])
-        sensors['rx_err_cnt'].set(errif='changed', value=result['rx_bad_pkt_cnt'])
+        counters = sensor_manager.counters.group(
+            (f_host.host, 'network'), NETWORK_COUNTERS,
+            rules=NETWORK_COUNTER_RULES)
+        values, _, _, statuses = counters.update(result,
+                                                 timestamp=read_time)
+        set_counter_sensors([sensors['tx_err_cnt'], sensors['rx_err_cnt']],
+                            counters, values, statuses)
         sensors['tx_pps'].set(
             status=Corr2Sensor.NOMINAL,
             value=result['tx_pps'])
@@ -541,15 +457,6 @@ def _cb_fhost_check_network(sensors, f_host, sensor_manager,sensor_task):
         set_failure()
     sensor_manager.logger.debug('_sensor_fhost_check_network ran on {}'.format(f_host.host))
 
-    functionRunTime = time.time() - functionStartTime;
-    ##print("9 on %s Ended End Time %f, Run Time %f" % (f_host.host,time.time(), functionRunTime))
-    #print("%.4f %.4f %f %i %s %s" % (functionStartTime,sensor_task.last_runtime_utc,functionRunTime,sensor_task.flow_control_increments,f_host.host,'9'))
-
-    IOLoop.current().call_at(
-        sensor_task.getNextSensorCallTime(current_function_runtime=functionRunTime),
-        _cb_fhost_check_network,
-        sensors,
-        f_host, sensor_manager,sensor_task)
 
 @gen.coroutine
 def _cb_feng_sync(sensors, f_host, sensor_manager,sensor_task):
@@ -563,11 +470,10 @@ def _cb_feng_sync(sensors, f_host, sensor_manager,sensor_task):
             sensor.set(status=Corr2Sensor.FAILURE,
                        value=Corr2Sensor.SENSOR_TYPES[Corr2Sensor.SENSOR_TYPE_LOOKUP[sensor.type]][1])
 
-    functionStartTime = time.time();
-    ##print("10 on %s Started at %f" % (f_host.host ,functionStartTime))
-
     try:
-        results = f_host.get_sync_status()
+        snapshot = yield host_snapshot(sensor_manager, f_host,
+                                       sensors['device_status'].executor)
+        results = snapshot['sync']
         sensors['resync_cnt'].set(value=results['sync80_cnt'],errif='changed')
         if ((results['synced']) and not (results['board_in_fault']) and (sensors['resync_cnt'].status() == Corr2Sensor.NOMINAL)):
             sensors['device_status'].set(value='ok',status=Corr2Sensor.NOMINAL)
@@ -584,11 +490,6 @@ def _cb_feng_sync(sensors, f_host, sensor_manager,sensor_task):
         '_sensor_feng_sync ran on {}'.format(
             f_host.host))
 
-    functionRunTime = time.time() - functionStartTime;
-    ##print("10 on %s Ended End Time %f, Run Time %f" % (f_host.host,time.time(), functionRunTime))
-    #print("%.4f %.4f %f %i %s %s" % (functionStartTime,sensor_task.last_runtime_utc,functionRunTime,sensor_task.flow_control_increments,f_host.host,'10'))
-
-    IOLoop.current().call_at(sensor_task.getNextSensorCallTime(current_function_runtime=functionRunTime), _cb_feng_sync, sensors, f_host, sensor_manager,sensor_task)
 
 @gen.coroutine
 def _cb_feng_rx_spead(sensors, f_host, sensor_manager,sensor_task):
@@ -602,14 +503,18 @@ def _cb_feng_rx_spead(sensors, f_host, sensor_manager,sensor_task):
             sensor.set(status=Corr2Sensor.FAILURE,
                        value=Corr2Sensor.SENSOR_TYPES[Corr2Sensor.SENSOR_TYPE_LOOKUP[sensor.type]][1])
 
-
-    functionStartTime = time.time();
-    ##print("11 on %s Started at %f" % (f_host.host ,functionStartTime))
     # SPEAD RX
     try:
-        results = f_host.get_unpack_status()
-        sensors['err_cnt'].set(value=results['time_err_cnt'],warnif='changed')
-        sensors['cnt'].set(value=results['pkt_cnt'], warnif='notchanged')
+        snapshot = yield host_snapshot(sensor_manager, f_host,
+                                       sensors['device_status'].executor)
+        results = snapshot['unpack']
+        counters = sensor_manager.counters.group(
+            (f_host.host, 'spead-rx'), SPEAD_RX_COUNTERS,
+            rules=SPEAD_RX_COUNTER_RULES)
+        values, _, _, statuses = counters.update(
+            results, timestamp=snapshot.timestamp)
+        set_counter_sensors([sensors['err_cnt'], sensors['cnt']],
+                            counters, values, statuses)
 
         if sensors['err_cnt'].status() == Corr2Sensor.ERROR:
             sensors['device_status'].set(value='fail', status=Corr2Sensor.ERROR)
@@ -631,12 +536,6 @@ def _cb_feng_rx_spead(sensors, f_host, sensor_manager,sensor_task):
         '_sensor_feng_rx_spead ran on {}'.format(
             f_host.host))
 
-    functionRunTime = time.time() - functionStartTime;
-    ##print("11 on %s Ended End Time %f, Run Time %f" % (f_host.host,time.time(), functionRunTime))
-    #print("%.4f %.4f %f %i %s %s" % (functionStartTime,sensor_task.last_runtime_utc,functionRunTime,sensor_task.flow_control_increments,f_host.host,'11'))
-
-    IOLoop.current().call_at(sensor_task.getNextSensorCallTime(current_function_runtime=functionRunTime), _cb_feng_rx_spead, sensors, f_host, sensor_manager,sensor_task)
-
 
 @gen.coroutine
 def _cb_feng_rx_reorder(sensors, f_host, sensor_manager,sensor_task):
@@ -650,11 +549,10 @@ def _cb_feng_rx_reorder(sensors, f_host, sensor_manager,sensor_task):
             sensor.set(status=Corr2Sensor.FAILURE,
                        value=Corr2Sensor.SENSOR_TYPES[Corr2Sensor.SENSOR_TYPE_LOOKUP[sensor.type]][1])
 
-    functionStartTime = time.time();
-    ##print("12 on %s Started at %f" % (f_host.host ,functionStartTime))
-
     try:
-        results = f_host.get_rx_reorder_status()
+        snapshot = yield host_snapshot(sensor_manager, f_host,
+                                       sensors['device_status'].executor)
+        results = snapshot['rx_reorder']
         device_status = True
         err_cnt = results['timestep_err_cnt'] + results['receive_err_cnt'] + \
                     results['relock_err_cnt'] + results['overflow_err_cnt']
@@ -670,15 +568,10 @@ def _cb_feng_rx_reorder(sensors, f_host, sensor_manager,sensor_task):
         set_failure()
 
     sensor_manager.logger.debug('_sensor_feng_rx_reorder ran on {}'.format(f_host.host))
-    functionRunTime = time.time() - functionStartTime;
-    ##print("12 on %s Ended End Time %f, Run Time %f" % (f_host.host,time.time(), functionRunTime))
-    #print("%.4f %.4f %f %i %s %s" % (functionStartTime,sensor_task.last_runtime_utc,functionRunTime,sensor_task.flow_control_increments,f_host.host,'12'))
-
-    IOLoop.current().call_at(sensor_task.getNextSensorCallTime(current_function_runtime=functionRunTime), _cb_feng_rx_reorder, sensors, f_host, sensor_manager,sensor_task)
 
 
 def setup_sensors_fengine(sens_man, general_executor, host_executors, ioloop,
-                          host_offset_dict):
+                          host_offset_dict, scheduler):
     """
     Set up the F-engine specific sensors.
     :param sens_man:
@@ -686,6 +579,7 @@ def setup_sensors_fengine(sens_man, general_executor, host_executors, ioloop,
     :param host_executors:
     :param ioloop:
     :param host_offset_dict:
+    :param scheduler: the SensorScheduler to run the callbacks on
     :return:
     """
     global host_offset_lookup
@@ -698,7 +592,7 @@ def setup_sensors_fengine(sens_man, general_executor, host_executors, ioloop,
         'Are the times received by F-engines in the system ok?',
         executor=general_executor)
     sensors_value = {}
-    
+
     for _f in sens_man.instrument.fhosts:
         fhost = host_offset_lookup[_f.host]
         sensor = sens_man.do_sensor(
@@ -711,7 +605,7 @@ def setup_sensors_fengine(sens_man, general_executor, host_executors, ioloop,
             'the digitisers' % _f.host)
         sensors_value[_f.host] = (sensor, sensor_u)
     sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_feng_rxtime','all boards'))
-    ioloop.add_callback(_cb_feng_rxtime, sensor_ok, sensors_value, sens_man,sensor_task)
+    scheduler.add_task(sensor_task, _cb_feng_rxtime, sensor_ok, sensors_value, sens_man,sensor_task)
     import numpy
     min_pfb_pwr = -20*numpy.log10(2**(sens_man.instrument.fops.pfb_bits-4-1))
     # F-engine host sensors
@@ -745,8 +639,8 @@ def setup_sensors_fengine(sens_man, general_executor, host_executors, ioloop,
                 Corr2Sensor.integer, '{}.network.rx-err-cnt'.format(fhost),
                 'RX network error count (bad packets received)', executor=executor),
         }
-        sensor_task = sensor_scheduler.SensorTask('_cb_fhost_check_network on '+_f.host)
-        ioloop.add_callback(_cb_fhost_check_network, network_sensors, _f, sens_man,sensor_task)
+        sensor_task = sensor_scheduler.SensorTask('_cb_fhost_check_network on '+_f.host, host=_f.host)
+        scheduler.add_task(sensor_task, _cb_fhost_check_network, network_sensors, _f, sens_man,sensor_task)
 
         # SPEAD counters
         spead_rx_sensors = {
@@ -763,9 +657,8 @@ def setup_sensors_fengine(sens_man, general_executor, host_executors, ioloop,
                 'F-engine RX SPEAD error counter.',
                 executor=executor),
         }
-        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_feng_rx_spead',_f.host))
-        ioloop.add_callback(_cb_feng_rx_spead, spead_rx_sensors, _f, sens_man,sensor_task)
-
+        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_feng_rx_spead',_f.host), host=_f.host)
+        scheduler.add_task(sensor_task, _cb_feng_rx_spead, spead_rx_sensors, _f, sens_man,sensor_task)
 
         # Rx reorder counters
         rx_reorder_sensors = {
@@ -778,9 +671,8 @@ def setup_sensors_fengine(sens_man, general_executor, host_executors, ioloop,
                 'Error counter from reordering digitiser data stream packets.',
                 executor=executor)
         }
-        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_feng_rx_reorder',_f.host))
-        ioloop.add_callback(_cb_feng_rx_reorder, rx_reorder_sensors, _f, sens_man,sensor_task)
-
+        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_feng_rx_reorder',_f.host), host=_f.host)
+        scheduler.add_task(sensor_task, _cb_feng_rx_reorder, rx_reorder_sensors, _f, sens_man,sensor_task)
 
         # CD functionality
         cd_sensors = {
@@ -810,9 +702,8 @@ def setup_sensors_fengine(sens_man, general_executor, host_executors, ioloop,
         }
         cd_sensors['delay0_updating'].tempstore = 0
         cd_sensors['delay1_updating'].tempstore = 0
-        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_feng_delay',_f.host),minimum_time_between_calls_s=6)
-        ioloop.add_callback(_cb_feng_delays, cd_sensors, _f, sens_man,sensor_task)
-
+        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_feng_delay',_f.host),minimum_time_between_calls_s=6, host=_f.host)
+        scheduler.add_task(sensor_task, _cb_feng_delays, cd_sensors, _f, sens_man,sensor_task)
 
         # DIG ADC counters
         adc_sensors = {
@@ -844,9 +735,8 @@ def setup_sensors_fengine(sens_man, general_executor, host_executors, ioloop,
                 Corr2Sensor.integer, '{}.dig.pol1-dig-clip-cnt'.format(fhost),
                 'F-engine DIG reported overrange counter.', executor=executor),
         }
-        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_feng_adcs',_f.host))
-        ioloop.add_callback(_cb_feng_adcs, adc_sensors, _f, sens_man,sensor_task)
-
+        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_feng_adcs',_f.host), host=_f.host)
+        scheduler.add_task(sensor_task, _cb_feng_adcs, adc_sensors, _f, sens_man,sensor_task)
 
         # PFB counters
         pfb_sensors = {
@@ -869,9 +759,8 @@ def setup_sensors_fengine(sens_man, general_executor, host_executors, ioloop,
             #    Corr2Sensor.integer, '{}.pfb.sync-cnt'.format(fhost),
             #    'F-engine PFB resync counter', executor=executor),
         }
-        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_feng_pfbs',_f.host))
-        ioloop.add_callback(_cb_feng_pfbs, pfb_sensors, _f, min_pfb_pwr, sens_man,sensor_task)
-
+        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_feng_pfbs',_f.host), host=_f.host)
+        scheduler.add_task(sensor_task, _cb_feng_pfbs, pfb_sensors, _f, min_pfb_pwr, sens_man,sensor_task)
 
         # CT functionality
         ct_sensors = {
@@ -885,9 +774,8 @@ def setup_sensors_fengine(sens_man, general_executor, host_executors, ioloop,
                 Corr2Sensor.integer, '{}.ct.err-cnt1'.format(fhost),
                 'F-engine corner-turner error counter, pol1', executor=executor),
         }
-        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_feng_ct',_f.host))
-        ioloop.add_callback(_cb_feng_ct, ct_sensors, _f, sens_man,sensor_task)
-
+        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_feng_ct',_f.host), host=_f.host)
+        scheduler.add_task(sensor_task, _cb_feng_ct, ct_sensors, _f, sens_man,sensor_task)
 
         # Pack block
         pack_sensors = {
@@ -898,11 +786,9 @@ def setup_sensors_fengine(sens_man, general_executor, host_executors, ioloop,
                 Corr2Sensor.integer, '{}.spead-tx.err-cnt'.format(fhost),
                 'F-engine pack (TX) error count', executor=executor)
         }
-        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_feng_pack',_f.host))
-        ioloop.add_callback(_cb_feng_pack, pack_sensors, _f, sens_man,sensor_task)
-
+        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_feng_pack',_f.host), host=_f.host)
+        scheduler.add_task(sensor_task, _cb_feng_pack, pack_sensors, _f, sens_man,sensor_task)
 
-        
         #EQ quant/gain level sensors
         quant_sensors = {
             'device_status': sens_man.do_sensor(
@@ -915,10 +801,8 @@ def setup_sensors_fengine(sens_man, general_executor, host_executors, ioloop,
                 Corr2Sensor.float, '{}.quant.pol1-quant-out-rms-pwr-dbfs'.format(fhost),
                 'F-engine Quantiser output RMS power in dBFS, pol1.', executor=executor),
         }
-        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_feng_quant on',_f.host))
-        ioloop.add_callback(_cb_feng_quant, quant_sensors, _f, sens_man,sensor_task)
-
-
+        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_feng_quant on',_f.host), host=_f.host)
+        scheduler.add_task(sensor_task, _cb_feng_quant, quant_sensors, _f, sens_man,sensor_task)
 
         #Sync status
         sync_sensors = {
@@ -929,19 +813,23 @@ def setup_sensors_fengine(sens_man, general_executor, host_executors, ioloop,
                 Corr2Sensor.integer, '{}.sync.resync-cnt'.format(fhost),
                 'Count of F-engine sync losses (or attempts to resynchronise).', executor=executor),
         }
-        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_feng_sync',_f.host))
-        ioloop.add_callback(_cb_feng_sync, sync_sensors, _f, sens_man,sensor_task)
-
-
+        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_feng_sync',_f.host), host=_f.host)
+        scheduler.add_task(sensor_task, _cb_feng_sync, sync_sensors, _f, sens_man,sensor_task)
 
         # Overall LRU ok
         lru_sensor = sens_man.do_sensor(
             Corr2Sensor.device_status, '{}.device-status'.format(fhost),
             'F-engine %s LRU ok' % _f.host, executor=executor)
-        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_fhost_lru',_f.host))
-        ioloop.add_callback(_cb_fhost_lru, sens_man, lru_sensor, _f,sensor_task)
-
-
-        
+        sens_man.aggregator.add(lru_sensor, [
+            ('{}.network.device-status'.format(fhost), ERROR_AND_WARN),
+            ('{}.network-reorder.device-status'.format(fhost), ERROR_ONLY),
+            ('{}.cd.device-status'.format(fhost), ERROR_AND_WARN),
+            ('{}.ct.device-status'.format(fhost), ERROR_ONLY),
+            ('{}.sync.device-status'.format(fhost), ERROR_AS_WARN),
+            ('{}.rx-timestamp'.format(fhost), ERROR_AS_WARN),
+            ('{}.pfb.device-status'.format(fhost), WARN_ONLY),
+            ('{}.quant.device-status'.format(fhost), WARN_ONLY),
+            ('{}.dig.device-status'.format(fhost), WARN_ONLY),
+        ])
 
 # end
@@ -5,103 +5,29 @@ import tornado
 
 from IPython.core.debugger import Pdb
 
-from tornado.ioloop import IOLoop
-
 from casperfpga.transport_katcp import KatcpRequestError, KatcpRequestFail, \
     KatcpRequestInvalid
 
 import sensor_scheduler
+from sensor_executor import host_call, host_snapshot
 from sensors import Corr2Sensor, boolean_sensor_do
+from sensor_aggregate import ERROR_AND_WARN
+from counter_engine import set_counter_sensors
 
 host_offset_lookup = {}
 
-@gen.coroutine
-def _cb_xhost_lru(sensor_manager, sensor, sensors, x_host,sensor_task):
-    """
-    Sensor call back function for x-engine LRU
-    :param sensor:
-    :return:
-    """
-   
-    functionStartTime = time.time();
-    #print("13 on %s Started at %f" % (x_host.host ,functionStartTime))
-
-    try:
-        h = host_offset_lookup[x_host.host]
-        # Pdb().set_trace()
-        status = Corr2Sensor.NOMINAL
-        for xctr in range(x_host.x_per_fpga):
-            pref = '{xhost}.xeng{xctr}'.format(xhost=h, xctr=xctr)
-            eng_status = Corr2Sensor.NOMINAL
-            if sensor_manager.sensor_get("{}.vacc.device-status".format(pref)).status() == Corr2Sensor.ERROR:
-                status = Corr2Sensor.ERROR
-                eng_status = Corr2Sensor.ERROR
-            elif sensor_manager.sensor_get("{}.bram-reorder.device-status".format(pref)).status() == Corr2Sensor.ERROR:
-                status = Corr2Sensor.ERROR
-                eng_status = Corr2Sensor.ERROR
-            elif sensor_manager.sensor_get("{}.spead-tx.device-status".format(pref)).status() == Corr2Sensor.ERROR:
-                status = Corr2Sensor.ERROR
-                eng_status = Corr2Sensor.ERROR
-            if sensor_manager.sensor_get("{}.vacc.device-status".format(pref)).status() == Corr2Sensor.WARN:
-                status = Corr2Sensor.WARN
-                eng_status = Corr2Sensor.WARN
-            elif sensor_manager.sensor_get("{}.bram-reorder.device-status".format(pref)).status() == Corr2Sensor.WARN:
-                status = Corr2Sensor.WARN
-                eng_status = Corr2Sensor.WARN
-            elif sensor_manager.sensor_get("{}.spead-tx.device-status".format(pref)).status() == Corr2Sensor.WARN:
-                status = Corr2Sensor.WARN
-                eng_status = Corr2Sensor.WARN
-
-            eng_sens_val = 'fail'
-            if(eng_status == Corr2Sensor.NOMINAL):
-                eng_sens_val = 'ok'
-            elif(eng_status == Corr2Sensor.WARN):
-                eng_sens_val = 'degraded'
-
-            sensors[xctr].set(value=eng_sens_val, status=eng_status)
-
-        if status != Corr2Sensor.ERROR:
-            if sensor_manager.sensor_get("{}.network.device-status".format(h)).status() == Corr2Sensor.ERROR:
-                status = Corr2Sensor.ERROR
-            elif sensor_manager.sensor_get("{}.network-reorder.device-status".format(h)).status() == Corr2Sensor.ERROR:
-                status = Corr2Sensor.ERROR
-            elif sensor_manager.sensor_get("{}.spead-rx.device-status".format(h)).status() == Corr2Sensor.ERROR:
-                status = Corr2Sensor.ERROR
-            elif sensor_manager.sensor_get("{}.network.device-status".format(h)).status() == Corr2Sensor.WARN:
-                status = Corr2Sensor.WARN
-            elif sensor_manager.sensor_get("{}.network-reorder.device-status".format(h)).status() == Corr2Sensor.WARN:
-                status = Corr2Sensor.WARN
-            elif sensor_manager.sensor_get("{}.spead-rx.device-status".format(h)).status() == Corr2Sensor.WARN:
-                status = Corr2Sensor.WARN
-
-        sens_val = 'fail'
-        if(status == Corr2Sensor.NOMINAL):
-            sens_val = 'ok'
-        elif(status == Corr2Sensor.WARN):
-            sens_val = 'degraded'
-
-        sensor.set(value=sens_val, status=status)
-
-    except Exception as e:
-        sensor_manager.logger.error(
-            'Error updating LRU sensor for {} - {}'.format(
-                x_host.host, e.message))
-        for xctr in range(x_host.x_per_fpga):
-            sensors[xctr].set(value='fail', status=Corr2Sensor.FAILURE)
-        sensor.set(value='fail', status=Corr2Sensor.FAILURE)
-
-    sensor_manager.logger.debug('_cb_xhost_lru ran')
-
-    functionRunTime = time.time() - functionStartTime;
-    #print("13 on %s Ended End Time %f, Run Time %f" % (x_host.host,time.time(), functionRunTime))
-    #print("%.4f %.4f %f %i %s %s" % (functionStartTime,sensor_task.last_runtime_utc,functionRunTime,sensor_task.flow_control_increments,x_host.host,'13'))
-    IOLoop.current().call_at(
-        sensor_task.getNextSensorCallTime(current_function_runtime=functionRunTime),
-        _cb_xhost_lru,
-        sensor_manager,
-        sensor, sensors,
-        x_host,sensor_task)
-
+# counters fed through the SensorManager's CounterEngine, and the status
+# to set when each one does or does not change
+NETWORK_COUNTERS = ['tx_over_err_cnt', 'rx_bad_pkt_cnt']
+NETWORK_COUNTER_RULES = {
+    'tx_over_err_cnt': ('changed', Corr2Sensor.ERROR),
+    'rx_bad_pkt_cnt': ('changed', Corr2Sensor.ERROR),
+}
+SPEAD_RX_COUNTERS = ['time_err_cnt', 'valid_pkt_cnt']
+SPEAD_RX_COUNTER_RULES = {
+    'time_err_cnt': ('changed', Corr2Sensor.ERROR),
+    'valid_pkt_cnt': ('notchanged', Corr2Sensor.WARN),
+}
 
 @gen.coroutine
 def _cb_xeng_network(sensors, x_host, sensor_manager,sensor_task):
@@ -110,15 +36,20 @@ def _cb_xeng_network(sensors, x_host, sensor_manager,sensor_task):
             sensor.set(status=Corr2Sensor.FAILURE,
                        value=Corr2Sensor.SENSOR_TYPES[Corr2Sensor.SENSOR_TYPE_LOOKUP[sensor.type]][1])
 
-    functionStartTime = time.time();
-
-    #print("14 on %s Started at %f" % (x_host.host ,functionStartTime))
+    def read_hw():
+        return x_host.gbes.gbe0.get_hw_gbe_stats(), time.time()
 
     device_status = Corr2Sensor.NOMINAL
     try:
-        result = x_host.gbes.gbe0.get_hw_gbe_stats()
-        sensors['tx_err_cnt'].set(errif='changed', value=result['tx_over_err_cnt'])
-        sensors['rx_err_cnt'].set(errif='changed', value=result['rx_bad_pkt_cnt'])
+        result, read_time = yield host_call(sensors['device_status'].executor,
+                                            read_hw)
+        counters = sensor_manager.counters.group(
+            (x_host.host, 'network'), NETWORK_COUNTERS,
+            rules=NETWORK_COUNTER_RULES)
+        values, _, _, statuses = counters.update(result,
+                                                 timestamp=read_time)
+        set_counter_sensors([sensors['tx_err_cnt'], sensors['rx_err_cnt']],
+                            counters, values, statuses)
         sensors['tx_pps'].set(
             status=Corr2Sensor.NOMINAL,
             value=result['tx_pps'])
@@ -168,11 +99,6 @@ def _cb_xeng_network(sensors, x_host, sensor_manager,sensor_task):
 
     sensor_manager.logger.debug('_cb_xeng_network ran')
 
-    functionRunTime = time.time() - functionStartTime;
-    #print("14 on %s Ended End Time %f, Run Time %f" % (x_host.host,time.time(), functionRunTime))
-    #print("%.4f %.4f %f %i %s %s" % (functionStartTime,sensor_task.last_runtime_utc,functionRunTime,sensor_task.flow_control_increments,x_host.host,'14'))
-    IOLoop.current().call_at(sensor_task.getNextSensorCallTime(current_function_runtime=functionRunTime), _cb_xeng_network, sensors, x_host, sensor_manager,sensor_task)
-
 
 @gen.coroutine
 def _cb_xeng_rx_spead(sensors, x_host, sensor_manager,sensor_task):
@@ -181,17 +107,20 @@ def _cb_xeng_rx_spead(sensors, x_host, sensor_manager,sensor_task):
             sensor.set(status=Corr2Sensor.FAILURE,
                        value=Corr2Sensor.SENSOR_TYPES[Corr2Sensor.SENSOR_TYPE_LOOKUP[sensor.type]][1])
 
-    functionStartTime = time.time();
-    #print("15 on %s Started at %f" % (x_host.host ,functionStartTime))
     # SPEAD RX
     status = Corr2Sensor.NOMINAL
     value = 'ok'
     try:
-        results = x_host.get_unpack_status()
-        sensors['err_cnt'].set(
-            value=results['time_err_cnt'],
-            errif='changed')
-        sensors['cnt'].set(value=results['valid_pkt_cnt'], warnif='notchanged')
+        snapshot = yield host_snapshot(sensor_manager, x_host,
+                                       sensors['device_status'].executor)
+        results = snapshot['unpack']
+        counters = sensor_manager.counters.group(
+            (x_host.host, 'spead-rx'), SPEAD_RX_COUNTERS,
+            rules=SPEAD_RX_COUNTER_RULES)
+        values, _, _, statuses = counters.update(
+            results, timestamp=snapshot.timestamp)
+        set_counter_sensors([sensors['err_cnt'], sensors['cnt']],
+                            counters, values, statuses)
         if sensors['err_cnt'].status() == Corr2Sensor.ERROR:
             status = Corr2Sensor.ERROR
             value = 'fail'
@@ -206,10 +135,6 @@ def _cb_xeng_rx_spead(sensors, x_host, sensor_manager,sensor_task):
 
     sensor_manager.logger.debug('_cb_xeng_rx_spead ran')
 
-    functionRunTime = time.time() - functionStartTime;
-    #print("%.4f %.4f %f %i %s %s" % (functionStartTime,sensor_task.last_runtime_utc,functionRunTime,sensor_task.flow_control_increments,x_host.host,'15'))
-    IOLoop.current().call_at(sensor_task.getNextSensorCallTime(current_function_runtime=functionRunTime), _cb_xeng_rx_spead, sensors, x_host, sensor_manager,sensor_task)
-
 
 @gen.coroutine
 def _cb_xeng_hmc_reorder(sensors, x_host, sensor_manager,sensor_task):
@@ -223,11 +148,10 @@ def _cb_xeng_hmc_reorder(sensors, x_host, sensor_manager,sensor_task):
             sensor.set(status=Corr2Sensor.FAILURE,
                        value=Corr2Sensor.SENSOR_TYPES[Corr2Sensor.SENSOR_TYPE_LOOKUP[sensor.type]][1])
 
-    functionStartTime = time.time(); 
-    #print("16 on %s Started at %f" % (x_host.host ,functionStartTime))       
-
+    executor = sensors['device_status'].executor
     try:
-        results = x_host.get_hmc_reorder_status()
+        snapshot = yield host_snapshot(sensor_manager, x_host, executor)
+        results = snapshot['hmc_reorder']
         device_status = Corr2Sensor.NOMINAL
         sens_val = 'ok'
         sensors['miss_err_cnt'].set(value=results['miss_err_cnt'], warnif='changed')
@@ -246,7 +170,9 @@ def _cb_xeng_hmc_reorder(sensors, x_host, sensor_manager,sensor_task):
 
         if device_status == Corr2Sensor.ERROR:
             x_host.logger.error("HMC Reorder error: %s"%str(results))
-            x_host.logger.error("HMC Reorder HMC status: %s"%str(x_host.hmcs.hmc_pkt_reord_hmc.get_hmc_status()))
+            hmc_status = yield host_call(
+                executor, x_host.hmcs.hmc_pkt_reord_hmc.get_hmc_status)
+            x_host.logger.error("HMC Reorder HMC status: %s"%str(hmc_status))
 
         sensors['device_status'].set(
             value=sens_val,
@@ -259,15 +185,6 @@ def _cb_xeng_hmc_reorder(sensors, x_host, sensor_manager,sensor_task):
 
     sensor_manager.logger.debug('_cb_xeng_hmc_reorder ran')
 
-    functionRunTime = time.time() - functionStartTime;
-    #print("16 on %s Ended End Time %f, Run Time %f" % (x_host.host,time.time(), functionRunTime))
-    #print("%.4f %.4f %f %i %s %s" % (functionStartTime,sensor_task.last_runtime_utc,functionRunTime,sensor_task.flow_control_increments,x_host.host,'16'))
-    IOLoop.current().call_at(
-        sensor_task.getNextSensorCallTime(current_function_runtime=functionRunTime),
-        _cb_xeng_hmc_reorder,
-        sensors,
-        x_host, sensor_manager,sensor_task)
-
 
 @gen.coroutine
 def _cb_xeng_missing_ants(sensors, sensor_top, x_host, sensor_manager,sensor_task):
@@ -282,18 +199,22 @@ def _cb_xeng_missing_ants(sensors, sensor_top, x_host, sensor_manager,sensor_tas
                        value=Corr2Sensor.SENSOR_TYPES[Corr2Sensor.SENSOR_TYPE_LOOKUP[sensor.type]][1])
         sensor_top.set(status=Corr2Sensor.FAILURE, value='fail')
 
-    functionStartTime = time.time();
-    #print("17 on %s Started at %f" % (x_host.host ,functionStartTime))
-
     status = Corr2Sensor.NOMINAL
     value = 'ok'
     try:
-        results = x_host.get_missing_ant_counts()
-        for n_ant, missing in enumerate(results):
-            sensors[n_ant].set(value=missing, warnif='changed')
-            if sensors[n_ant].status() == Corr2Sensor.WARN:
-                status = Corr2Sensor.WARN
-                value = 'degraded'
+        snapshot = yield host_snapshot(sensor_manager, x_host,
+                                       sensor_top.executor)
+        results = snapshot['missing_ants']
+        names = ['ant{}'.format(n_ant) for n_ant in range(len(results))]
+        counters = sensor_manager.counters.group(
+            (x_host.host, 'missing-ants'), names,
+            rules={name: ('changed', Corr2Sensor.WARN) for name in names})
+        values, _, _, statuses = counters.update(
+            results, timestamp=snapshot.timestamp)
+        if set_counter_sensors(sensors, counters, values, statuses) == \
+                Corr2Sensor.WARN:
+            status = Corr2Sensor.WARN
+            value = 'degraded'
         sensor_top.set(status=status, value=value)
     except Exception as e:
         sensor_manager.logger.error('Error updating RX reorder sensors for {} - '
@@ -302,16 +223,6 @@ def _cb_xeng_missing_ants(sensors, sensor_top, x_host, sensor_manager,sensor_tas
 
     sensor_manager.logger.debug('_cb_xeng_missing_ants ran')
 
-    functionRunTime = time.time() - functionStartTime;
-    #print("17 on %s Ended End Time %f, Run Time %f" % (x_host.host,time.time(), functionRunTime))
-    #print("%.4f %.4f %f %i %s %s" % (functionStartTime,sensor_task.last_runtime_utc,functionRunTime,sensor_task.flow_control_increments,x_host.host,'17'))
-    IOLoop.current().call_at(
-        sensor_task.getNextSensorCallTime(current_function_runtime=functionRunTime),
-        _cb_xeng_missing_ants,
-        sensors,
-        sensor_top,
-        x_host, sensor_manager,sensor_task)
-
 
 @gen.coroutine
 def _cb_xeng_rx_reorder(sensors, x_host, sensor_manager,sensor_task):
@@ -321,11 +232,10 @@ def _cb_xeng_rx_reorder(sensors, x_host, sensor_manager,sensor_task):
     :return:
     """
 
-    functionStartTime = time.time();
-    #print("18 on %s Started at %f" % (x_host.host ,functionStartTime))
-
     try:
-        rv = x_host.get_rx_reorder_status()
+        snapshot = yield host_snapshot(sensor_manager, x_host,
+                                       sensors[0]['err_cnt'].executor)
+        rv = snapshot['rx_reorder']
         is_ok=True
         for n_xengcore, sensordict in enumerate(sensors):
             sens_val = 'ok'
@@ -355,11 +265,6 @@ def _cb_xeng_rx_reorder(sensors, x_host, sensor_manager,sensor_task):
 
     sensor_manager.logger.debug('_cb_xeng_rx_reorder ran')
 
-    functionRunTime = time.time() - functionStartTime;
-    #print("18 on %s Ended End Time %f, Run Time %f" % (x_host.host,time.time(), functionRunTime))
-    #print("%.4f %.4f %f %i %s %s" % (functionStartTime,sensor_task.last_runtime_utc,functionRunTime,sensor_task.flow_control_increments,x_host.host,'18'))
-    IOLoop.current().call_at(sensor_task.getNextSensorCallTime(current_function_runtime=functionRunTime), _cb_xeng_rx_reorder, sensors, x_host, sensor_manager,sensor_task)
-
 
 @gen.coroutine
 def _cb_xeng_vacc(sensors_value, sensor_manager,sensor_task):
@@ -391,16 +296,18 @@ def _cb_xeng_vacc(sensors_value, sensor_manager,sensor_task):
                     sensordict['device_status'].set(
                         status=Corr2Sensor.FAILURE, value='fail')
 
-    functionStartTime = time.time();
-    #print("19 on all at %f" % (functionStartTime))
-
     instrument = sensors_value['synchronised'].manager.instrument
+    executor = sensors_value['synchronised'].executor
+
+    def read_hw():
+        return (instrument.xops.vaccs_synchronised(),
+                instrument.xops.get_vacc_status())
+
     try:
-        synced = instrument.xops.vaccs_synchronised()
+        synced, rv = yield host_call(executor, read_hw)
         status = Corr2Sensor.NOMINAL if synced else Corr2Sensor.ERROR
         sensors_value['synchronised'].set(value=synced, status=status)
-        
-        rv = instrument.xops.get_vacc_status()
+
         for _x in rv:
             if _x != 'synchronised':
                 for xctr, sensordict in enumerate(sensors_value[_x]):
@@ -428,9 +335,13 @@ def _cb_xeng_vacc(sensors_value, sensor_manager,sensor_task):
                         # faulty_host.logger.error('VACC%i error status: %s'%(xctr,str(sensors_value[_x][xctr])))
                         faulty_host.logger.error('VACC%i error status: %s'%(xctr, sensor_values_str))
                         if (xctr < 2):
-                            faulty_host.logger.error('VACC HMC0 error status: %s'%(str(faulty_host.hmcs.sys0_vacc_hmc_vacc_hmc.get_hmc_status())))
+                            hmc_status = yield host_call(
+                                executor, faulty_host.hmcs.sys0_vacc_hmc_vacc_hmc.get_hmc_status)
+                            faulty_host.logger.error('VACC HMC0 error status: %s'%(str(hmc_status)))
                         else:
-                            faulty_host.logger.error('VACC HMC1 error status: %s'%(str(faulty_host.hmcs.sys2_vacc_hmc_vacc_hmc.get_hmc_status())))
+                            hmc_status = yield host_call(
+                                executor, faulty_host.hmcs.sys2_vacc_hmc_vacc_hmc.get_hmc_status)
+                            faulty_host.logger.error('VACC HMC1 error status: %s'%(str(hmc_status)))
                     else:
                         status = Corr2Sensor.NOMINAL
                         value = 'ok'
@@ -442,11 +353,6 @@ def _cb_xeng_vacc(sensors_value, sensor_manager,sensor_task):
 
     sensor_manager.logger.debug('_cb_xeng_vacc ran')
 
-    functionRunTime = time.time() - functionStartTime;
-    #print("19 on %s Ended, Run Time %f" % (time.time(), functionRunTime))
-    #print("%.4f %.4f %f %i %s" % (functionStartTime,sensor_task.last_runtime_utc,functionRunTime,sensor_task.flow_control_increments,'19'))
-    IOLoop.current().call_at(sensor_task.getNextSensorCallTime(current_function_runtime=functionRunTime), _cb_xeng_vacc, sensors_value, sensor_manager,sensor_task)
-
 
 @gen.coroutine
 def _cb_xeng_pack(sensors, x_host, sensor_manager,sensor_task):
@@ -462,10 +368,10 @@ def _cb_xeng_pack(sensors, x_host, sensor_manager,sensor_task):
                 sensor.set(status=Corr2Sensor.FAILURE,
                            value=Corr2Sensor.SENSOR_TYPES[Corr2Sensor.SENSOR_TYPE_LOOKUP[sensor.type]][1])
 
-    functionStartTime = time.time();
-    #print("20 on %s Started at %f" % (x_host.host ,functionStartTime))
     try:
-        rv = x_host.get_pack_status()
+        snapshot = yield host_snapshot(sensor_manager, x_host,
+                                       sensors[0]['err_cnt'].executor)
+        rv = snapshot['pack']
         is_ok=True
         for n_xengcore, sensordict in enumerate(sensors):
             accum_errors = rv[n_xengcore]['align_err_cnt'] + rv[n_xengcore]['overflow_err_cnt'] 
@@ -485,14 +391,9 @@ def _cb_xeng_pack(sensors, x_host, sensor_manager,sensor_task):
 
     sensor_manager.logger.debug('_cb_xeng_pack ran')
 
-    functionRunTime = time.time() - functionStartTime;
-    #print("20 on %s Ended End Time %f, Run Time %f" % (x_host.host,time.time(), functionRunTime))
-    #print("%.4f %.4f %f %i %s %s" % (functionStartTime,sensor_task.last_runtime_utc,functionRunTime,sensor_task.flow_control_increments,x_host.host,'20'))
-    IOLoop.current().call_at(sensor_task.getNextSensorCallTime(current_function_runtime=functionRunTime), _cb_xeng_pack, sensors, x_host, sensor_manager,sensor_task)
-
 
 def setup_sensors_xengine(sens_man, general_executor, host_executors, ioloop,
-                          host_offset_dict):
+                          host_offset_dict, scheduler):
     """
     Set up the X-engine specific sensors.
     :param sens_man:
@@ -500,6 +401,7 @@ def setup_sensors_xengine(sens_man, general_executor, host_executors, ioloop,
     :param host_executors:
     :param ioloop:
     :param host_offset_dict:
+    :param scheduler: the SensorScheduler to run the callbacks on
     :return:
     """
     global host_offset_lookup
@@ -535,8 +437,8 @@ def setup_sensors_xengine(sens_man, general_executor, host_executors, ioloop,
                 Corr2Sensor.integer, '{}.rx-err-cnt'.format(pref),
                 'RX network error count (bad packets received)', executor=executor),
         }
-        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_xeng_network',_x.host))
-        ioloop.add_callback(_cb_xeng_network, network_sensors, _x, sens_man,sensor_task)
+        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_xeng_network',_x.host), host=_x.host)
+        scheduler.add_task(sensor_task, _cb_xeng_network, network_sensors, _x, sens_man,sensor_task)
 
     # SPEAD counters
 
@@ -557,12 +459,12 @@ def setup_sensors_xengine(sens_man, general_executor, host_executors, ioloop,
                 'X-engine RX SPEAD packet error counter.',
                 executor=executor),
         }
-        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_xeng_rx_spead',_x.host))
-        ioloop.add_callback(_cb_xeng_rx_spead, sensors, _x, sens_man,sensor_task)
-
+        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_xeng_rx_spead',_x.host), host=_x.host)
+        scheduler.add_task(sensor_task, _cb_xeng_rx_spead, sensors, _x, sens_man,sensor_task)
 
     # HMC reorders
     for _x in sens_man.instrument.xhosts:
+        executor = host_executors[_x.host]
         xhost = host_offset_lookup[_x.host]
         pref = '{xhost}.network-reorder'.format(xhost=xhost)
         sensors = {
@@ -577,8 +479,8 @@ def setup_sensors_xengine(sens_man, general_executor, host_executors, ioloop,
                 Corr2Sensor.integer, '{}.miss-err-cnt'.format(pref),
                 'X-engine missing F-engine packet count; data filled with zeros.', executor=executor),
         }
-        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_xeng_hmc_reorder',_x.host))
-        ioloop.add_callback(_cb_xeng_hmc_reorder, sensors, _x, sens_man,sensor_task)
+        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_xeng_hmc_reorder',_x.host), host=_x.host)
+        scheduler.add_task(sensor_task, _cb_xeng_hmc_reorder, sensors, _x, sens_man,sensor_task)
 
     # missing antennas
 
@@ -593,8 +495,8 @@ def setup_sensors_xengine(sens_man, general_executor, host_executors, ioloop,
             sensors.append(sens_man.do_sensor(
                 Corr2Sensor.integer, '{}.missing-pkts.fhost{:02}-cnt'.format(xhost, ant),
                 'Missing packet count for antenna %i.' % ant, executor=executor))
-        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_xeng_missing_ants',_x.host))
-        ioloop.add_callback(_cb_xeng_missing_ants, sensors, sensor_top, _x, sens_man,sensor_task)
+        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_xeng_missing_ants',_x.host), host=_x.host)
+        scheduler.add_task(sensor_task, _cb_xeng_missing_ants, sensors, sensor_top, _x, sens_man,sensor_task)
 
     # BRAM reorders
 
@@ -613,9 +515,8 @@ def setup_sensors_xengine(sens_man, general_executor, host_executors, ioloop,
                 Corr2Sensor.integer, '{pref}.err-cnt'.format(pref=pref),
                 'BRAM packet reorder errors.', executor=executor)
             sensors.append(sensordict)
-        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_xeng_rx_reorder',_x.host))
-        ioloop.add_callback(_cb_xeng_rx_reorder, sensors, _x, sens_man,sensor_task)
-
+        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_xeng_rx_reorder',_x.host), host=_x.host)
+        scheduler.add_task(sensor_task, _cb_xeng_rx_reorder, sensors, _x, sens_man,sensor_task)
 
     # VACC
     sensors_value = {}
@@ -652,8 +553,8 @@ def setup_sensors_xengine(sens_man, general_executor, host_executors, ioloop,
                 Corr2Sensor.integer, '{pref}.timestamp'.format(pref=pref),
                 'Current VACC timestamp.')
             sensors_value[_x.host].append(sensordict)
-    sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_xeng_vacc',_x.host))
-    ioloop.add_callback(_cb_xeng_vacc, sensors_value, sens_man,sensor_task)
+    sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_xeng_vacc','all boards'))
+    scheduler.add_task(sensor_task, _cb_xeng_vacc, sensors_value, sens_man,sensor_task)
 
     # Xeng Packetiser block
 
@@ -677,24 +578,30 @@ def setup_sensors_xengine(sens_man, general_executor, host_executors, ioloop,
                     executor=executor)
                 }
             sensors.append(sensordict)
-        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_xeng_pack',_x.host))
-        ioloop.add_callback(_cb_xeng_pack, sensors, _x, sens_man,sensor_task)
-
+        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_xeng_pack',_x.host), host=_x.host)
+        scheduler.add_task(sensor_task, _cb_xeng_pack, sensors, _x, sens_man,sensor_task)
 
         # LRU ok
         sensor = sens_man.do_sensor(
             Corr2Sensor.device_status, '{}.device-status'.format(xhost),
             'X-engine %s LRU ok' % _x.host, executor=executor)
-        sensors=[]
+        children = []
         for xctr in range(_x.x_per_fpga):
             pref = '{xhost}.xeng{xctr}'.format(xhost=xhost, xctr=xctr)
             xeng_sensor = sens_man.do_sensor(
                 Corr2Sensor.device_status,
                 '{}.device-status'.format(pref),
                 'X-engine core status')
-            sensors.append(xeng_sensor)
-        sensor_task = sensor_scheduler.SensorTask('{0: <25} on {1: >15}'.format('_cb_xhost_lru',_x.host))
-        ioloop.add_callback(_cb_xhost_lru, sens_man, sensor, sensors, _x,sensor_task)
-
+            sens_man.aggregator.add(xeng_sensor, [
+                ('{}.vacc.device-status'.format(pref), ERROR_AND_WARN),
+                ('{}.bram-reorder.device-status'.format(pref), ERROR_AND_WARN),
+                ('{}.spead-tx.device-status'.format(pref), ERROR_AND_WARN),
+            ])
+            children.append((xeng_sensor.name, ERROR_AND_WARN))
+        sens_man.aggregator.add(sensor, children + [
+            ('{}.network.device-status'.format(xhost), ERROR_AND_WARN),
+            ('{}.network-reorder.device-status'.format(xhost), ERROR_AND_WARN),
+            ('{}.spead-rx.device-status'.format(xhost), ERROR_AND_WARN),
+        ])
 
 # end
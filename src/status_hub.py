@@ -0,0 +1,270 @@
+import os
+import json
+import time
+import socket
+import struct
+import logging
+import threading
+import SocketServer
+
+from status_snapshot import StatusSnapshot
+
+LOGGER = logging.getLogger(__name__)
+
+# every message is JSON, preceded by its length. Not pickle - the hub
+# must not run code sent by whoever connects to its socket.
+_HEADER = struct.Struct('!I')
+# largest message accepted
+_MAX_MESSAGE = 16 * 1024 * 1024
+
+
+def _jsonable(value):
+    """
+    json.dumps default: numpy scalars and arrays from register reads.
+    """
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError('{!r} is not JSON serialisable'.format(value))
+
+
+def _send(sock, obj):
+    data = json.dumps(obj, default=_jsonable)
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise EOFError('Status hub connection closed.')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
+
+def _recv(sock):
+    size = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))[0]
+    if size > _MAX_MESSAGE:
+        raise EOFError('Status hub message of {} bytes is too big.'.format(
+            size))
+    return json.loads(_recv_exactly(sock, size))
+
+
+def snapshot_to_dict(snapshot):
+    """
+    A snapshot as plain JSON types. Read errors are sent as their type
+    and message.
+    """
+    return {
+        'host': snapshot.host, 'timestamp': snapshot.timestamp,
+        'read_time': snapshot.read_time,
+        'sections': snapshot._sections,
+        'errors': {section: '{}: {}'.format(type(error).__name__, error)
+                   for section, error in snapshot._errors.items()},
+    }
+
+
+def snapshot_from_dict(value):
+    """
+    Rebuild a snapshot sent by snapshot_to_dict. Read errors come back as
+    RuntimeErrors with the original type and message.
+    """
+    return StatusSnapshot(
+        value['host'], value['timestamp'], value['read_time'],
+        value['sections'],
+        {section: RuntimeError(error)
+         for section, error in value['errors'].items()})
+
+
+class _HubRequestHandler(SocketServer.BaseRequestHandler):
+    """
+    Serve requests from one client connection until it closes.
+    """
+    def handle(self):
+        hub = self.server.hub
+        while True:
+            try:
+                request = _recv(self.request)
+            except (EOFError, ValueError):
+                return
+            try:
+                _send(self.request, ['ok', hub.handle(*request)])
+            except Exception as e:
+                _send(self.request, ['fail', '{}: {}'.format(
+                    type(e).__name__, e)])
+
+
+class _UnixServer(SocketServer.ThreadingMixIn,
+                  SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class StatusHub(object):
+    """
+    Owns the hardware status reads for an instrument and serves the
+    snapshots to other processes over a Unix socket, so that the corr2
+    servlet's monitoring loop and the sensor servlet share one set of
+    register reads per cycle.
+    """
+    def __init__(self, cache, hosts, socket_path, logger=None):
+        """
+        :param cache: the StatusSnapshotCache that does the reads
+        :param hosts: the hosts to serve, FpgaFHosts and FpgaXHosts
+        :param socket_path: the Unix socket to listen on
+        :param logger:
+        :return:
+        """
+        self.cache = cache
+        self.hosts = {host.host: host for host in hosts}
+        self.socket_path = socket_path
+        self.logger = logger or LOGGER
+        self.requests = 0
+        self._server = None
+        self._thread = None
+
+    def handle(self, command, hostname=None, max_age_s=None):
+        """
+        Handle one client request.
+        :param command: 'get' or 'invalidate'
+        :param hostname: the host the request is for
+        :param max_age_s: the client's freshness bound, for 'get'
+        :return: a snapshot_to_dict dict for 'get', else None
+        """
+        self.requests += 1
+        if command == 'get':
+            if hostname not in self.hosts:
+                raise KeyError('Unknown host {}'.format(hostname))
+            return snapshot_to_dict(
+                self.cache.get(self.hosts[hostname], max_age_s))
+        elif command == 'invalidate':
+            self.cache.invalidate(self.hosts.get(hostname))
+            return None
+        raise ValueError('Unknown status hub command {}'.format(command))
+
+    def start(self):
+        """
+        Start serving, in a background thread. Only the hub's own user
+        can connect to the socket.
+        :return:
+        """
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        umask = os.umask(0o077)
+        try:
+            self._server = _UnixServer(self.socket_path, _HubRequestHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(self.socket_path, 0o600)
+        self._server.hub = self
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='status-hub')
+        self._thread.daemon = True
+        self._thread.start()
+        self.logger.info('Status hub serving {} hosts on {}'.format(
+            len(self.hosts), self.socket_path))
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class StatusHubClient(object):
+    """
+    A stand-in for StatusSnapshotCache that gets its snapshots from a
+    StatusHub. If the hub cannot be reached, the reads are done locally
+    with the fallback cache instead.
+    """
+    def __init__(self, socket_path, fallback=None, timeout=10.0,
+                 retry_s=10.0, logger=None):
+        """
+        :param socket_path: the hub's Unix socket
+        :param fallback: a StatusSnapshotCache to use if the hub is down
+        :param timeout: socket timeout, seconds
+        :param retry_s: after failing to reach the hub, use the fallback
+        for this long before trying the hub again
+        :param logger:
+        :return:
+        """
+        self.socket_path = socket_path
+        self.fallback = fallback
+        self.timeout = timeout
+        self.retry_s = retry_s
+        self.logger = logger or LOGGER
+        self._retry_at = 0
+        self.max_age_s = getattr(fallback, 'max_age_s', 1.0)
+        self.hub_gets = 0
+        self.fallback_gets = 0
+        # the sensor executors call in from many threads
+        self._local = threading.local()
+
+    def _connection(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, 'sock', None)
+        self._local.sock = None
+        if sock is not None:
+            try:
+                sock.close()
+            except socket.error:
+                pass
+
+    def _request(self, *request):
+        try:
+            sock = self._connection()
+            _send(sock, request)
+            result, value = _recv(sock)
+        except (socket.error, EOFError, struct.error, ValueError) as e:
+            self._close()
+            raise IOError('Status hub {} unavailable - {}'.format(
+                self.socket_path, e))
+        if result != 'ok':
+            raise RuntimeError('Status hub request failed - {}'.format(value))
+        return value
+
+    def get(self, host, max_age_s=None, sections=None):
+        """
+        Get a snapshot for a host, from the hub if possible.
+        :param host: an FpgaFHost or FpgaXHost
+        :param max_age_s: freshness bound, defaults to the fallback's
+        :param sections: the sections needed, for reads done locally. The
+        hub always reads every section, to share them between clients.
+        :return: a StatusSnapshot
+        """
+        max_age_s = self.max_age_s if max_age_s is None else max_age_s
+        if self.fallback is None or time.time() >= self._retry_at:
+            try:
+                snapshot = snapshot_from_dict(
+                    self._request('get', host.host, max_age_s))
+                self.hub_gets += 1
+                return snapshot
+            except IOError as e:
+                if self.fallback is None:
+                    raise
+                self._retry_at = time.time() + self.retry_s
+                self.logger.warning('{} - reading directly for the next '
+                                    '{}s.'.format(e, self.retry_s))
+        self.fallback_gets += 1
+        return self.fallback.get(host, max_age_s, sections)
+
+    def invalidate(self, host=None):
+        if self.fallback is not None:
+            self.fallback.invalidate(host)
+        try:
+            self._request('invalidate', getattr(host, 'host', None))
+        except IOError as e:
+            self.logger.warning(str(e))
+
+# end
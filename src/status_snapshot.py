@@ -0,0 +1,229 @@
+import time
+import logging
+import threading
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _read_tl_cd(host):
+    """
+    Read the coarse delay timed-latch load counters.
+    """
+    return {
+        'tl_cd0_load_count':
+            host.registers.tl_cd0_status.read()['data']['load_count'],
+        'tl_cd1_load_count':
+            host.registers.tl_cd1_status.read()['data']['load_count'],
+    }
+
+
+# the status sections read in one batch, per host type
+FHOST_SECTIONS = [
+    ('tl_cd', _read_tl_cd),
+    ('cd', lambda host: host.get_cd_status()),
+    ('ct', lambda host: host.get_ct_status()),
+    ('pfb', lambda host: host.get_pfb_status()),
+    ('adc', lambda host: host.get_adc_status()),
+    ('quant', lambda host: host.get_quant_status()),
+    ('sync', lambda host: host.get_sync_status()),
+    ('unpack', lambda host: host.get_unpack_status()),
+    ('rx_reorder', lambda host: host.get_rx_reorder_status()),
+    ('pack', lambda host: host.get_pack_status()),
+]
+
+XHOST_SECTIONS = [
+    ('unpack', lambda host: host.get_unpack_status()),
+    ('hmc_reorder', lambda host: host.get_hmc_reorder_status()),
+    ('rx_reorder', lambda host: host.get_rx_reorder_status()),
+    ('missing_ants', lambda host: host.get_missing_ant_counts()),
+    ('pack', lambda host: host.get_pack_status()),
+    ('vacc', lambda host: host.get_vacc_status()),
+]
+
+
+class FrozenDict(dict):
+    def __readonly__(self, *args, **kwargs):
+        raise RuntimeError(
+            'Cannot modify a status snapshot: {}, {}'.format(args, kwargs))
+    __setitem__ = __readonly__
+    __delitem__ = __readonly__
+    pop = __readonly__
+    popitem = __readonly__
+    clear = __readonly__
+    update = __readonly__
+    setdefault = __readonly__
+    del __readonly__
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class StatusSnapshot(object):
+    """
+    An immutable, timestamped set of status register readings from one
+    host, all taken in the same batch.
+    """
+    __slots__ = ['host', 'timestamp', 'read_time', '_sections', '_errors']
+
+    def __init__(self, host, timestamp, read_time, sections, errors):
+        object.__setattr__(self, 'host', host)
+        object.__setattr__(self, 'timestamp', timestamp)
+        object.__setattr__(self, 'read_time', read_time)
+        object.__setattr__(self, '_sections', _freeze(sections))
+        object.__setattr__(self, '_errors', dict(errors))
+
+    def __setattr__(self, key, value):
+        raise RuntimeError('Cannot modify a status snapshot.')
+
+    def age(self):
+        return time.time() - self.timestamp
+
+    def sections(self):
+        return self._sections.keys() + self._errors.keys()
+
+    def covers(self, sections):
+        """
+        :param sections: section names
+        :return: True if this snapshot has a reading, or a read error,
+        for each of the sections
+        """
+        return all(section in self._sections or section in self._errors
+                   for section in sections)
+
+    def __contains__(self, section):
+        return section in self._sections
+
+    def __getitem__(self, section):
+        """
+        Get a section of the snapshot. If that section failed to read,
+        the exception it raised is raised again here, so callers handle
+        it just as if they had done the read themselves.
+        :param section: the section name, e.g. 'cd'
+        :return: a read-only dict (or tuple, for per-engine sections)
+        """
+        if section in self._errors:
+            raise self._errors[section]
+        return self._sections[section]
+
+    def __repr__(self):
+        return '<StatusSnapshot {} @ {:.3f}>'.format(self.host, self.timestamp)
+
+
+class StatusSnapshotCache(object):
+    """
+    Shares status register reads between everything that polls a host.
+    The first caller in a poll cycle reads every section for that host in
+    one batch, or just the sections it asks for; later callers get the
+    same snapshot until it is older than their freshness bound. A caller
+    that needs sections the snapshot lacks reads just those and adds
+    them to it.
+    """
+    def __init__(self, max_age_s=1.0, logger=None):
+        """
+        :param max_age_s: default freshness bound, in seconds
+        :param logger:
+        :return:
+        """
+        self.max_age_s = max_age_s
+        self.logger = logger or LOGGER
+        self.reads = 0
+        self.hits = 0
+        self._snapshots = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _sections_for(host):
+        if getattr(host, 'host_type', None) == 'fhost':
+            return FHOST_SECTIONS
+        return XHOST_SECTIONS
+
+    def _host_lock(self, hostname):
+        with self._lock:
+            if hostname not in self._locks:
+                self._locks[hostname] = threading.Lock()
+            return self._locks[hostname]
+
+    def get(self, host, max_age_s=None, sections=None):
+        """
+        Get a snapshot for a host no older than max_age_s, reading the
+        hardware only if needed. Blocking - call it from the host's
+        executor, not the IOLoop.
+        :param host: an FpgaFHost or FpgaXHost
+        :param max_age_s: freshness bound, defaults to the cache's
+        :param sections: the section names needed, None for all of them.
+        If they have to be read, only these are. Sections missing from a
+        fresh cached snapshot are read and added to it.
+        :return: a StatusSnapshot
+        """
+        max_age_s = self.max_age_s if max_age_s is None else max_age_s
+        if sections is None:
+            needed = [name for name, _ in self._sections_for(host)]
+        else:
+            needed = sections
+        # concurrent callers for the same host wait for one read
+        with self._host_lock(host.host):
+            snapshot = self._snapshots.get(host.host)
+            if snapshot is None or snapshot.age() > max_age_s:
+                return self.refresh(host, sections)
+            missing = [name for name in needed
+                       if not snapshot.covers([name])]
+            if not missing:
+                self.hits += 1
+                return snapshot
+            return self.refresh(host, missing, base=snapshot)
+
+    def refresh(self, host, sections=None, base=None):
+        """
+        Read the status sections for a host into a new snapshot.
+        :param host:
+        :param sections: the section names to read, None for all of them
+        :param base: a snapshot of the same host to add the readings to,
+        rather than replace. The result keeps its timestamp, so its age
+        is that of its oldest reading.
+        :return: a StatusSnapshot
+        """
+        start = time.time()
+        readings = dict(base._sections) if base is not None else {}
+        errors = dict(base._errors) if base is not None else {}
+        for name, reader in self._sections_for(host):
+            if sections is not None and name not in sections:
+                continue
+            try:
+                readings[name] = reader(host)
+                errors.pop(name, None)
+            except Exception as e:
+                errors[name] = e
+                readings.pop(name, None)
+        read_time = time.time() - start
+        if base is not None:
+            snapshot = StatusSnapshot(host.host, base.timestamp,
+                                      base.read_time + read_time,
+                                      readings, errors)
+        else:
+            snapshot = StatusSnapshot(host.host, start, read_time,
+                                      readings, errors)
+        self._snapshots[host.host] = snapshot
+        self.reads += 1
+        if errors:
+            self.logger.debug('{}: status snapshot could not read {}.'.format(
+                host.host, ', '.join(errors.keys())))
+        return snapshot
+
+    def invalidate(self, host=None):
+        """
+        Drop cached snapshots, e.g. after reconfiguring or clearing counters.
+        :param host: the host to drop, or None for all of them
+        :return:
+        """
+        if host is None:
+            self._snapshots = {}
+        else:
+            self._snapshots.pop(host.host, None)
+
+# end
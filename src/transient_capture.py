@@ -0,0 +1,155 @@
+"""
+Write transient buffer (ADC snapshot) captures to HDF5, one input at a
+time as the reads finish, instead of holding every input in memory.
+
+File layout:
+
+    /                   attrs: trigger_mcnt, trigger_time, created
+    /adc/<input name>   int8/int16 samples, chunked and optionally
+                        compressed. attrs: timestamp (the snapshot's
+                        48-bit trigger time), host, offset, input_number
+
+Captures requested over katcp go in one directory, transient_capture_dir
+in the [FxCorrelator] section of the config - see capture_path.
+"""
+import os
+import time
+import uuid
+import logging
+import tempfile
+import threading
+
+import numpy
+
+import lazy_import
+h5py = lazy_import.lazy_module('h5py')
+
+LOGGER = logging.getLogger(__name__)
+
+# samples per HDF5 chunk
+CHUNK_SAMPLES = 16384
+
+# where captures go if the config does not say
+DEFAULT_CAPTURE_DIR = os.path.join(tempfile.gettempdir(),
+                                   'corr2_transient_buffers')
+
+
+def capture_path(capture_dir, filename=''):
+    """
+    Work out where a capture file goes. The file must be in capture_dir
+    and must not exist yet.
+    :param capture_dir: the capture directory, made if it does not exist
+    :param filename: a plain file name, or '' for a new unique name
+    :return: the absolute path of the file
+    :raises ValueError: if the name has a path in it, or the file exists
+    """
+    if filename == '':
+        filename = 'transient_buffer_{}_{}.h5'.format(
+            time.strftime('%Y%m%d-%H%M%S'), uuid.uuid4().hex[:8])
+    elif os.sep in filename or (os.altsep and os.altsep in filename) or \
+            filename in (os.curdir, os.pardir):
+        raise ValueError('Capture file name {} must not include a '
+                         'directory.'.format(filename))
+    capture_dir = os.path.abspath(capture_dir)
+    if not os.path.isdir(capture_dir):
+        os.makedirs(capture_dir)
+    path = os.path.join(capture_dir, filename)
+    if os.path.exists(path):
+        raise ValueError('Capture file {} already exists.'.format(path))
+    return path
+
+
+class TransientCaptureWriter(object):
+    """
+    Streams ADC snapshots into a chunked HDF5 file and keeps summary
+    statistics per input. Safe to call from several reader threads, the
+    writes are serialised.
+    """
+    def __init__(self, filename, compression='gzip',
+                 chunk_samples=CHUNK_SAMPLES, logger=None):
+        """
+        :param filename: the HDF5 file to create, which must not exist
+        :param compression: an h5py compression filter, or None
+        :param chunk_samples: samples per chunk
+        :param logger:
+        :return:
+        """
+        self.filename = os.path.abspath(filename)
+        self.compression = compression or None
+        self.chunk_samples = chunk_samples
+        self.logger = logger or LOGGER
+        # input name -> summary stats
+        self.stats = {}
+        self.bytes_written = 0
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._h5 = h5py.File(self.filename, mode='w-')
+        self._h5.attrs['created'] = self.started
+        self._group = self._h5.create_group('adc')
+
+    def set_trigger(self, trigger_mcnt=None, trigger_time=None):
+        """
+        Record the requested trigger time of the capture.
+        """
+        with self._lock:
+            if trigger_mcnt is not None:
+                self._h5.attrs['trigger_mcnt'] = trigger_mcnt
+            if trigger_time is not None:
+                self._h5.attrs['trigger_time'] = trigger_time
+
+    def write_input(self, name, adc_data, **attrs):
+        """
+        Write one input's snapshot and note its stats.
+        :param name: the input name
+        :param adc_data: an fhost_fpga.AdcData
+        :param attrs: extra attributes for the dataset, e.g. host
+        :return: the input's stats
+        """
+        samples = numpy.asarray(adc_data.data)
+        stats = {
+            'timestamp': adc_data.timestamp,
+            'samples': len(samples),
+            'min': samples.min().item() if len(samples) else 0,
+            'max': samples.max().item() if len(samples) else 0,
+            'rms': float(numpy.sqrt(numpy.mean(
+                numpy.square(samples, dtype=numpy.float64))))
+            if len(samples) else 0.0,
+        }
+        with self._lock:
+            dset = self._group.create_dataset(
+                name, data=samples,
+                chunks=(min(self.chunk_samples, len(samples)),)
+                if len(samples) else None,
+                compression=self.compression)
+            dset.attrs['timestamp'] = adc_data.timestamp
+            for key, value in attrs.items():
+                dset.attrs[key] = value
+            self._h5.flush()
+            self.bytes_written += samples.nbytes
+            self.stats[name] = stats
+        return stats
+
+    def close(self):
+        with self._lock:
+            if self._h5 is not None:
+                self._h5.close()
+                self._h5 = None
+
+    def summary(self):
+        """
+        :return: a dict of the capture's totals
+        """
+        with self._lock:
+            timestamps = [stats['timestamp'] for stats in self.stats.values()]
+            return {
+                'filename': self.filename,
+                'inputs': len(self.stats),
+                'samples': sum(stats['samples']
+                               for stats in self.stats.values()),
+                'bytes': self.bytes_written,
+                'seconds': time.time() - self.started,
+                'timestamp_spread': max(timestamps) - min(timestamps)
+                if timestamps else 0,
+            }
+
+# end
@@ -0,0 +1,65 @@
+"""
+Test the counter engine's deltas, rates and statuses, in particular
+across a counter wrap.
+"""
+import unittest
+
+from katcp import Sensor
+
+from corr2.counter_engine import CounterEngine
+
+
+class TestCounterEngine(unittest.TestCase):
+    def setUp(self):
+        self.engine = CounterEngine()
+
+    def test_first_sample_is_unchanged(self):
+        group = self.engine.group(('host1', 'network'), ['err', 'pkt'],
+                                  rules={'err': ('changed', Sensor.ERROR)})
+        values, deltas, rates, statuses = group.update([5, 100], 10.0)
+        self.assertEqual(values, [5, 100])
+        self.assertEqual(deltas, [0, 0])
+        self.assertEqual(statuses, [Sensor.NOMINAL, Sensor.NOMINAL])
+
+    def test_32bit_wrap(self):
+        group = self.engine.group(('host1', 'spead-rx'), ['err', 'pkt'],
+                                  rules={'err': ('changed', Sensor.WARN),
+                                         'pkt': ('notchanged', Sensor.WARN)})
+        group.update({'err': 7, 'pkt': 2 ** 32 - 10}, 10.0)
+        values, deltas, rates, statuses = group.update(
+            {'err': 7, 'pkt': 20}, 12.0)
+        # pkt wrapped past 2**32: 10 counts to the wrap and 20 after it
+        self.assertEqual(deltas, [0, 30])
+        self.assertEqual(rates, [0.0, 15.0])
+        self.assertEqual(statuses, [Sensor.NOMINAL, Sensor.NOMINAL])
+        _, deltas, _, statuses = group.update({'err': 8, 'pkt': 20}, 13.0)
+        self.assertEqual(deltas, [1, 0])
+        self.assertEqual(statuses, [Sensor.WARN, Sensor.WARN])
+
+    def test_48bit_wrap_and_forget(self):
+        group = self.engine.group('wide', ['cnt'], bits=48)
+        group.update([2 ** 48 - 1], 1.0)
+        _, deltas, _, _ = group.update([0], 2.0)
+        self.assertEqual(deltas, [1])
+        self.engine.forget()
+        _, deltas, _, _ = group.update([1000], 3.0)
+        self.assertEqual(deltas, [0])
+
+    def test_same_timestamp_not_resampled(self):
+        group = self.engine.group(('host1', 'spead-rx'), ['pkt'],
+                                  rules={'pkt': ('notchanged', Sensor.WARN)})
+        group.update([100], 10.0)
+        first = group.update([150], 11.0)
+        # a cached snapshot read again does not look like a stalled counter
+        again = group.update([150], 11.0)
+        self.assertEqual(again, first)
+        self.assertEqual(again[1], [50])
+        self.assertEqual(again[3], [Sensor.NOMINAL])
+        _, deltas, rates, _ = group.update([170], 12.0)
+        self.assertEqual(deltas, [20])
+        self.assertEqual(rates, [20.0])
+
+if __name__ == '__main__':
+    unittest.main()
+
+# end
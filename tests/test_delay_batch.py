@@ -0,0 +1,87 @@
+"""
+Check DelayBatch's vectorised fixed-point conversion against the old
+per-input path: delay.prepare_delay_vals followed by the register
+arithmetic fhost_fpga used to do one input at a time.
+"""
+import unittest
+
+from corr2 import delay as delayops
+from corr2.delay import DelayBatch
+
+SAMPLE_RATE_HZ = 1712e6
+BITSHIFT = 2 ** 23
+REG_BP = 31
+MAX_POSITIVE = 1 - 1 / float(2 ** REG_BP)
+MAX_NEGATIVE = -1 + 1 / float(2 ** REG_BP)
+
+DELAYS = [
+    '0,0:0,0',
+    '1.5e-6,2e-12:0.5,1e-3',
+    '-2.25e-7,-3e-12:-1.2,-4e-2',
+    # delay rate, phase and phase rate past the register ranges
+    '3e-6,1e-6:4.0,1e9',
+    '1e-9,-1e-6:-4.0,-1e9',
+]
+
+
+def old_words(delay):
+    """
+    The register values the old per-input code wrote for a Delay.
+    """
+    delay_whole = int(delay.delay)
+    delay_frac = int((delay.delay - delay_whole) * 2 ** 32)
+    delay_delta = float(delay.delay_delta) * BITSHIFT
+    delay_delta = min(max(delay_delta, -1.0), MAX_POSITIVE)
+    delay_delta_word = int(delay_delta * 2 ** REG_BP)
+    phase = min(max(delay.phase_offset, MAX_NEGATIVE), MAX_POSITIVE)
+    phase_delta = float(delay.phase_offset_delta) * BITSHIFT
+    phase_delta = min(max(phase_delta, MAX_NEGATIVE), MAX_POSITIVE)
+    return {
+        'delay_whole': delay_whole, 'delay_frac': delay_frac,
+        'delay_delta': delay_delta_word,
+        'phase': phase, 'phase_delta': phase_delta,
+        'act_delay_delta':
+            float(delay_delta_word) / 2 ** REG_BP / BITSHIFT,
+        'act_phase': float(int(phase * 2 ** REG_BP)) / 2 ** REG_BP,
+        'act_phase_delta':
+            float(int(phase_delta * 2 ** REG_BP)) / 2 ** REG_BP / BITSHIFT,
+    }
+
+
+class TestDelayBatch(unittest.TestCase):
+    def test_matches_old_path(self):
+        batch = DelayBatch.from_list(DELAYS, SAMPLE_RATE_HZ, load_mcnt=1234)
+        old = delayops.process_list(DELAYS, SAMPLE_RATE_HZ)
+        self.assertEqual(len(batch), len(old))
+        self.assertEqual(batch.load_mcnt, 1234)
+        for ctr, delay in enumerate(old):
+            words = batch.words(ctr)
+            expected = old_words(delay)
+            for field, value in expected.items():
+                self.assertEqual(getattr(words, field), value,
+                                 'input {} {}: {} != {}'.format(
+                                     ctr, field, getattr(words, field),
+                                     value))
+
+    def test_from_delays(self):
+        old = delayops.process_list(DELAYS, SAMPLE_RATE_HZ)
+        batch = DelayBatch.from_delays(old)
+        direct = DelayBatch.from_list(DELAYS, SAMPLE_RATE_HZ)
+        for ctr in range(len(old)):
+            self.assertEqual(batch.words(ctr), direct.words(ctr))
+
+    def test_saturation(self):
+        batch = DelayBatch.from_list(DELAYS, SAMPLE_RATE_HZ)
+        self.assertEqual(batch.saturated_inputs(), [3, 4])
+        self.assertEqual(batch.words(3).saturated,
+                         ('delay_delta', 'phase', 'phase_delta'))
+        self.assertEqual(batch.words(1).saturated, ())
+
+    def test_bad_delay(self):
+        self.assertRaises(ValueError, DelayBatch.from_list,
+                          ['0,0:0,0', '0,0:nonsense'], SAMPLE_RATE_HZ)
+
+if __name__ == '__main__':
+    unittest.main()
+
+# end
@@ -0,0 +1,126 @@
+"""
+Test the delay queue's choice of models to arm: load mcnt order, waiting
+for a busy latch, earlier models overriding an armed one, dropping models
+that are too late, and newer models replacing ones for the same mcnt.
+"""
+import unittest
+
+from corr2.delay_queue import DelayQueue, StagedDelay
+
+
+class FakeHost(object):
+    def __init__(self, host):
+        self.host = host
+
+
+class FakeFengine(object):
+    def __init__(self, input_number, host):
+        self.input_number = input_number
+        self.name = 'ant%i' % input_number
+        self.host = host
+        self.offset = input_number % 2
+
+
+class FakeFops(object):
+    def __init__(self, n_inputs=2):
+        host = FakeHost('fhost00')
+        self.fengines = [FakeFengine(ctr, host) for ctr in range(n_inputs)]
+        self.hosts = [host]
+
+
+class FakeBatch(object):
+    def __init__(self, load_mcnt, words):
+        self.load_mcnt = load_mcnt
+        self._words = words
+
+    def __len__(self):
+        return len(self._words)
+
+    def saturated_inputs(self):
+        return []
+
+    def words(self, index):
+        return self._words[index]
+
+
+class TestDelayQueue(unittest.TestCase):
+    NOW = 1000.0
+
+    def setUp(self):
+        self.queue = DelayQueue(FakeFops(n_inputs=1), arm_lead_s=0.05,
+                                load_margin_s=0.05)
+        self.seq = 0
+
+    def _pend(self, load_mcnt, load_time, input_number=0):
+        self.seq += 1
+        staged = StagedDelay(load_mcnt, load_time, self.seq, 'w%i' % load_mcnt)
+        self.queue._pending.setdefault(input_number, []).append(staged)
+        self.queue._pending[input_number].sort()
+        return staged
+
+    def _due_mcnts(self, now):
+        due, wake = self.queue._due(now)
+        return [staged.load_mcnt for _, staged in due], wake
+
+    def test_load_order(self):
+        for load_mcnt in [300, 100, 200]:
+            self._pend(load_mcnt, self.NOW + load_mcnt / 100.0)
+        due, wake = self.queue._due(self.NOW)
+        self.assertEqual([staged.load_mcnt for _, staged in due], [100])
+        self.assertIsNone(wake)
+        self.queue._armed[0] = due[0][1]
+        # the latch is busy until mcnt 100 has loaded
+        mcnts, wake = self._due_mcnts(self.NOW + 0.5)
+        self.assertEqual(mcnts, [])
+        self.assertAlmostEqual(wake, self.NOW + 1.05)
+        mcnts, _ = self._due_mcnts(self.NOW + 1.06)
+        self.assertEqual(mcnts, [200])
+
+    def test_earlier_model_overrides(self):
+        armed = StagedDelay(500, self.NOW + 5.0, 0, 'w500')
+        self.queue._armed[0] = armed
+        self._pend(400, self.NOW + 4.0)
+        mcnts, _ = self._due_mcnts(self.NOW)
+        self.assertEqual(mcnts, [400])
+        # the overridden model goes back in the queue
+        self.assertEqual(self.queue.pending(), {0: [500]})
+
+    def test_too_late_dropped(self):
+        self._pend(100, self.NOW + 0.01)
+        self._pend(200, self.NOW + 2.0)
+        mcnts, _ = self._due_mcnts(self.NOW)
+        self.assertEqual(mcnts, [200])
+        self.assertEqual(self.queue.dropped, 1)
+        self.assertEqual(self.queue.pending(), {})
+
+    def test_newer_model_replaces_same_mcnt(self):
+        queue = DelayQueue(FakeFops(n_inputs=2))
+        queue._stage(FakeBatch(100, ['a0', 'a1']), self.NOW + 1.0)
+        queue._stage(FakeBatch(200, ['b0', 'b1']), self.NOW + 2.0)
+        queue._stage(FakeBatch(100, ['c0', 'c1']), self.NOW + 1.0)
+        self.assertEqual(queue.pending(), {0: [100, 200], 1: [100, 200]})
+        due, _ = queue._due(self.NOW)
+        self.assertEqual(sorted(staged.words for _, staged in due),
+                         ['c0', 'c1'])
+
+    def test_single_input(self):
+        queue = DelayQueue(FakeFops(n_inputs=2))
+        queue._stage(FakeBatch(100, ['a0', 'a1']), self.NOW + 1.0)
+        queue._stage(FakeBatch(100, ['b1']), self.NOW + 1.0, input_number=1)
+        queue._stage(FakeBatch(200, ['c1']), self.NOW + 2.0, input_number=1)
+        self.assertEqual(queue.pending(), {0: [100], 1: [100, 200]})
+        due, _ = queue._due(self.NOW)
+        self.assertEqual(sorted(staged.words for _, staged in due),
+                         ['a0', 'b1'])
+
+    def test_wrong_input_count(self):
+        self.assertRaises(ValueError, self.queue._stage,
+                          FakeBatch(100, ['a0', 'a1']), self.NOW + 1.0)
+        self.assertRaises(ValueError, self.queue._stage,
+                          FakeBatch(100, ['a0', 'a1']), self.NOW + 1.0,
+                          input_number=0)
+
+if __name__ == '__main__':
+    unittest.main()
+
+# end
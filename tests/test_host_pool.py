@@ -0,0 +1,110 @@
+"""
+Test the host pool: one operation at a time per host in submission
+order, different hosts in parallel, timeouts cancelling operations that
+have not started, and urgent operations going ahead of queued ones.
+"""
+import time
+import threading
+import unittest
+
+from corr2.host_pool import HostPool, HostPoolError, HostTimeout
+
+
+class FakeHost(object):
+    def __init__(self, host):
+        self.host = host
+
+
+class TestHostPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = HostPool(max_workers=4, urgent_workers=2)
+        self.host1 = FakeHost('host1')
+        self.host2 = FakeHost('host2')
+        self.lock = threading.Lock()
+        self.running = {}
+        self.overlap = []
+        self.log = []
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def _op(self, host, name, seconds=0.02):
+        with self.lock:
+            self.running[host.host] = self.running.get(host.host, 0) + 1
+            self.overlap.append(dict(self.running))
+            self.log.append((host.host, name, 'start'))
+        time.sleep(seconds)
+        with self.lock:
+            self.running[host.host] -= 1
+            self.log.append((host.host, name, 'end'))
+        return name
+
+    def test_per_host_serialisation(self):
+        futures = [self.pool.submit(host, self._op, '{}{}'.format(
+            host.host, ctr)) for ctr in range(4)
+            for host in [self.host1, self.host2]]
+        results = [future.result(timeout=5) for future in futures]
+        self.assertEqual(len(results), 8)
+        # never two operations at once on a host
+        self.assertTrue(all(count <= 1 for counts in self.overlap
+                            for count in counts.values()))
+        # the two hosts did run at the same time
+        self.assertIn({'host1': 1, 'host2': 1}, self.overlap)
+        # and each host's operations ran in submission order
+        for host in ['host1', 'host2']:
+            started = [name for hostname, name, event in self.log
+                       if hostname == host and event == 'start']
+            self.assertEqual(started, ['{}{}'.format(host, ctr)
+                                       for ctr in range(4)])
+
+    def test_map_hosts(self):
+        results = self.pool.map_hosts(self._op, [self.host1, self.host2],
+                                      args=('op',))
+        self.assertEqual(results, {'host1': 'op', 'host2': 'op'})
+
+    def test_timeout_cancels_queued(self):
+        release = threading.Event()
+        ran = []
+        blocker = self.pool.submit(self.host1, lambda host: release.wait(5))
+        try:
+            with self.assertRaises(HostPoolError) as ctx:
+                self.pool.map_hosts(lambda host: ran.append(host.host),
+                                    [self.host1, self.host2], timeout=0.2)
+        finally:
+            release.set()
+        error = ctx.exception
+        self.assertEqual(error.results, {'host2': None})
+        self.assertIsInstance(error.errors['host1'], HostTimeout)
+        blocker.result(timeout=5)
+        # host1's timed out operation was cancelled, not run late
+        after = self.pool.submit(self.host1, lambda host: 'after')
+        self.assertEqual(after.result(timeout=5), 'after')
+        self.assertEqual(ran, ['host2'])
+
+    def test_failure_kept_per_host(self):
+        def fail_on_host1(host):
+            if host.host == 'host1':
+                raise IOError('no reply')
+            return 'ok'
+        with self.assertRaises(HostPoolError) as ctx:
+            self.pool.map_hosts(fail_on_host1, [self.host1, self.host2])
+        self.assertEqual(ctx.exception.results, {'host2': 'ok'})
+        self.assertIsInstance(ctx.exception.errors['host1'], IOError)
+
+    def test_urgent_goes_first(self):
+        release = threading.Event()
+        order = []
+        self.pool.submit(self.host1, lambda host: release.wait(5))
+        queued = self.pool.submit(self.host1,
+                                  lambda host: order.append('queued'))
+        urgent = self.pool.submit_urgent(self.host1,
+                                         lambda host: order.append('urgent'))
+        release.set()
+        queued.result(timeout=5)
+        urgent.result(timeout=5)
+        self.assertEqual(order, ['urgent', 'queued'])
+
+if __name__ == '__main__':
+    unittest.main()
+
+# end
@@ -0,0 +1,47 @@
+"""
+Round-trip arrays through pack_array and unpack_array.
+"""
+import unittest
+
+import numpy
+
+from corr2.packed_array import pack_array, unpack_array
+
+
+class TestPackedArray(unittest.TestCase):
+    ARRAYS = [
+        (numpy.arange(4096) % 256 - 128).astype(numpy.int8),
+        (numpy.arange(1024) + 1j * numpy.arange(1024)[::-1]).astype(
+            numpy.complex64),
+        numpy.arange(64 * 8, dtype='>u4').reshape(64, 8),
+        numpy.array(3.5),
+    ]
+
+    def test_round_trip(self):
+        for encoding in ['b64', 'raw']:
+            for array in self.ARRAYS:
+                args = pack_array(array, timestamp=1234.5, encoding=encoding)
+                self.assertEqual(len(args), 5)
+                self.assertTrue(all(isinstance(arg, str) for arg in args))
+                unpacked, timestamp = unpack_array(args)
+                self.assertEqual(timestamp, 1234.5)
+                self.assertEqual(unpacked.shape, array.shape)
+                self.assertEqual(unpacked.dtype,
+                                 array.dtype.newbyteorder('<'))
+                self.assertTrue(numpy.array_equal(unpacked, array))
+
+    def test_list_and_no_timestamp(self):
+        unpacked, timestamp = unpack_array(pack_array([1.0, -2.0, 3.0]))
+        self.assertIsNone(timestamp)
+        self.assertEqual(unpacked.tolist(), [1.0, -2.0, 3.0])
+
+    def test_bad_encoding(self):
+        self.assertRaises(ValueError, pack_array, [1, 2], encoding='hex')
+        args = pack_array([1, 2])
+        self.assertRaises(ValueError, unpack_array, ['hex'] + args[1:])
+        self.assertRaises(ValueError, unpack_array, args[:4])
+
+if __name__ == '__main__':
+    unittest.main()
+
+# end
@@ -0,0 +1,41 @@
+"""
+Test the decimation of sensor histories: values are held from one reading
+to the next, so steady sensors fill their buckets and means are weighted
+by how long each value was held.
+"""
+import unittest
+
+import numpy as np
+
+from corr2.sensor_history import SensorHistory
+
+
+class TestSensorHistory(unittest.TestCase):
+    def setUp(self):
+        self.history = SensorHistory(16)
+
+    def test_value_held_into_empty_buckets(self):
+        self.history.append(100.0, 1.0)
+        self.history.append(105.0, 3.0)
+        self.assertEqual(self.history.decimate(100.0, 120.0, 4), [
+            (100.0, 1.0, 1.0, 1.0, 1), (105.0, 3.0, 3.0, 3.0, 1),
+            (110.0, 3.0, 3.0, 3.0, 0), (115.0, 3.0, 3.0, 3.0, 0)])
+
+    def test_time_weighted_mean(self):
+        self.history.append(100.0, 0.0)
+        self.history.append(101.0, 10.0)
+        self.history.append(102.0, 0.0)
+        self.assertEqual(self.history.decimate(100.0, 110.0, 1),
+                         [(100.0, 0.0, 10.0, 1.0, 3)])
+
+    def test_gaps_and_before_first_reading(self):
+        self.history.append(100.0, 1.0)
+        self.history.append(102.0, np.nan)
+        self.history.append(106.0, 2.0)
+        self.assertEqual(self.history.decimate(90.0, 110.0, 4), [
+            (100.0, 1.0, 1.0, 1.0, 1), (105.0, 2.0, 2.0, 2.0, 1)])
+
+if __name__ == '__main__':
+    unittest.main()
+
+# end
@@ -0,0 +1,124 @@
+"""
+Test the sensor scheduler's deadline order, global calls/s budget and
+per-host limit, on a fake IOLoop with a manual clock.
+"""
+import unittest
+
+from corr2 import sensor_scheduler
+from corr2.sensor_scheduler import SensorScheduler, SensorTask
+
+
+class FakeIOLoop(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.timeouts = []
+
+    def time(self):
+        return self.now
+
+    def call_at(self, when, callback):
+        timeout = [when, callback]
+        self.timeouts.append(timeout)
+        return timeout
+
+    def remove_timeout(self, timeout):
+        if timeout in self.timeouts:
+            self.timeouts.remove(timeout)
+
+    def add_future(self, future, callback):
+        future.callbacks.append(callback)
+
+    def run_until(self, until):
+        while self.timeouts:
+            timeout = min(self.timeouts, key=lambda timeout_: timeout_[0])
+            if timeout[0] > until:
+                break
+            self.timeouts.remove(timeout)
+            self.now = max(self.now, timeout[0])
+            timeout[1]()
+        self.now = until
+
+
+class FakeFuture(object):
+    def __init__(self):
+        self.callbacks = []
+
+    def add_done_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def exception(self):
+        return None
+
+    def resolve(self):
+        for callback in self.callbacks:
+            callback(self)
+
+
+class TestSensorScheduler(unittest.TestCase):
+    def setUp(self):
+        self.ioloop = FakeIOLoop()
+        self.calls = []
+        # no random first-call phases or jitter
+        self._uniform = sensor_scheduler.random.uniform
+        sensor_scheduler.random.uniform = lambda low, high: 0
+
+    def tearDown(self):
+        sensor_scheduler.random.uniform = self._uniform
+
+    def _call(self, name):
+        self.calls.append((name, self.ioloop.now))
+
+    def test_deadline_order(self):
+        scheduler = SensorScheduler(ioloop=self.ioloop, jitter_fraction=0)
+        for name, offset in [('c', 3.0), ('a', 1.0), ('b', 2.0)]:
+            scheduler.add_task(SensorTask(name, period_s=10.0,
+                                          offset_s=offset),
+                               self._call, name)
+        scheduler.start()
+        self.ioloop.run_until(self.ioloop.now + 5)
+        self.assertEqual([name for name, _ in self.calls], ['a', 'b', 'c'])
+
+    def test_token_bucket(self):
+        scheduler = SensorScheduler(ioloop=self.ioloop, max_calls_per_s=2,
+                                    jitter_fraction=0)
+        for ctr in range(6):
+            scheduler.add_task(SensorTask('t%i' % ctr, period_s=100.0),
+                               self._call, 't%i' % ctr)
+        start = self.ioloop.now
+        scheduler.start()
+        self.ioloop.run_until(start + 2.01)
+        # two tokens to start with, then two a second
+        self.assertEqual(len(self.calls), 6)
+        self.assertLessEqual(len([1 for _, when in self.calls
+                                  if when - start < 1.0]), 3)
+
+    def test_host_parking(self):
+        scheduler = SensorScheduler(ioloop=self.ioloop,
+                                    max_concurrent_per_host=1,
+                                    jitter_fraction=0)
+        futures = []
+
+        def slow(name):
+            self._call(name)
+            future = FakeFuture()
+            futures.append(future)
+            return future
+        scheduler.add_task(SensorTask('a', host='host1', period_s=100.0),
+                           slow, 'a')
+        scheduler.add_task(SensorTask('b', host='host1', period_s=100.0),
+                           slow, 'b')
+        scheduler.add_task(SensorTask('c', host='host2', period_s=100.0),
+                           slow, 'c')
+        scheduler.start()
+        self.ioloop.run_until(self.ioloop.now + 1)
+        # one of host1's tasks waits for the other, host2 is not held up
+        self.assertEqual(sorted(name for name, _ in self.calls), ['a', 'c'])
+        futures[0].resolve()
+        self.ioloop.run_until(self.ioloop.now + 1)
+        self.assertEqual(sorted(name for name, _ in self.calls),
+                         ['a', 'b', 'c'])
+
+if __name__ == '__main__':
+    unittest.main()
+
+# end
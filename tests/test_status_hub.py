@@ -0,0 +1,90 @@
+"""
+Test the status hub against a fake host: snapshots served over the
+socket, the client's fallback to local reads when the hub is down, and
+its retry_s back-off before trying the hub again.
+"""
+import os
+import stat
+import time
+import shutil
+import tempfile
+import unittest
+
+from corr2.status_hub import StatusHub, StatusHubClient
+from corr2.status_snapshot import StatusSnapshotCache
+
+
+class FakeXHost(object):
+    host_type = 'xhost'
+
+    def __init__(self, host):
+        self.host = host
+        self.reads = 0
+
+    def get_unpack_status(self):
+        self.reads += 1
+        return {'rx_err_cnt': 3, 'per_engine': [{'ok': True}, {'ok': False}]}
+
+    def get_vacc_status(self):
+        raise IOError('vacc register read timed out')
+
+    def __getattr__(self, name):
+        if name.startswith('get_'):
+            return lambda: {'ok': True}
+        raise AttributeError(name)
+
+
+class TestStatusHub(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmpdir, 'hub.sock')
+        self.host = FakeXHost('xhost01')
+        self.hub = StatusHub(StatusSnapshotCache(max_age_s=10.0),
+                             [self.host], self.socket_path)
+
+    def tearDown(self):
+        self.hub.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_served_snapshot(self):
+        self.hub.start()
+        mode = stat.S_IMODE(os.stat(self.socket_path).st_mode)
+        self.assertEqual(mode, 0o600)
+        client = StatusHubClient(self.socket_path)
+        snapshot = client.get(self.host)
+        self.assertEqual(snapshot.host, 'xhost01')
+        self.assertEqual(snapshot['unpack']['rx_err_cnt'], 3)
+        self.assertEqual(snapshot['unpack']['per_engine'][1]['ok'], False)
+        # read errors come back as exceptions with the original message
+        with self.assertRaises(RuntimeError) as ctx:
+            snapshot['vacc']
+        self.assertIn('vacc register read timed out', str(ctx.exception))
+        # a second client shares the hub's read
+        StatusHubClient(self.socket_path).get(self.host)
+        self.assertEqual(self.host.reads, 1)
+        self.assertEqual(client.hub_gets, 1)
+
+    def test_fallback_and_retry(self):
+        fallback = StatusSnapshotCache(max_age_s=0)
+        client = StatusHubClient(self.socket_path, fallback=fallback,
+                                 retry_s=0.2)
+        # hub not running: read locally
+        snapshot = client.get(self.host, sections=['unpack'])
+        self.assertEqual(snapshot['unpack']['rx_err_cnt'], 3)
+        self.assertEqual((client.hub_gets, client.fallback_gets), (0, 1))
+        # within retry_s the hub is not tried, even once it is up
+        self.hub.start()
+        client.get(self.host)
+        self.assertEqual((client.hub_gets, client.fallback_gets), (0, 2))
+        time.sleep(0.25)
+        client.get(self.host)
+        self.assertEqual((client.hub_gets, client.fallback_gets), (1, 2))
+
+    def test_client_without_fallback(self):
+        client = StatusHubClient(self.socket_path)
+        self.assertRaises(IOError, client.get, self.host)
+
+if __name__ == '__main__':
+    unittest.main()
+
+# end
@@ -0,0 +1,76 @@
+"""
+Test the status snapshot cache's partial reads: sections missing from a
+fresh snapshot are added to it rather than replacing it.
+"""
+import unittest
+
+from corr2.status_snapshot import StatusSnapshotCache
+
+
+class FakeXHost(object):
+    host_type = 'xhost'
+
+    def __init__(self, host):
+        self.host = host
+        self.reads = {}
+
+    def _read(self, name):
+        self.reads[name] = self.reads.get(name, 0) + 1
+        return {'reads': self.reads[name]}
+
+    def get_vacc_status(self):
+        return self._read('vacc')
+
+    def get_hmc_reorder_status(self):
+        return self._read('hmc_reorder')
+
+    def get_rx_reorder_status(self):
+        return self._read('rx_reorder')
+
+    def __getattr__(self, name):
+        if name.startswith('get_'):
+            return lambda: self._read(name[4:])
+        raise AttributeError(name)
+
+
+class TestStatusSnapshotCache(unittest.TestCase):
+    def setUp(self):
+        self.host = FakeXHost('xhost01')
+        self.cache = StatusSnapshotCache(max_age_s=10.0)
+
+    def test_partial_reads_merge(self):
+        full = self.cache.get(self.host)
+        self.assertEqual(self.host.reads['vacc'], 1)
+        # a fresh full snapshot covers a partial request
+        partial = self.cache.get(self.host, sections=['vacc', 'hmc_reorder'])
+        self.assertIs(partial, full)
+        self.cache.invalidate(self.host)
+        self.cache.get(self.host, sections=['vacc'])
+        # the missing sections are read and added, vacc is not read again
+        snapshot = self.cache.get(self.host,
+                                  sections=['vacc', 'hmc_reorder'])
+        self.assertEqual(self.host.reads['vacc'], 2)
+        self.assertEqual(self.host.reads['hmc_reorder'], 2)
+        self.assertTrue(snapshot.covers(['vacc', 'hmc_reorder']))
+        self.assertEqual(self.host.reads['rx_reorder'], 1)
+        # and a full request then only reads what is still missing
+        self.cache.get(self.host)
+        self.assertEqual(self.host.reads['vacc'], 2)
+        self.assertEqual(self.host.reads['rx_reorder'], 2)
+
+    def test_no_sections(self):
+        self.cache.get(self.host)
+        snapshot = self.cache.get(self.host, sections=[])
+        self.assertTrue(snapshot.covers(['vacc', 'rx_reorder']))
+        self.assertEqual(self.host.reads['vacc'], 1)
+
+    def test_stale_snapshot_replaced(self):
+        self.cache.get(self.host)
+        snapshot = self.cache.get(self.host, max_age_s=-1, sections=['vacc'])
+        self.assertEqual(snapshot.sections(), ['vacc'])
+        self.assertEqual(self.host.reads['vacc'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
+
+# end